@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+import os
+
+import plac
+
+from learning2write import VALID_PATTERN_SETS
+from learning2write.evaluation import evaluate_model, merge_results, summarise
+from learning2write.inference import NumpyPolicy
+
+
+@plac.annotations(
+    model_path=plac.Annotation('The path and the filename of the saved model to evaluate. This can also be a policy '
+                               'exported with `python -m learning2write.inference`, which runs without TensorFlow.',
+                               type=str, kind='positional'),
+    model_type=plac.Annotation('The type of model that is being loaded. Not needed for exported policies.',
+                               choices=['acktr', 'acer', 'ppo'], type=str, kind='positional'),
+    pattern_sets=plac.Annotation('Comma separated list of the pattern sets to evaluate the model on, out of %s.'
+                                 % ', '.join(sorted(VALID_PATTERN_SETS)), kind='option', type=str),
+    rotate_patterns=plac.Annotation('Flag indicating that patterns should be randomly rotated.', kind='flag'),
+    flip_patterns=plac.Annotation('Flag indicating that patterns should be randomly flipped.', kind='flag'),
+    n_episodes=plac.Annotation('How many episodes to run per pattern set.', type=int, kind='option'),
+    n_envs=plac.Annotation('How many environments each worker should run at once.', type=int, kind='option'),
+    n_workers=plac.Annotation('How many worker processes to spread the episodes across.', type=int, kind='option'),
+    seed=plac.Annotation('The seed for choosing patterns. Worker `i` is seeded with `seed + i`, and reads its own part '
+                         'of the images of the EMNIST pattern sets.', type=int, kind='option'),
+    deterministic=plac.Annotation('Flag indicating that the model should choose the most likely actions instead of '
+                                  'sampling them.', kind='flag'),
+    output_path=plac.Annotation('Where to save the results as JSON. By default the results are only printed.',
+                                type=str, kind='option')
+)
+def main(model_path, model_type=None, pattern_sets='3x3', rotate_patterns=False, flip_patterns=False, n_episodes=1000,
+         n_envs=32, n_workers=4, seed=0, deterministic=False, output_path=None):
+    """Evaluate a model in the writing environment without rendering, running many episodes in parallel."""
+    if model_path.endswith('.npz'):
+        model_class = NumpyPolicy
+    elif model_type is None:
+        raise ValueError('The model type is needed to load \'%s\'' % model_path)
+    else:
+        # Only import TensorFlow (through train.py) if it is needed, in this process and in the workers.
+        from train import get_model_type
+
+        model_class = get_model_type(model_type)
+    summaries = {}
+
+    # TensorFlow does not cope with being forked, so the workers are started fresh.
+    with multiprocessing.get_context('spawn').Pool(n_workers) as pool:
+        for pattern_set in pattern_sets.split(','):
+            if pattern_set not in VALID_PATTERN_SETS:
+                raise ValueError('Unrecognised pattern set \'%s\'' % pattern_set)
+
+            # Split the episodes as evenly as possible between the workers.
+            worker_episodes = [n_episodes // n_workers + (1 if i < n_episodes % n_workers else 0)
+                               for i in range(n_workers)]
+            tasks = [(model_class, model_path, pattern_set, n, n_envs, seed + i, deterministic, rotate_patterns,
+                      flip_patterns, i, n_workers)
+                     for i, n in enumerate(worker_episodes) if n > 0]
+            summary = summarise(merge_results(pool.starmap(evaluate_model, tasks)))
+            summaries[pattern_set] = summary
+
+            print('%s - Episodes: %d - Accuracy: %.4f - Mean F1: %.4f - Return: %.2f (std. %.2f) - '
+                  'Episode Length: %.2f (median %d)'
+                  % (pattern_set, summary['n_episodes'], summary['accuracy'], summary['f1'],
+                     summary['return']['mean'], summary['return']['std'], summary['length']['mean'],
+                     summary['length']['p50']))
+
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+        with open(output_path, 'w') as file:
+            json.dump({'model_path': model_path, 'model_type': model_type, 'rotate_patterns': rotate_patterns,
+                       'flip_patterns': flip_patterns, 'deterministic': deterministic, 'seed': seed,
+                       'results': summaries}, file, indent=2)
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,257 @@
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import plac
+
+from learning2write.checkpoints import read_index
+
+# The defaults of the train.py options that the cost of a run depends on.
+DEFAULT_N_WORKERS = 4
+DEFAULT_VEC_ENV_TYPE = 'subproc'
+# Where train.py writes the TensorBoard logs of the runs.
+TENSORBOARD_LOG_PATH = 'tensorboard'
+
+
+class Run(NamedTuple):
+    """A training run of an experiment."""
+    name: str
+    args: dict
+    steps: int
+    seed: int
+    # How many CPUs the run uses.
+    cost: int
+
+
+def expand_spec(spec: dict) -> List[Run]:
+    """Expand an experiment spec into the training runs that it describes.
+
+    A spec is a dictionary with the following keys:
+        - 'runs': A list of dictionaries of train.py options, e.g. `{"model_type": "acer", "pattern_set": "3x3"}`.
+                  An option whose value is a list is swept over, i.e. there is a run for each value (and for each
+                  combination of values if several options are lists).
+        - 'args': The options that every run shares, e.g. `{"rotate_patterns": true}`. Optional.
+        - 'steps': How many steps to train each run for. A run can override this with its own 'steps'.
+        - 'seeds': The seeds to train each run with. Optional, defaults to a single seed of zero.
+
+    :param spec: The experiment spec.
+    :return: The runs, one for each combination of a run's options and seed.
+    """
+    runs = []
+    shared_args = spec.get('args', {})
+
+    for run_spec in spec['runs']:
+        keys = list(run_spec)
+        values = [value if isinstance(value, list) else [value] for value in run_spec.values()]
+
+        for combination in itertools.product(*values):
+            run_args = dict(zip(keys, combination))
+            args = dict(shared_args, **run_args)
+            steps = args.pop('steps', spec['steps'])
+
+            if args.get('checkpoint_frequency', 1) < 1:
+                raise ValueError('Runs must save checkpoints so that they can be resumed')
+
+            # A batched run steps its environments in the training process, a subproc run has a process per worker.
+            if args.get('n_workers') == 'auto':
+                # The run chooses its own workers and may use every CPU.
+                cost = os.cpu_count() + 1
+            elif args.get('vec_env_type', DEFAULT_VEC_ENV_TYPE) == 'subproc':
+                cost = args.get('n_workers', DEFAULT_N_WORKERS) + 1
+            else:
+                cost = 1
+
+            for seed in spec.get('seeds', [0]):
+                name = '_'.join([get_name_part(key, value) for key, value in run_args.items() if key != 'steps'] +
+                                ['seed%d' % seed])
+                runs.append(Run(name, args, steps, seed, cost))
+
+    names = [run.name for run in runs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+
+    if duplicates:
+        raise ValueError('Runs must have unique names, got duplicates: %s' % ', '.join(duplicates))
+
+    return runs
+
+
+def get_name_part(key: str, value) -> str:
+    """Get the part of a run's name for one of its options, e.g. 'acer' for the model type or 'n_workers-8'."""
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, bool):
+        return key if value else 'no_%s' % key
+    else:
+        return '%s-%s' % (key, value)
+
+
+def get_command(run: Run, checkpoint_path: str, model_path: Optional[str] = None,
+                steps: Optional[int] = None) -> List[str]:
+    """Get the command that trains a run.
+
+    :param run: The run.
+    :param checkpoint_path: The directory to save the run's checkpoints to.
+    :param model_path: The checkpoint to resume training from, if any.
+    :param steps: How many steps to train for. Defaults to the run's steps.
+    :return: The command, as a list of arguments.
+    """
+    command = [sys.executable, 'train.py']
+
+    for key, value in run.args.items():
+        if value is True:
+            command.append('-%s' % key.replace('_', '-'))
+        elif value is not False and value is not None:
+            command += ['-%s' % key.replace('_', '-'), str(value)]
+
+    command += ['-steps', str(steps if steps is not None else run.steps), '-seed', str(run.seed),
+                '-checkpoint-path', checkpoint_path]
+
+    if model_path:
+        command += ['-model-path', model_path]
+
+    return command
+
+
+def start_run(run: Run, checkpoint_root: str, log_path: str) -> Optional[subprocess.Popen]:
+    """Start training a run in a new process, resuming from its latest checkpoint if it has one.
+
+    :param run: The run.
+    :param checkpoint_root: The directory that holds the checkpoint directory of every run.
+    :param log_path: The directory to write the log of every run to.
+    :return: The training process, or None if the run is already complete.
+    """
+    checkpoint_path = os.path.join(checkpoint_root, run.name)
+    checkpoints = read_index(checkpoint_path)
+
+    if checkpoints and checkpoints[-1].timesteps is not None:
+        latest = checkpoints[-1]
+        model_path, steps = latest.path, run.steps - latest.timesteps
+
+        if steps <= 0:
+            print('[%s] \'%s\' has already been trained for %d steps.' % (datetime.now(), run.name, latest.timesteps))
+
+            return None
+
+        print('[%s] Resuming \'%s\' from \'%s\' (%d steps left).' % (datetime.now(), run.name, model_path, steps))
+    else:
+        model_path, steps = None, run.steps
+        print('[%s] Starting \'%s\'.' % (datetime.now(), run.name))
+
+    command = get_command(run, checkpoint_path, model_path, steps)
+
+    # Append to the log so that the log of a resumed run follows on from where it was stopped.
+    with open(os.path.join(log_path, '%s.log' % run.name), 'a') as log_file:
+        log_file.write('[%s] %s\n' % (datetime.now(), ' '.join(command)))
+        log_file.flush()
+
+        # Unbuffered so that the log can be followed while the run is training.
+        return subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT,
+                                env=dict(os.environ, PYTHONUNBUFFERED='1'))
+
+
+def start_tensorboard(log_path: str) -> subprocess.Popen:
+    """Start TensorBoard on the training logs of every run.
+
+    :param log_path: The directory to write TensorBoard's own log to.
+    :return: The TensorBoard process.
+    """
+    with open(os.path.join(log_path, 'tensorboard.log'), 'a') as log_file:
+        return subprocess.Popen(['tensorboard', '--logdir', TENSORBOARD_LOG_PATH], stdout=log_file,
+                                stderr=subprocess.STDOUT)
+
+
+def is_complete(run: Run, checkpoint_root: str) -> bool:
+    """Check whether a run has finished training, i.e. it saved its final checkpoint."""
+    return os.path.exists(os.path.join(checkpoint_root, run.name, 'checkpoint_last.pkl'))
+
+
+@plac.annotations(
+    spec_path=plac.Annotation('The path to the JSON experiment spec, see `expand_spec()`.', type=str,
+                              kind='positional'),
+    cpus=plac.Annotation('How many CPUs the runs may use at once. Defaults to the number of CPUs of the machine. A '
+                         'run uses a CPU per worker process plus one for training.', type=int, kind='option'),
+    log_path=plac.Annotation('The directory to write the log of each run to.', type=str, kind='option'),
+    checkpoint_root=plac.Annotation('The directory to save the checkpoints of each run in.', type=str, kind='option'),
+    dry_run=plac.Annotation('Flag indicating that the runs should be listed but not started.', kind='flag'),
+    tensorboard=plac.Annotation('Flag indicating that TensorBoard should be started on the training logs of the runs '
+                                'until every run has stopped. Its output goes to \'<log-path>/tensorboard.log\'.',
+                                kind='flag')
+)
+def main(spec_path, cpus=None, log_path='logs', checkpoint_root='checkpoints', dry_run=False, tensorboard=False):
+    """Train every run of an experiment, running as many at once as the CPU budget allows.
+
+    Runs that have already finished are skipped, and runs that were stopped part way through are resumed from their
+    latest checkpoint.
+    """
+    cpus = cpus if cpus else os.cpu_count()
+
+    with open(spec_path) as file:
+        runs = expand_spec(json.load(file))
+
+    pending = [run for run in runs if not is_complete(run, checkpoint_root)]
+    print('%d runs, %d already complete, %d CPUs.' % (len(runs), len(runs) - len(pending), cpus))
+
+    if dry_run:
+        for run in pending:
+            print('%-40s cost %2d  %s' % (run.name, run.cost, ' '.join(get_command(run, os.path.join(checkpoint_root,
+                                                                                                    run.name)))))
+        return
+
+    os.makedirs(log_path, exist_ok=True)
+    tensorboard_process = start_tensorboard(log_path) if tensorboard else None
+    # The processes of the runs that are training, by run name.
+    running = {}
+    failed = []
+
+    try:
+        while pending or running:
+            for run, process in list(running.values()):
+                if process.poll() is not None:
+                    del running[run.name]
+
+                    if process.returncode == 0 and is_complete(run, checkpoint_root):
+                        print('[%s] Finished \'%s\'.' % (datetime.now(), run.name))
+                    else:
+                        print('[%s] \'%s\' stopped before finishing (exit code %d), see \'%s\'.'
+                              % (datetime.now(), run.name, process.returncode,
+                                 os.path.join(log_path, '%s.log' % run.name)))
+                        failed.append(run.name)
+
+            used = sum(min(run.cost, cpus) for run, _ in running.values())
+
+            # Start the first runs that fit in the remaining budget. A run that needs more than the whole budget is
+            # started on its own.
+            for run in list(pending):
+                if used + min(run.cost, cpus) <= cpus:
+                    pending.remove(run)
+                    process = start_run(run, checkpoint_root, log_path)
+
+                    if process is not None:
+                        running[run.name] = run, process
+                        used += min(run.cost, cpus)
+
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print('Stopping %d runs...' % len(running))
+
+        for _, process in running.values():
+            process.terminate()
+
+        for _, process in running.values():
+            process.wait()
+    finally:
+        if tensorboard_process is not None:
+            tensorboard_process.terminate()
+            tensorboard_process.wait()
+
+    if failed:
+        print('Failed runs: %s' % ', '.join(failed))
+
+
+if __name__ == '__main__':
+    plac.call(main)
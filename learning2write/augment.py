@@ -0,0 +1,98 @@
+"""This module defines the augmentation of patterns by the symmetries of the square (the dihedral group D4).
+
+Each of the 8 transforms (the 4 rotations, each optionally preceded by a left-right flip) only moves cells around, so
+it can be precomputed as a permutation of the flattened cell indices of a grid. Transforming a pattern, or a whole
+batch of patterns with a different transform each, is then a single fancy-index gather.
+
+Transforms are numbered 0-7. Transform `t` flips the pattern left to right if `t >= 4` and then rotates it by
+`t % 4` quarter turns, as `np.rot90` does. So transforms 0-3 are the same as `np.rot90(pattern, k=t)`.
+"""
+from functools import lru_cache
+from typing import Tuple, Union
+
+import numpy as np
+
+N_TRANSFORMS = 8
+IDENTITY = np.array([0])
+ROTATIONS = np.arange(4)
+FLIPS = np.array([0, 4])
+ALL_TRANSFORMS = np.arange(N_TRANSFORMS)
+
+
+def get_transforms(rotate=False, flip=False) -> np.ndarray:
+    """Get the transforms to choose from when augmenting patterns.
+
+    :param rotate: Whether or not to include the rotations.
+    :param flip: Whether or not to include the flips.
+    :return: The numbers of the transforms.
+    """
+    if rotate and flip:
+        return ALL_TRANSFORMS
+    elif rotate:
+        return ROTATIONS
+    elif flip:
+        return FLIPS
+    else:
+        return IDENTITY
+
+
+@lru_cache()
+def get_index_maps(shape: Tuple[int, int]) -> np.ndarray:
+    """Get the index maps of the dihedral transforms for a grid.
+
+    :param shape: The shape (height, width) of the grid. This must be square since rotating by a quarter turn would
+                  otherwise change the shape.
+    :return: A read-only array with the shape (8, height * width) where `pattern.reshape(-1)[maps[t]]` is the
+             flattened pattern transformed by transform `t`.
+    """
+    height, width = shape
+
+    if height != width:
+        raise ValueError('Cannot augment non-square patterns with the shape %s' % str(shape))
+
+    indices = np.arange(height * width).reshape(shape)
+    maps = np.array([np.rot90(np.fliplr(indices) if t >= 4 else indices, k=t % 4).reshape(-1)
+                     for t in range(N_TRANSFORMS)])
+    maps.flags.writeable = False
+
+    return maps
+
+
+def augment(patterns: np.ndarray, transforms: Union[int, np.ndarray]) -> np.ndarray:
+    """Transform a pattern or a batch of patterns.
+
+    :param patterns: A single pattern with the shape (height, width), or a batch of patterns with the shape
+                     (n, height, width).
+    :param transforms: The transform to apply to the pattern, or an array of the transforms to apply to each pattern of
+                       the batch.
+    :return: The transformed pattern(s).
+    """
+    patterns = np.asarray(patterns)
+    shape = patterns.shape[-2:]
+    maps = get_index_maps(shape)
+
+    if patterns.ndim == 2:
+        return patterns.reshape(-1)[maps[transforms]].reshape(shape)
+    else:
+        flat = patterns.reshape(len(patterns), -1)
+
+        return flat[np.arange(len(patterns))[:, np.newaxis], maps[transforms]].reshape(patterns.shape)
+
+
+def augmented_table(patterns: np.ndarray, transforms=ALL_TRANSFORMS) -> np.ndarray:
+    """Create a table of every transform of every pattern, with duplicates removed.
+
+    Sampling uniformly from this table gives each distinct augmented pattern the same probability, whereas augmenting
+    patterns as they are sampled favours symmetric patterns (e.g. all 4 rotations of a cross are the same pattern).
+
+    :param patterns: The patterns with the shape (n, height, width).
+    :param transforms: The transforms to apply.
+    :return: The distinct augmented patterns, in the order that they first appear when the transforms are applied to
+             each pattern in turn.
+    """
+    patterns = np.asarray(patterns)
+    maps = get_index_maps(patterns.shape[-2:])
+    table = patterns.reshape(len(patterns), -1)[:, maps[transforms]].reshape((-1,) + patterns.shape[1:])
+    _, first_indices = np.unique(table.reshape(len(table), -1), axis=0, return_index=True)
+
+    return table[np.sort(first_indices)]
@@ -0,0 +1,161 @@
+"""This module chooses how to run the environments for training, by measuring what is fastest on this machine.
+
+An update of an A2C-style model has two parts: stepping the environments `n_steps` times (see `learning2write.bench`)
+and the learner's work (choosing actions with the policy and training on the batch of experience). The first depends
+on how the environments are run and how many there are, the second only on how many there are. Both are measured for
+each candidate, and the configuration that gives the most timesteps per second is chosen:
+
+    timesteps/second = n_envs * n_steps / (n_steps * env step time + learner time)
+
+The learner time is measured by training the model for a few seconds with the batched environment (whose step time is
+measured separately and taken away), so only one model has to be built for each number of environments.
+"""
+import os
+import time
+from functools import partial
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+
+from learning2write.bench import benchmark, get_env, random_actions
+from learning2write.patterns import PatternSet
+
+VEC_ENV_TYPES = ['batched', 'subproc']
+BATCHED_N_ENVS = [1, 2, 4, 8, 16, 32, 64]
+
+
+class Candidate(NamedTuple):
+    """A way of running the environments, and how fast training is with it."""
+    vec_env_type: str
+    n_envs: int
+    # The time per update spent stepping the environments, and the rest of the time per update, in seconds.
+    env_time: float
+    learner_time: float
+    timesteps_per_second: float
+
+    @property
+    def env_fraction(self) -> float:
+        """The fraction of an update that is spent stepping the environments."""
+        return self.env_time / (self.env_time + self.learner_time)
+
+
+def get_subproc_n_envs(cpu_count: Optional[int] = None) -> List[int]:
+    """Get the numbers of worker processes to try: powers of two up to the number of CPUs, and the number of CPUs."""
+    cpu_count = cpu_count if cpu_count else os.cpu_count()
+
+    return sorted({2 ** i for i in range(int(np.log2(cpu_count)) + 1)} | {cpu_count})
+
+
+def measure_env_step_time(vec_env_type: str, n_envs: int, pattern_set: PatternSet, max_steps: int,
+                          duration: float, action_mode='cells') -> float:
+    """Measure how long it takes to step every environment once.
+
+    :param vec_env_type: How to run the environments, see `VEC_ENV_TYPES`.
+    :param n_envs: The number of environments.
+    :param pattern_set: The pattern set to use in the environments.
+    :param max_steps: The maximum number of steps per episode.
+    :param duration: Roughly how long to measure for, in seconds.
+    :param action_mode: The action mode of the environments, see `learning2write.env.ACTION_MODES`.
+    :return: The time, in seconds.
+    """
+    env = get_env(vec_env_type, n_envs, pattern_set, max_steps, action_mode)
+
+    try:
+        result = benchmark(env, partial(random_actions, n_actions=env.action_space.n), duration,
+                           np.random.RandomState(0))
+    finally:
+        env.close()
+
+    return n_envs / result['steps_per_second']
+
+
+def measure_update_time(model, duration: float, n_warmup_updates=2) -> float:
+    """Measure how long an update of a model takes, by training it for a while.
+
+    :param model: The model, with its environment set.
+    :param duration: Roughly how long to measure for, in seconds.
+    :param n_warmup_updates: How many updates to leave out of the measurement, e.g. the first updates that set up the
+                             optimiser.
+    :return: The mean time of an update, in seconds.
+    """
+    times = []
+
+    def callback(locals_, globals_):
+        times.append(time.perf_counter())
+
+        # Stop training once there are enough updates after the warm up.
+        return len(times) <= n_warmup_updates + 1 or times[-1] - times[n_warmup_updates] < duration
+
+    model.learn(total_timesteps=np.iinfo(np.int32).max, callback=callback)
+
+    return (times[-1] - times[n_warmup_updates]) / (len(times) - 1 - n_warmup_updates)
+
+
+def autotune(make_model: Callable, pattern_set: PatternSet, max_steps: int, n_envs: Optional[List[int]] = None,
+             duration=2.0, log: Callable[[str], None] = print, action_mode='cells') -> Candidate:
+    """Find how to run the environments so that training is fastest.
+
+    :param make_model: A function that creates a new model for a (vectorised) environment. The model must have an
+                       `n_steps` attribute, and a `learn` function that stops when the callback returns False.
+    :param pattern_set: The pattern set that will be trained on.
+    :param max_steps: The maximum number of steps per episode.
+    :param n_envs: The numbers of environments to try with both types of vectorised environment. By default a range
+                   that suits each type is tried.
+    :param duration: Roughly how long to measure each part of each candidate for, in seconds.
+    :param log: The function to report progress and the results with.
+    :param action_mode: The action mode of the environments, see `learning2write.env.ACTION_MODES`.
+    :return: The fastest candidate.
+    """
+    candidate_n_envs = {'batched': n_envs if n_envs else BATCHED_N_ENVS,
+                        'subproc': n_envs if n_envs else get_subproc_n_envs()}
+    env_step_times = {}
+    learner_times = {}
+
+    for vec_env_type in VEC_ENV_TYPES:
+        for n in candidate_n_envs[vec_env_type]:
+            env_step_times[vec_env_type, n] = measure_env_step_time(vec_env_type, n, pattern_set, max_steps,
+                                                                    duration / 2, action_mode)
+
+    for n in sorted(set(candidate_n_envs['batched']) | set(candidate_n_envs['subproc'])):
+        if ('batched', n) not in env_step_times:
+            env_step_times['batched', n] = measure_env_step_time('batched', n, pattern_set, max_steps, duration / 2,
+                                                                 action_mode)
+
+        env = get_env('batched', n, pattern_set, max_steps, action_mode)
+
+        try:
+            model = make_model(env)
+            update_time = measure_update_time(model, duration)
+            n_steps = model.n_steps
+            model.sess.close()
+        finally:
+            env.close()
+
+        # The learner's time is what is left of an update after stepping the (batched) environments.
+        learner_times[n] = max(update_time - n_steps * env_step_times['batched', n], 0.0)
+        log('n_envs=%-3d update %.1f ms, of which learner %.1f ms' % (n, 1000 * update_time, 1000 * learner_times[n]))
+
+    candidates = []
+
+    for (vec_env_type, n), env_step_time in sorted(env_step_times.items()):
+        if n in candidate_n_envs[vec_env_type]:
+            env_time = n_steps * env_step_time
+            candidates.append(Candidate(vec_env_type, n, env_time, learner_times[n],
+                                        n * n_steps / (env_time + learner_times[n])))
+
+    candidates.sort(key=lambda c: c.timesteps_per_second, reverse=True)
+
+    log('%-8s %6s %14s %18s %12s' % ('type', 'n_envs', 'env ms/update', 'learner ms/update', 'timesteps/s'))
+
+    for candidate in candidates:
+        log('%-8s %6d %14.1f %18.1f %12.0f' % (candidate.vec_env_type, candidate.n_envs, 1000 * candidate.env_time,
+                                               1000 * candidate.learner_time, candidate.timesteps_per_second))
+
+    best = candidates[0]
+    log('Chose %s with %d environments: about %.0f timesteps/s, with %.0f%% of each update spent stepping the '
+        'environments%s.' % (best.vec_env_type, best.n_envs, best.timesteps_per_second, 100 * best.env_fraction,
+                             ' (next best: %s with %d environments, about %.0f timesteps/s)'
+                             % (candidates[1].vec_env_type, candidates[1].n_envs, candidates[1].timesteps_per_second)
+                             if len(candidates) > 1 else ''))
+
+    return best
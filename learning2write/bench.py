@@ -0,0 +1,346 @@
+"""This module benchmarks the throughput of the learning2write environments.
+
+For each pattern set, it measures how many steps and resets per second a single `WritingEnvironment`, a
+`SubprocVecEnv` of writing environments, and a `BatchedWritingEnvironment` can do, along with the latency of a step.
+Each configuration is run with random actions, and with scripted actions that write the reference pattern (which gives
+the longer episodes of a trained agent). The results are saved as JSON along with information about the machine so
+that runs can be compared across commits and hosts, e.g.:
+
+    python -m learning2write.bench -pattern-set 5x5 -subproc-workers 1,4 -batched-envs 64,1024
+
+With `-startup`, it also measures how long it takes to import the package in a fresh interpreter, and to start the
+worker processes of a `SubprocVecEnv` and get their first observations.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, List, Optional
+
+import numpy as np
+import plac
+from stable_baselines.common.vec_env import SubprocVecEnv, VecEnv
+
+from learning2write.env import WritingEnvironment, MOVE_DOWN, MOVE_LEFT, MOVE_RIGHT, FILL_SQUARE, QUIT, ACTION_MODES, \
+    get_default_max_steps
+from learning2write.patterns import get_pattern_set, PatternSet, VALID_PATTERN_SETS
+from learning2write.shared import SharedPatternStore
+from learning2write.strokes import StrokeActions
+from learning2write.vec_env import BatchedWritingEnvironment, seed_vec_env
+
+BENCHMARK_MODES = ['single', 'subproc', 'batched']
+ACTION_TYPES = ['random', 'scripted']
+
+
+def random_actions(observations: np.ndarray, rng: np.random.RandomState,
+                   n_actions=WritingEnvironment.N_DISCRETE_ACTIONS) -> np.ndarray:
+    """Choose uniformly random actions.
+
+    :param observations: A batch of observations.
+    :param rng: The random number generator to use.
+    :param n_actions: The number of actions of the environment.
+    :return: An action for each observation.
+    """
+    return rng.randint(n_actions, size=len(observations))
+
+
+def scripted_actions(observations: np.ndarray, rng: Optional[np.random.RandomState] = None,
+                     stroke_actions: Optional[StrokeActions] = None) -> np.ndarray:
+    """Choose the actions of an agent that writes the reference pattern perfectly.
+
+    The agent snakes through the grid (left to right along even rows and right to left along odd rows), fills in each
+    cell of the reference pattern that it passes over and quits at the end of the last row.
+
+    :param observations: A batch of observations.
+    :param rng: Unused, for compatibility with `random_actions`.
+    :param stroke_actions: The actions of the 'strokes' action mode, if the environment uses it. The agent then takes
+                           the same path with pen up strokes of one cell and dots.
+    :return: An action for each observation.
+    """
+    n, rows, cols, _ = observations.shape
+    positions = observations[..., 2].reshape(n, -1).argmax(axis=1)
+    envs = np.arange(n)
+    row, col = positions // cols, positions % cols
+    is_reversed = row % 2 == 1
+    is_row_end = np.where(is_reversed, col == 0, col == cols - 1)
+
+    actions = np.where(is_reversed, MOVE_LEFT, MOVE_RIGHT)
+    actions[is_row_end] = MOVE_DOWN
+    actions[is_row_end & (row == rows - 1)] = QUIT
+    actions[(observations[envs, row, col, 1] == 1) & (observations[envs, row, col, 0] == 0)] = FILL_SQUARE
+
+    if stroke_actions is not None:
+        # The moves of the 'cells' action mode are the first four stroke directions.
+        actions = np.where(actions < FILL_SQUARE, actions * stroke_actions.max_length,
+                           np.where(actions == FILL_SQUARE, stroke_actions.dot_action, stroke_actions.quit_action))
+
+    return actions
+
+
+def get_machine_info() -> dict:
+    """Get information about the machine and the code that the benchmark is run with.
+
+    :return: A JSON-serialisable dictionary of the machine information.
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'git_commit': commit,
+        'date': datetime.now().isoformat()
+    }
+
+
+class SingleEnv:
+    """Gives a single writing environment the same interface as the vectorised environments, without the overhead of
+    `DummyVecEnv`, so that the environment itself is what is measured."""
+
+    num_envs = 1
+
+    def __init__(self, env: WritingEnvironment):
+        self.env = env
+        self.action_space = env.action_space
+
+    def reset(self) -> np.ndarray:
+        return self.env.reset()[np.newaxis]
+
+    def step(self, actions: np.ndarray):
+        observation, reward, done, info = self.env.step(actions[0])
+
+        if done:
+            observation = self.env.reset()
+
+        return observation[np.newaxis], np.array([reward]), np.array([done]), [info]
+
+    def seed(self, seed=None):
+        return self.env.seed(seed)
+
+    def close(self):
+        self.env.close()
+
+
+def get_env(mode: str, n_envs: int, pattern_set: PatternSet, max_steps: int, action_mode='cells') -> VecEnv:
+    """Create the environment to benchmark.
+
+    :param mode: The type of environment, see `BENCHMARK_MODES`. A single environment is wrapped so that it can be
+                 used like the vectorised environments.
+    :param n_envs: The number of environments (or worker processes).
+    :param pattern_set: The pattern set to use in the environment(s).
+    :param max_steps: The maximum number of steps per episode.
+    :param action_mode: The action mode of the environment(s), see `learning2write.env.ACTION_MODES`.
+    :return: The vectorised environment.
+    """
+    if mode == 'single':
+        return SingleEnv(WritingEnvironment(pattern_set, max_steps=max_steps, action_mode=action_mode))
+    elif mode == 'subproc':
+        def make_env(worker: int):
+            # Same as `train.get_env`, each worker reads its own part of the patterns.
+            shared_pattern_set.set_part(worker, n_envs)
+
+            return WritingEnvironment(shared_pattern_set, max_steps=max_steps, action_mode=action_mode)
+
+        with SharedPatternStore(pattern_set) as pattern_store:
+            shared_pattern_set = pattern_store.patterns
+            env = SubprocVecEnv([lambda worker=worker: make_env(worker) for worker in range(n_envs)])
+            env.get_attr('max_steps')
+
+        return env
+    elif mode == 'batched':
+        return BatchedWritingEnvironment(n_envs, pattern_set, max_steps=max_steps, action_mode=action_mode)
+    else:
+        raise ValueError('Unrecognised benchmark mode \'%s\'' % mode)
+
+
+def benchmark(env, choose_actions: Callable, duration: float, rng: np.random.RandomState) -> dict:
+    """Measure the throughput of an environment.
+
+    :param env: The (vectorised) environment.
+    :param choose_actions: The function that chooses actions for a batch of observations.
+    :param duration: Roughly how long to run each measurement for, in seconds.
+    :param rng: The random number generator to choose actions with.
+    :return: The results of the benchmark.
+    """
+    observations = env.reset()
+
+    # Warm up, e.g. so that any lazily loaded patterns have been loaded.
+    for _ in range(10):
+        observations, _, _, _ = env.step(choose_actions(observations, rng))
+
+    latencies = []
+    n_episodes = 0
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < duration:
+        actions = choose_actions(observations, rng)
+        step_start = time.perf_counter()
+        observations, _, dones, _ = env.step(actions)
+        latencies.append(time.perf_counter() - step_start)
+        n_episodes += int(np.count_nonzero(dones))
+
+    step_time = sum(latencies)
+    n_resets = 0
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < duration / 4:
+        env.reset()
+        n_resets += env.num_envs
+
+    reset_time = time.perf_counter() - start
+
+    return {
+        'n_steps': len(latencies) * env.num_envs,
+        'steps_per_second': len(latencies) * env.num_envs / step_time,
+        'episodes_per_second': n_episodes / step_time,
+        'resets_per_second': n_resets / reset_time,
+        'latency_p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'latency_p99_ms': 1000 * float(np.percentile(latencies, 99))
+    }
+
+
+def measure_import_time(module='learning2write', repeats=5) -> float:
+    """Measure how long it takes to import a module in a fresh interpreter.
+
+    :param module: The name of the module.
+    :param repeats: How many times to measure.
+    :return: The median time, in seconds.
+    """
+    code = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)' % module
+    times = [float(subprocess.check_output([sys.executable, '-c', code])) for _ in range(repeats)]
+
+    return float(np.median(times))
+
+
+def measure_spawn_time(pattern_set: PatternSet, n_workers: int, max_steps: int, repeats=3,
+                       action_mode='cells') -> float:
+    """Measure how long it takes to start the worker processes of a `SubprocVecEnv` and get their first observations.
+
+    :param pattern_set: The pattern set to use in the environments.
+    :param n_workers: The number of worker processes.
+    :param max_steps: The maximum number of steps per episode.
+    :param repeats: How many times to measure.
+    :param action_mode: The action mode of the environments.
+    :return: The median time, in seconds.
+    """
+    times = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        env = get_env('subproc', n_workers, pattern_set, max_steps, action_mode)
+        env.reset()
+        times.append(time.perf_counter() - start)
+        env.close()
+
+    return float(np.median(times))
+
+
+def parse_int_list(string: str) -> List[int]:
+    """Parse a comma separated list of integers, e.g. '1,2,4'."""
+    return [int(value) for value in string.split(',') if value]
+
+
+@plac.annotations(
+    pattern_set=plac.Annotation('The pattern set to benchmark. Benchmarks all of them by default.',
+                                choices=VALID_PATTERN_SETS, kind='option', type=str),
+    modes=plac.Annotation('Comma separated list of which environments to benchmark, out of %s.'
+                          % ', '.join(BENCHMARK_MODES), kind='option', type=str),
+    subproc_workers=plac.Annotation('Comma separated list of the numbers of workers to benchmark SubprocVecEnv with.',
+                                    kind='option', type=parse_int_list),
+    action_mode=plac.Annotation('The action mode of the environments, see `learning2write.env.WritingEnvironment`.',
+                                choices=ACTION_MODES, kind='option', type=str),
+    batched_envs=plac.Annotation('Comma separated list of the numbers of environments to benchmark the batched '
+                                 'environment with.', kind='option', type=parse_int_list),
+    duration=plac.Annotation('Roughly how many seconds to run each benchmark for.', kind='option', type=float),
+    seed=plac.Annotation('The seed for the pattern sets and random actions.', kind='option', type=int),
+    startup=plac.Annotation('Flag indicating that the time to import the package and to start the workers of '
+                            'SubprocVecEnv should be measured too.', kind='flag'),
+    output_path=plac.Annotation('Where to save the results. Defaults to \'benchmarks/<date>.json\'.',
+                                kind='option', type=str)
+)
+def main(pattern_set=None, modes=','.join(BENCHMARK_MODES), subproc_workers=(1, 2, 4), action_mode='cells',
+         batched_envs=(16, 256, 4096), duration=2.0, seed=0, startup=False, output_path=None):
+    """Benchmark the throughput of the learning2write environments."""
+    modes = modes.split(',')
+
+    for mode in modes:
+        if mode not in BENCHMARK_MODES:
+            raise ValueError('Unrecognised benchmark mode \'%s\'' % mode)
+
+    results = []
+
+    if startup:
+        import_time = measure_import_time()
+        results.append({'mode': 'import', 'import_time_s': import_time})
+        print('import learning2write: %.3f s' % import_time)
+
+    n_envs = {'single': [1], 'subproc': subproc_workers, 'batched': batched_envs}
+
+    for pattern_set_name in [pattern_set] if pattern_set else sorted(VALID_PATTERN_SETS):
+        try:
+            pattern_set_ = get_pattern_set(pattern_set_name)
+        except (IOError, OSError) as e:
+            # e.g. the EMNIST data has not been downloaded.
+            print('Skipping pattern set \'%s\': %s' % (pattern_set_name, e))
+            results.append({'pattern_set': pattern_set_name, 'error': str(e)})
+            continue
+
+        # Same as in training.
+        max_steps = get_default_max_steps((pattern_set_.height, pattern_set_.width), action_mode)
+        stroke_actions = StrokeActions((pattern_set_.height, pattern_set_.width)) if action_mode == 'strokes' else None
+        choose_actions = {'random': partial(random_actions, n_actions=stroke_actions.n_actions) if stroke_actions
+                          else random_actions,
+                          'scripted': partial(scripted_actions, stroke_actions=stroke_actions)}
+
+        if startup:
+            for n in subproc_workers:
+                spawn_time = measure_spawn_time(pattern_set_, n, max_steps, action_mode=action_mode)
+                results.append({'pattern_set': pattern_set_name, 'mode': 'spawn', 'n_envs': n,
+                                'spawn_time_s': spawn_time})
+                print('%-7s %-8s n_envs=%-5d %.3f s to start the workers' % (pattern_set_name, 'spawn', n, spawn_time))
+
+        for mode in modes:
+            for n in n_envs[mode]:
+                env = get_env(mode, n, pattern_set_, max_steps, action_mode)
+
+                for action_type in ACTION_TYPES:
+                    rng = np.random.RandomState(seed)
+                    seed_vec_env(env, seed)
+                    result = benchmark(env, choose_actions[action_type], duration, rng)
+                    result = dict(pattern_set=pattern_set_name, mode=mode, n_envs=n, actions=action_type, **result)
+                    results.append(result)
+
+                    print('%-7s %-8s n_envs=%-5d %-8s %12.0f steps/s %10.0f resets/s  p50 %.3f ms  p99 %.3f ms'
+                          % (pattern_set_name, mode, n, action_type, result['steps_per_second'],
+                             result['resets_per_second'], result['latency_p50_ms'], result['latency_p99_ms']))
+
+                env.close()
+
+        pattern_set_.close()
+
+    if output_path is None:
+        output_path = os.path.join('benchmarks', '%s.json' % datetime.now().strftime('%Y%m%d-%H%M%S'))
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    with open(output_path, 'w') as file:
+        json.dump({'machine': get_machine_info(),
+                   'config': {'duration': duration, 'seed': seed, 'startup': startup, 'action_mode': action_mode},
+                   'results': results}, file, indent=2)
+
+    print('Saved results to \'%s\'.' % output_path)
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -0,0 +1,77 @@
+"""This module defines helpers for storing binary patterns as packed bits and scoring them with popcounts.
+
+Packing a pattern stores each cell as a single bit, so a 28x28 pattern takes 98 bytes instead of 784 (or more).
+Patterns are packed row by row into the last axis, so batches of patterns of any shape can be packed and scored at
+once.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from learning2write.metrics import precision_recall_f1
+
+# The number of set bits in each possible byte.
+POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def pack(patterns: np.ndarray) -> np.ndarray:
+    """Pack binary patterns into bits.
+
+    :param patterns: The patterns with the shape (..., height, width). Any non-zero cell is treated as filled.
+    :return: The packed patterns with the shape (..., ceil(height * width / 8)).
+    """
+    patterns = np.asarray(patterns)
+
+    return np.packbits(patterns.reshape(patterns.shape[:-2] + (-1,)) != 0, axis=-1)
+
+
+def unpack(packed: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Unpack patterns that were packed with `pack`.
+
+    :param packed: The packed patterns with the shape (..., n_bytes).
+    :param shape: The shape (height, width) of a single pattern.
+    :return: The patterns as uint8 arrays with the shape (..., height, width).
+    """
+    n_cells = shape[0] * shape[1]
+
+    return np.unpackbits(packed, axis=-1)[..., :n_cells].reshape(packed.shape[:-1] + tuple(shape))
+
+
+def popcount(packed: np.ndarray) -> np.ndarray:
+    """Count the set bits of packed patterns.
+
+    :param packed: The packed patterns with the shape (..., n_bytes).
+    :return: The number of set bits in each pattern.
+    """
+    return POPCOUNT_TABLE[packed].sum(axis=-1, dtype=np.int64)
+
+
+def confusion_counts(targets: np.ndarray, predictions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count the true positives, false positives and false negatives of packed patterns.
+
+    :param targets: The packed ground truth patterns.
+    :param predictions: The packed predicted patterns. These are broadcast against `targets`.
+    :return: A 3-tuple of the counts of true positives, false positives and false negatives.
+    """
+    # The padding bits are zero in both patterns so they never count towards any of these.
+    true_positives = popcount(targets & predictions)
+    false_positives = popcount(~targets & predictions)
+    false_negatives = popcount(targets & ~predictions)
+
+    return true_positives, false_positives, false_negatives
+
+
+def precision_recall_f1_packed(targets: np.ndarray, predictions: np.ndarray,
+                               n_cells: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Calculate the precision, recall and f1 metrics of packed patterns.
+
+    This gives the same results as `WritingEnvironment._precision_recall_f1` on the unpacked patterns.
+
+    :param targets: The packed ground truth patterns.
+    :param predictions: The packed predicted patterns. These are broadcast against `targets`.
+    :param n_cells: The number of cells in a single (unpacked) pattern.
+    :return: A 3-tuple containing the precision, recall and f1-score of each pattern.
+    """
+    true_positives, false_positives, false_negatives = confusion_counts(targets, predictions)
+
+    return precision_recall_f1(true_positives, false_positives, true_positives + false_negatives, n_cells)
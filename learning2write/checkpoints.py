@@ -0,0 +1,193 @@
+"""This module defines the saving of checkpoints in the background and the policy for which checkpoints to keep.
+
+Saving a stable-baselines model has two parts: collecting the model's data and parameters (fast, the parameters are
+copied out of the TensorFlow session into NumPy arrays) and pickling them to disk (slow). `snapshot` does the first part
+on the training thread, and `CheckpointWriter` does the second in a background thread so that training can carry on.
+"""
+import json
+import os
+import threading
+from typing import Callable, List, NamedTuple, Optional, Set
+
+# The file in a checkpoint directory that lists the periodic checkpoints that have been written.
+CHECKPOINT_INDEX_FILENAME = 'checkpoints.json'
+
+
+class Snapshot(NamedTuple):
+    """The saved state of a model, as passed by the model's `save` to its `_save_to_file`."""
+    data: dict
+    params: object
+    save_to_file: Callable
+
+
+def snapshot(model) -> Snapshot:
+    """Take a snapshot of a model's data and parameters in memory, without writing anything to disk.
+
+    :param model: The stable-baselines model.
+    :return: The snapshot of the model.
+    """
+    save_to_file = type(model)._save_to_file
+    captured = {}
+
+    def capture(save_path, data=None, params=None):
+        captured['data'], captured['params'] = data, params
+
+    # `save` collects everything that needs saving and hands it to `_save_to_file`, so intercept that call.
+    model._save_to_file = capture
+
+    try:
+        model.save('snapshot')
+    finally:
+        del model._save_to_file
+
+    return Snapshot(captured['data'], captured['params'], save_to_file)
+
+
+class CheckpointWriter:
+    """Writes snapshots to disk in a background thread, one at a time.
+
+    Each snapshot is written to a temporary file which is then renamed, so a checkpoint file is never partially
+    written, even if training is killed part way through a write.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def is_writing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def write(self, snapshot_: Snapshot, path: str):
+        """Start writing a snapshot. If a snapshot is still being written, wait for it to finish first.
+
+        :param snapshot_: The snapshot to write.
+        :param path: The path to write the snapshot to.
+        """
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(snapshot_, path))
+        self._thread.start()
+
+    def wait(self):
+        """Wait for the snapshot that is being written, if any. Errors from writing the snapshot are raised here."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, snapshot_: Snapshot, path: str):
+        # The temporary file needs an extension, otherwise `_save_to_file` adds '.pkl' to it.
+        temp_path = path + '.tmp'
+
+        try:
+            snapshot_.save_to_file(temp_path, data=snapshot_.data, params=snapshot_.params)
+            os.replace(temp_path, path)
+        except BaseException as e:
+            self._error = e
+
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class Checkpoint(NamedTuple):
+    """A checkpoint that has been saved."""
+    path: str
+    # The number of checkpoints saved before this one.
+    index: int
+    # How far training had got when the checkpoint was saved.
+    updates: Optional[int] = None
+    timesteps: Optional[int] = None
+    # How well the model was doing, e.g. its evaluation accuracy.
+    metric: Optional[float] = None
+
+
+def write_index(checkpoint_path: str, checkpoints: List[Checkpoint]):
+    """Save the list of checkpoints in a checkpoint directory, so that training can be resumed from the latest one.
+
+    :param checkpoint_path: The checkpoint directory.
+    :param checkpoints: The checkpoints that have been written.
+    """
+    path = os.path.join(checkpoint_path, CHECKPOINT_INDEX_FILENAME)
+    temp_path = path + '.tmp'
+
+    with open(temp_path, 'w') as file:
+        json.dump([checkpoint._asdict() for checkpoint in checkpoints], file, indent=2)
+
+    os.replace(temp_path, path)
+
+
+def read_index(checkpoint_path: str) -> List[Checkpoint]:
+    """Load the list of checkpoints in a checkpoint directory.
+
+    :param checkpoint_path: The checkpoint directory.
+    :return: The checkpoints that were written and still exist, in the order they were saved. Empty if there is no
+             index.
+    """
+    path = os.path.join(checkpoint_path, CHECKPOINT_INDEX_FILENAME)
+
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as file:
+        checkpoints = [Checkpoint(**checkpoint) for checkpoint in json.load(file)]
+
+    return sorted([checkpoint for checkpoint in checkpoints if os.path.exists(checkpoint.path)],
+                  key=lambda checkpoint: checkpoint.index)
+
+
+class RetentionPolicy:
+    """Decides which checkpoints to keep, so that long training runs do not fill up the disk.
+
+    A checkpoint is kept if any of the rules keeps it. If no rules are given then every checkpoint is kept.
+    """
+
+    def __init__(self, keep_last: Optional[int] = None, keep_every: Optional[int] = None,
+                 keep_best: Optional[int] = None, higher_is_better=True):
+        """Create a retention policy.
+
+        :param keep_last: Keep this many of the most recent checkpoints.
+        :param keep_every: Keep every checkpoint whose index is a multiple of this.
+        :param keep_best: Keep this many of the checkpoints with the best metric (e.g. evaluation accuracy).
+                          Checkpoints without a metric are not counted, but the ones after the latest checkpoint with
+                          a metric are kept until a later checkpoint is given a metric.
+        :param higher_is_better: Whether a higher metric is better.
+        """
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.higher_is_better = higher_is_better
+
+    @property
+    def keeps_everything(self) -> bool:
+        return not (self.keep_last or self.keep_every or self.keep_best)
+
+    def select(self, checkpoints: List[Checkpoint]) -> Set[str]:
+        """Choose the checkpoints to keep.
+
+        :param checkpoints: The checkpoints that have been saved.
+        :return: The paths of the checkpoints to keep.
+        """
+        if self.keeps_everything:
+            return {checkpoint.path for checkpoint in checkpoints}
+
+        keep = set()
+
+        if self.keep_last:
+            keep.update(checkpoint.path for checkpoint in sorted(checkpoints, key=lambda c: c.index)[-self.keep_last:])
+
+        if self.keep_every:
+            keep.update(checkpoint.path for checkpoint in checkpoints if checkpoint.index % self.keep_every == 0)
+
+        if self.keep_best:
+            scored = [checkpoint for checkpoint in checkpoints if checkpoint.metric is not None]
+            # The checkpoints after the latest one with a metric may still be given one, e.g. by an evaluation that
+            # is running in the background.
+            latest_scored = max((checkpoint.index for checkpoint in scored), default=-1)
+            keep.update(checkpoint.path for checkpoint in checkpoints if checkpoint.index > latest_scored)
+            scored.sort(key=lambda c: c.metric, reverse=self.higher_is_better)
+            keep.update(checkpoint.path for checkpoint in scored[:self.keep_best])
+
+        return keep
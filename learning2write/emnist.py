@@ -0,0 +1,122 @@
+"""This module converts the EMNIST dataset into binarised pattern files that can be memory-mapped.
+
+Decoding the gzipped IDX files that EMNIST is distributed as is slow, so each dataset is converted once into a `.npy`
+file of binarised 28x28 patterns next to the original files. Pattern sets then open that file with `np.memmap`, which
+means that startup is nearly instant and that every process using the same dataset shares the same pages of memory.
+
+The pattern files can be created ahead of time with:
+
+    python -m learning2write.emnist -dataset byclass
+
+otherwise they are created the first time a dataset is used.
+"""
+import gzip
+import os
+import struct
+
+import numpy as np
+import plac
+
+from learning2write.bitpack import pack
+
+EMNIST_DATASETS = ['byclass', 'bymerge', 'balanced', 'letters', 'digits', 'mnist']
+EMNIST_SUBSETS = ['train', 'test']
+
+IDX_IMAGES_MAGIC_NUMBER = 2051
+
+
+def get_patterns_path(dataset: str, subset='train', packed=False, data_path='emnist_data') -> str:
+    """Get the path of the pattern file for an EMNIST dataset.
+
+    :param dataset: Which dataset of EMNIST, see `EMNIST_DATASETS`.
+    :param subset: Which subset of the dataset, either 'train' or 'test'.
+    :param packed: Whether to get the path of the file of packed patterns.
+    :param data_path: The directory containing the EMNIST data.
+    :return: The path of the pattern file.
+    """
+    return os.path.join(data_path, 'emnist-%s-%s-%s.npy' % (dataset, subset, 'packed' if packed else 'patterns'))
+
+
+def load_patterns(dataset: str, subset='train', packed=False, data_path='emnist_data') -> np.memmap:
+    """Open the pattern file for an EMNIST dataset, creating it first if needed.
+
+    :param dataset: Which dataset of EMNIST, see `EMNIST_DATASETS`.
+    :param subset: Which subset of the dataset, either 'train' or 'test'.
+    :param packed: Whether to load the patterns as packed bits (see `learning2write.bitpack`).
+    :param data_path: The directory containing the EMNIST data.
+    :return: A read-only memory-mapped array of patterns with the shape (n, 28, 28), or (n, 98) if packed.
+    """
+    path = get_patterns_path(dataset, subset, packed, data_path)
+
+    if not os.path.exists(path):
+        convert(dataset, subset, packed, data_path)
+
+    return np.load(path, mmap_mode='r')
+
+
+def convert(dataset: str, subset='train', packed=False, data_path='emnist_data', chunk_size=8192) -> str:
+    """Convert the images of an EMNIST dataset into a file of binarised patterns.
+
+    The patterns are the same as the images loaded by `python-mnist` in the 'rounded_binarized' mode: pixels are set
+    if they are more than half of the maximum intensity, and the images are transposed to fix their orientation.
+
+    :param dataset: Which dataset of EMNIST, see `EMNIST_DATASETS`.
+    :param subset: Which subset of the dataset, either 'train' or 'test'.
+    :param packed: Whether to store the patterns as packed bits (see `learning2write.bitpack`).
+    :param data_path: The directory containing the EMNIST data.
+    :param chunk_size: How many images to convert at once.
+    :return: The path of the pattern file.
+    """
+    if dataset not in EMNIST_DATASETS:
+        raise ValueError('Unrecognised EMNIST dataset \'%s\'' % dataset)
+
+    if subset not in EMNIST_SUBSETS:
+        raise ValueError('Unrecognised EMNIST subset \'%s\'' % subset)
+
+    images_path = os.path.join(data_path, 'emnist-%s-%s-images-idx3-ubyte' % (dataset, subset))
+    path = get_patterns_path(dataset, subset, packed, data_path)
+    # Write to a temporary file first so that other processes never see a partially written pattern file.
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    with (gzip.open(images_path + '.gz', 'rb') if os.path.exists(images_path + '.gz') else open(images_path, 'rb')) \
+            as file:
+        magic, size, rows, cols = struct.unpack('>IIII', file.read(16))
+
+        if magic != IDX_IMAGES_MAGIC_NUMBER:
+            raise ValueError('Magic number mismatch in \'%s\', expected %d, got %d.'
+                             % (images_path, IDX_IMAGES_MAGIC_NUMBER, magic))
+
+        shape = (size, (rows * cols + 7) // 8) if packed else (size, rows, cols)
+        patterns = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=shape)
+
+        for start in range(0, size, chunk_size):
+            n_images = min(chunk_size, size - start)
+            images = np.frombuffer(file.read(n_images * rows * cols), dtype=np.uint8)
+            images = (images > 127).reshape(n_images, rows, cols).transpose(0, 2, 1)
+            patterns[start:start + n_images] = pack(images) if packed else images
+
+        patterns.flush()
+        del patterns
+
+    os.replace(temp_path, path)
+
+    return path
+
+
+@plac.annotations(
+    dataset=plac.Annotation('Which EMNIST dataset to convert. Converts all of them by default.',
+                            choices=EMNIST_DATASETS, kind='option', type=str),
+    packed=plac.Annotation('Flag indicating that the patterns should be stored as packed bits.', kind='flag'),
+    data_path=plac.Annotation('The directory containing the EMNIST data.', kind='option', type=str)
+)
+def main(dataset=None, packed=False, data_path='emnist_data'):
+    """Convert the EMNIST dataset into pattern files that can be memory-mapped."""
+    for dataset_ in [dataset] if dataset else EMNIST_DATASETS:
+        for subset in EMNIST_SUBSETS:
+            print('Converting %s (%s)...' % (dataset_, subset))
+            path = convert(dataset_, subset, packed, data_path)
+            print('Saved patterns to \'%s\'.' % path)
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -1,18 +1,25 @@
-"""This module defines the learning2write gym environment."""
+"""This module defines the learning2write gym environment.
+
+The window that the environment is rendered to in 'human' mode needs pyglet, which connects to a display as soon as
+its window modules are imported. Those modules are only imported once the window is opened, so that the environment
+can be imported and run on a machine without a display (e.g. in the worker processes of a `SubprocVecEnv`).
+"""
 
-import random
 from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
+from time import perf_counter
 from typing import Optional, Tuple
 
 import gym
 import numpy as np
-import pyglet
 from gym import spaces
-from gym.envs.classic_control import rendering
-from pyglet.window import key
 
+from learning2write.instrumentation import Stats
+from learning2write.metrics import MAX_TABLE_CELLS, get_f1_table, precision_recall_f1
 from learning2write.patterns import PatternSet, Patterns3x3
+from learning2write.raster import Rasterizer
+from learning2write.strokes import StrokeActions, PEN_DOWN
 
 MOVE_UP = 0
 MOVE_DOWN = 1
@@ -21,15 +28,129 @@ MOVE_RIGHT = 3
 FILL_SQUARE = 4
 QUIT = 5
 
+PENALTY_PER_STEP = -1
+CORRECT_FILL_REWARD = 10
+CORRECT_PATTERN_REWARD = 100
+OUT_OF_BOUNDS_PENALTY = -100
+
+# How the agent acts: one cell at a time, or in strokes of several cells (see `learning2write.strokes`).
+ACTION_MODES = ['cells', 'strokes']
+
+
+@lru_cache(maxsize=None)
+def get_fill_reward_table(n_cells: int) -> np.ndarray:
+    """Tabulate the reward for filling a cell, for every possible count of true positives, false positives and targets
+    in a grid, see `learning2write.metrics.get_f1_table()`.
+
+    :param n_cells: The total number of cells in a pattern, at most `learning2write.metrics.MAX_TABLE_CELLS`.
+    :return: An array with the shape (n_cells + 1, n_cells + 1, n_cells + 1, 2) where `[tp, fp, n_targets, is_target]`
+             holds exactly the same reward as `WritingEnvironment` calculates for filling a cell that is (1) or is not
+             (0) filled in the reference pattern.
+    """
+    f1 = get_f1_table(n_cells)
+    rewards = np.zeros(f1.shape + (2,))
+    # A count cannot go past the number of cells, so the last entry along the count that increases is never used.
+    rewards[:, :-1, :, 0] = (f1[:, 1:] - f1[:, :-1]) * CORRECT_FILL_REWARD
+    rewards[:-1, :, :, 1] = (f1[1:] - f1[:-1]) * CORRECT_FILL_REWARD
+    rewards.flags.writeable = False
+
+    return rewards
+
+
+def get_positions(observations: np.ndarray) -> np.ndarray:
+    """Find the agent in a batch of observations.
+
+    :param observations: The observations with the shape (n, height, width, 3).
+    :return: The agent's position (row, col) in each observation.
+    """
+    width = observations.shape[2]
+    flat_positions = observations[..., 2].reshape(len(observations), -1).argmax(axis=1)
+
+    return np.stack([flat_positions // width, flat_positions % width], axis=1)
+
+
+def get_action_mode(pattern_shape: Tuple[int, int], n_actions: int) -> str:
+    """Work out the action mode of an environment, or of a policy trained on one, from its number of actions.
+
+    :param pattern_shape: The shape (height, width) of the grid.
+    :param n_actions: The number of actions.
+    :return: The action mode, see `ACTION_MODES`.
+    """
+    if n_actions == WritingEnvironment.N_DISCRETE_ACTIONS:
+        return 'cells'
+    elif n_actions == StrokeActions(pattern_shape).n_actions:
+        return 'strokes'
+    else:
+        raise ValueError('Unrecognised number of actions \'%d\' for a %dx%d grid'
+                         % ((n_actions,) + tuple(pattern_shape)))
+
+
+def get_default_max_steps(pattern_shape: Tuple[int, int], action_mode='cells') -> int:
+    """Get the default maximum number of steps per episode.
+
+    :param pattern_shape: The shape (height, width) of the grid.
+    :param action_mode: The action mode, see `ACTION_MODES`.
+    :return: Just enough moves to cover the grid twice in the 'cells' action mode, or enough strokes to cross the grid
+             twice in each direction in the 'strokes' action mode.
+    """
+    height, width = pattern_shape
+
+    return 2 * height * width if action_mode == 'cells' else 2 * (height + width)
+
+
+def get_action_masks(patterns: np.ndarray, positions: np.ndarray,
+                     stroke_actions: Optional[StrokeActions] = None) -> np.ndarray:
+    """Find which actions are worth taking in a batch of states.
+
+    Moving off the grid ends the episode with a penalty and filling a cell that is already filled does nothing, so
+    both are masked out. Quitting is always allowed.
+
+    :param patterns: The drawn patterns with the shape (n, height, width).
+    :param positions: The agents' positions (row, col) with the shape (n, 2).
+    :param stroke_actions: The stroke actions if using the 'strokes' action mode, see `StrokeActions.get_masks()`.
+    :return: A boolean array with the shape (n, n_actions) that is True for the actions that are allowed.
+    """
+    if stroke_actions is not None:
+        return stroke_actions.get_masks(patterns, positions)
+
+    n, height, width = patterns.shape
+    rows, cols = positions[:, 0], positions[:, 1]
+    masks = np.ones((n, WritingEnvironment.N_DISCRETE_ACTIONS), dtype=bool)
+    masks[:, MOVE_UP] = rows > 0
+    masks[:, MOVE_DOWN] = rows < height - 1
+    masks[:, MOVE_LEFT] = cols > 0
+    masks[:, MOVE_RIGHT] = cols < width - 1
+    masks[:, FILL_SQUARE] = patterns[np.arange(n), rows, cols] == 0
+
+    return masks
+
+
+def get_position_masks(pattern_shape: Tuple[int, int], stroke_actions: Optional[StrokeActions] = None) -> np.ndarray:
+    """Find which actions are allowed from each cell of an empty grid.
+
+    Apart from filling a cell (or drawing a dot), whether an action is allowed only depends on the agent's position, so
+    the masks of `get_action_masks()` can be looked up in this table and then combined with whether the agent's cell is
+    filled, e.g. by the masked policies of `train.py`.
+
+    :param pattern_shape: The shape (height, width) of the grid.
+    :param stroke_actions: The stroke actions if using the 'strokes' action mode.
+    :return: A boolean array with the shape (height * width, n_actions) with the mask of each cell, in row-major order.
+    """
+    n_cells = pattern_shape[0] * pattern_shape[1]
+    positions = np.stack(np.unravel_index(np.arange(n_cells), pattern_shape), axis=1)
+
+    return get_action_masks(np.zeros((n_cells,) + tuple(pattern_shape), dtype=np.uint8), positions, stroke_actions)
+
 
 class WritingEnvironment(gym.Env):
     """A custom gym environment for teaching RL agents how to write."""
-    metadata = {'render.modes': ['human', 'text']}
+    metadata = {'render.modes': ['human', 'rgb_array', 'text']}
 
     N_DISCRETE_ACTIONS = 6
 
     def __init__(self, pattern_set: Optional[PatternSet] = None, max_steps=1000,
-                 cell_size: Optional[int] = None, target_window_height=480):
+                 cell_size: Optional[int] = None, target_window_height=480, observation_view=False, instrument=False,
+                 action_mode='cells', report_action_mask=False):
         """Create a writing environment.
 
         :param pattern_set: The set of patterns to use. Defaults to 3x3.
@@ -37,38 +158,110 @@ class WritingEnvironment(gym.Env):
         :param cell_size: The size of the squares representing a 'pixel' in the pattern. By default a cell size is
                           automatically chosen.
         :param target_window_height: The desired height of the display window. Ignored if cell_size is set.
+        :param observation_view: Whether observations should be read-only views of the environment's observation
+                                 buffer instead of copies. Views avoid an allocation per step, but their contents change
+                                 when the environment is stepped or reset.
+        :param instrument: Whether or not to time each phase of resetting, stepping and rendering the environment,
+                           see `get_stats()` and `learning2write.instrumentation`.
+        :param action_mode: Either 'cells' to move and fill one cell at a time, or 'strokes' to draw lines of several
+                            cells in a single step (see `learning2write.strokes`).
+        :param report_action_mask: Whether `step()` should pass the action mask of the new state as
+                                   `info['action_mask']`, see `action_mask`. The masked policies work the mask out from
+                                   the observation, so this is only needed by code that wants it without doing so.
         """
         super(WritingEnvironment, self).__init__()
 
+        if action_mode not in ACTION_MODES:
+            raise ValueError('Unrecognised action mode \'%s\'' % action_mode)
+
         # Environment State
         self.pattern_set = pattern_set if pattern_set else Patterns3x3()
         self.pattern_shape = (self.rows, self.cols)
-        self.pattern: np.ndarray = np.zeros(self.pattern_shape)
-        self.reference_pattern: np.ndarray = np.zeros(self.pattern_shape)
+        # The observation is kept in one HWC buffer that is updated in place, only touching the cells that change.
+        # The current pattern and the reference pattern are views of its first two channels, and the third channel
+        # marks the agent's position.
+        self._observation = np.zeros((self.rows, self.cols, 3), dtype=np.uint8)
+        self.pattern: np.ndarray = self._observation[:, :, 0]
+        self.reference_pattern: np.ndarray = self._observation[:, :, 1]
+        self.observation_view = observation_view
+        self.report_action_mask = report_action_mask
+        # Running counts of the filled cells that are (or are not) filled in the reference pattern, and of the filled
+        # cells in the reference pattern. These are updated as cells are filled so that calculating the f1 score
+        # does not require looking at the whole grid.
+        self._true_positives = 0
+        self._false_positives = 0
+        self._n_targets = 0
         # Agent State
-        self.agent_position: np.ndarray = np.zeros(2, dtype=int)
+        self.agent_position: Tuple[int, int] = (0, 0)
+        self._observation[0, 0, 2] = 1
         # GUI
-        self.viewer: Optional[rendering.Viewer] = None
+        # The window and what is drawn in it, see `_render()`.
+        self.viewer = None
+        self.patterns_geom = None
+        self.rasterizer: Optional[Rasterizer] = None
         self.cell_size = cell_size if cell_size else self._get_cell_size(target_window_height)
         self.window_height = (self.rows + 2) * self.cell_size
         self.window_width = (2 * self.cols + 4) * self.cell_size
         # Environment Stuff
         self.steps = 0
         self.max_steps = max_steps
-        self.action_space = spaces.Discrete(WritingEnvironment.N_DISCRETE_ACTIONS)
+        self.action_mode = action_mode
+        self.stroke_actions = StrokeActions(self.pattern_shape) if action_mode == 'strokes' else None
+        self.action_space = spaces.Discrete(self.stroke_actions.n_actions if self.stroke_actions
+                                            else WritingEnvironment.N_DISCRETE_ACTIONS)
         self.observation_space = spaces.Box(low=0, high=1, shape=(self.rows, self.cols, 3), dtype=np.uint8)
+        # Rewards
+        # The f1 scores, and the rewards for filling a cell, are looked up in tables if the grid is small enough.
+        self._f1_table = get_f1_table(self.n_cells) if self.n_cells <= MAX_TABLE_CELLS else None
+        self._fill_rewards = get_fill_reward_table(self.n_cells) if self.n_cells <= MAX_TABLE_CELLS else None
+        # Instrumentation
+        self.stats: Optional[Stats] = Stats() if instrument else None
 
     @property
     def state(self) -> np.ndarray:
         """Get the current state of the environment.
 
-        :return: The state as a tensor.
+        :return: The state as a HWC tensor. This is a read-only view of the observation buffer if `observation_view`
+                 is set, otherwise a copy of it.
         """
-        pos = np.zeros(self.pattern_shape)
+        if self.stats is not None:
+            start = perf_counter()
+
+        if self.observation_view:
+            state = self._observation.view()
+            state.flags.writeable = False
+        else:
+            state = self._observation.copy()
+
+        if self.stats is not None:
+            self.stats.record('observation', perf_counter() - start)
+
+        return state
+
+    @property
+    def action_mask(self) -> np.ndarray:
+        """Get which actions are worth taking in the current state, see `get_action_masks()`.
+
+        :return: A boolean array that is True for the actions that are allowed. This is also passed as
+                 `info['action_mask']` by `step()` if `report_action_mask` is set.
+        """
+        if self.stroke_actions:
+            return self.stroke_actions.get_masks(self.pattern[np.newaxis], np.array([self.agent_position]))[0]
+
         row, col = self.agent_position
-        pos[row, col] = 1
+        # The same as `get_action_masks()`, without the overhead of handling a batch.
+        mask = np.ones(WritingEnvironment.N_DISCRETE_ACTIONS, dtype=bool)
+        mask[MOVE_UP] = row > 0
+        mask[MOVE_DOWN] = row < self.rows - 1
+        mask[MOVE_LEFT] = col > 0
+        mask[MOVE_RIGHT] = col < self.cols - 1
+        mask[FILL_SQUARE] = self.pattern[row, col] == 0
 
-        return np.stack((self.pattern, self.reference_pattern, pos), axis=2)  # create HWC tensor
+        return mask
+
+    @property
+    def n_cells(self) -> int:
+        return self.rows * self.cols
 
     @property
     def rows(self):
@@ -84,77 +277,99 @@ class WritingEnvironment(gym.Env):
 
         :return: Whether or not the parent program should quit.
         """
-        return self.viewer and \
-               (not self.viewer.isopen or self.keys.key_was_pressed(key.ESCAPE) or self.keys.key_was_pressed(key.Q))
+        if not self.viewer:
+            return False
+
+        from pyglet.window import key
+
+        return not self.viewer.isopen or self.keys.key_was_pressed(key.ESCAPE) or self.keys.key_was_pressed(key.Q)
 
     def seed(self, seed=None):
         self.pattern_set.seed(seed)
-        random.seed(seed)
 
         return [seed]
 
-    def reset(self):
-        self.pattern = np.zeros(self.pattern_shape)
-        self.agent_position = np.zeros(2, dtype=int)
-        self.reference_pattern = self.pattern_set.sample()
-        self.steps = 0
+    def get_stats(self) -> dict:
+        """Get the timings of each phase of the environment, if it is instrumented.
 
-        return self.state
+        :return: The statistics of each phase, see `learning2write.instrumentation.Stats.as_dict()`. Empty if the
+                 environment is not instrumented.
+        """
+        return self.stats.as_dict() if self.stats is not None else {}
 
-    def step(self, action: int):
-        penalty_per_step = -1
-        correct_fill_reward = 10
-        correct_pattern_reward = 100
-        out_of_bounds_penalty = -100
+    def reset_stats(self):
+        """Forget the timings recorded so far."""
+        if self.stats is not None:
+            self.stats.clear()
 
-        reward = penalty_per_step
-        done = False
-        info = dict()
+    def reset(self):
+        if self.stats is not None:
+            start = perf_counter()
 
-        if action == FILL_SQUARE:
-            row, col = self.agent_position
+        self.pattern[:] = 0
 
-            if self.pattern[row, col] == 0:
-                _, _, f1 = self._precision_recall_f1(self.reference_pattern, self.pattern)
+        if self.stats is not None:
+            sample_start = perf_counter()
+            self.reference_pattern[:] = self.pattern_set.sample()
+            self.stats.record('sample', perf_counter() - sample_start)
+        else:
+            self.reference_pattern[:] = self.pattern_set.sample()
 
-                self.pattern[row, col] = 1
+        self._set_agent_position((0, 0))
+        self.steps = 0
+        self._true_positives = 0
+        self._false_positives = 0
+        self._n_targets = np.count_nonzero(self.reference_pattern == 1)
+        state = self.state
 
-                _, _, f1_ = self._precision_recall_f1(self.reference_pattern, self.pattern)
+        if self.stats is not None:
+            self.stats.record('reset', perf_counter() - start)
 
-                # Reward is proportional to the f1 score.
-                # Moving towards a more accurate copy increases the reward.
-                reward = (f1_ - f1) * correct_fill_reward
-        elif action == QUIT:
-            # Give a bonus proportional to the accuracy of the reproduction of the reference pattern.
-            _, _, f1 = self._precision_recall_f1(self.reference_pattern, self.pattern)
-            reward = f1 * correct_pattern_reward - (1 - f1) * correct_pattern_reward
+        return state
 
-            done = True
-        elif 0 <= action < WritingEnvironment.N_DISCRETE_ACTIONS:
-            # Agent should only move within the defined grid world.
-            move_was_valid = self._move(action)
+    def step(self, action: int):
+        if self.stats is not None:
+            start = perf_counter()
 
-            if not move_was_valid:
-                reward = out_of_bounds_penalty
-                done = True
+        if self.stroke_actions:
+            reward, done = self._stroke(action)
         else:
-            raise ValueError('Unrecognised action: %s' % str(action))
+            reward, done = self._cell_action(action)
 
+        info = dict()
         self.steps += 1
 
         if self.steps >= self.max_steps:
             done = True
 
-        return self.state, reward, done, info
+        state = self.state
+
+        if self.report_action_mask:
+            info['action_mask'] = self.action_mask
+
+        if self.stats is not None:
+            self.stats.record('step', perf_counter() - start)
+
+        return state, reward, done, info
 
     def render(self, mode='human', close=False):
+        if self.stats is not None:
+            start = perf_counter()
+
         if mode == 'text':
-            self._render_text()
-        elif mode in {'human', 'rgb_array'}:
-            return self._render(mode)
+            result = self._render_text()
+        elif mode == 'rgb_array':
+            result = self._render_rgb_array()
+        elif mode == 'human':
+            result = self._render(mode)
         else:
             raise NotImplementedError
 
+        if self.stats is not None:
+            self.stats.record('render', perf_counter() - start)
+
+        return result
+
     def wait(self, duration):
         """Essentially perform a no-op while still processing GUI events.
 
@@ -179,6 +394,9 @@ class WritingEnvironment(gym.Env):
         if self.viewer is not None:
             self.viewer.close()
             self.viewer = None
+            self.patterns_geom = None
+
+        self.pattern_set.close()
 
     @staticmethod
     def _precision_recall_f1(target, prediction) -> Tuple[float, float, float]:
@@ -206,6 +424,130 @@ class WritingEnvironment(gym.Env):
 
         return precision, recall, f1
 
+    def _f1(self) -> float:
+        """Calculate the f1 score of the current pattern from the running counts of filled cells.
+
+        :return: The same f1 score as `_precision_recall_f1(self.reference_pattern, self.pattern)`.
+        """
+        if self._f1_table is not None:
+            return self._f1_table[self._true_positives, self._false_positives, self._n_targets]
+
+        _, _, f1 = precision_recall_f1(self._true_positives, self._false_positives, self._n_targets, self.n_cells)
+
+        return f1
+
+    def _cell_action(self, action: int) -> Tuple[float, bool]:
+        """Carry out an action of the 'cells' action mode.
+
+        :param action: The action.
+        :return: The reward, and whether the episode has ended.
+        """
+        reward = PENALTY_PER_STEP
+        done = False
+
+        if action == FILL_SQUARE:
+            row, col = self.agent_position
+
+            if self.pattern[row, col] == 0:
+                if self.stats is not None:
+                    reward_start = perf_counter()
+
+                self.pattern[row, col] = 1
+                is_target = int(self.reference_pattern[row, col] == 1)
+
+                # Reward is proportional to the f1 score.
+                # Moving towards a more accurate copy increases the reward.
+                if self._fill_rewards is not None:
+                    reward = self._fill_rewards[self._true_positives, self._false_positives, self._n_targets, is_target]
+                    self._true_positives += is_target
+                    self._false_positives += 1 - is_target
+                else:
+                    f1 = self._f1()
+                    self._true_positives += is_target
+                    self._false_positives += 1 - is_target
+                    reward = (self._f1() - f1) * CORRECT_FILL_REWARD
+
+                if self.stats is not None:
+                    self.stats.record('reward', perf_counter() - reward_start)
+        elif action == QUIT:
+            reward = self._quit_reward()
+            done = True
+        elif 0 <= action < WritingEnvironment.N_DISCRETE_ACTIONS:
+            # Agent should only move within the defined grid world.
+            move_was_valid = self._move(action)
+
+            if not move_was_valid:
+                reward = OUT_OF_BOUNDS_PENALTY
+                done = True
+        else:
+            raise ValueError('Unrecognised action: %s' % str(action))
+
+        return reward, done
+
+    def _stroke(self, action: int) -> Tuple[float, bool]:
+        """Carry out an action of the 'strokes' action mode, see `learning2write.strokes`.
+
+        The reward is the same as for filling cells one at a time: the change in the f1 score for the cells that the
+        stroke (or dot) fills, or the per-step penalty if it does not fill any.
+
+        :param action: The action.
+        :return: The reward, and whether the episode has ended.
+        """
+        stroke_actions = self.stroke_actions
+        reward = PENALTY_PER_STEP
+
+        if action == stroke_actions.quit_action:
+            return self._quit_reward(), True
+        elif not 0 <= action <= stroke_actions.dot_action:
+            raise ValueError('Unrecognised action: %s' % str(action))
+
+        position = np.array([self.agent_position])
+
+        if action < stroke_actions.n_strokes:
+            end = tuple(position[0] + stroke_actions.end_offsets[action])
+
+            # Same as a move, a stroke that would leave the grid ends the episode instead.
+            if not self._is_position_valid(end):
+                return OUT_OF_BOUNDS_PENALTY, True
+
+        if action == stroke_actions.dot_action or stroke_actions.pens[action] == PEN_DOWN:
+            if self.stats is not None:
+                reward_start = perf_counter()
+
+            _, rows, cols = stroke_actions.get_cells(position, np.array([action]))
+            is_new = self.pattern[rows, cols] == 0
+
+            if is_new.any():
+                rows, cols = rows[is_new], cols[is_new]
+                f1 = self._f1()
+                self.pattern[rows, cols] = 1
+                n_targets_filled = np.count_nonzero(self.reference_pattern[rows, cols] == 1)
+                self._true_positives += n_targets_filled
+                self._false_positives += len(rows) - n_targets_filled
+                reward = (self._f1() - f1) * CORRECT_FILL_REWARD
+
+            if self.stats is not None:
+                self.stats.record('reward', perf_counter() - reward_start)
+
+        if action < stroke_actions.n_strokes:
+            self._set_agent_position(end)
+
+        return reward, False
+
+    def _quit_reward(self) -> float:
+        """Calculate the reward for quitting."""
+        if self.stats is not None:
+            reward_start = perf_counter()
+
+        # Give a bonus proportional to the accuracy of the reproduction of the reference pattern.
+        f1 = self._f1()
+        reward = f1 * CORRECT_PATTERN_REWARD - (1 - f1) * CORRECT_PATTERN_REWARD
+
+        if self.stats is not None:
+            self.stats.record('reward', perf_counter() - reward_start)
+
+        return reward
+
     def _get_cell_size(self, target_window_height) -> int:
         """Calculate the cell size.
 
@@ -238,11 +580,20 @@ class WritingEnvironment(gym.Env):
         new_pos = (row, col)
 
         if self._is_position_valid(new_pos):
-            self.agent_position = new_pos
+            self._set_agent_position(new_pos)
             return True
         else:
             return False
 
+    def _set_agent_position(self, position: Tuple[int, int]):
+        """Update the agent's position and the position channel of the observation buffer.
+
+        :param position: The agent's new position.
+        """
+        self._observation[self.agent_position + (2,)] = 0
+        self._observation[position + (2,)] = 1
+        self.agent_position = position
+
     def _is_position_valid(self, point):
         """Check if a proposed agent position is valid or not.
 
@@ -280,74 +631,47 @@ class WritingEnvironment(gym.Env):
 
         print('―' * 2 * (self.cols + 2))
 
-    def _render(self, mode='human'):
-        """Render the environment to a window.
+    def _render_rgb_array(self) -> np.ndarray:
+        """Render the environment to an RGB array without a window, see `learning2write.raster`.
 
-        :return: If mode is 'human', returns True if the display window is still open, otherwise false.
-                 If mode is 'rgb_array', returns a ndarray of the raw pixels.
+        :return: The frame with the shape (window_height, window_width, 3). This is a read-only view of a buffer that
+                 is overwritten by the next call if `observation_view` is set, otherwise it is a copy.
         """
-        if self.viewer is None:
-            self.viewer = rendering.Viewer(self.window_width, self.window_height)
+        if self.rasterizer is None:
+            self.rasterizer = Rasterizer(self.pattern_shape, self.cell_size)
 
-            pyglet.gl.glClearColor(1, 1, 1, 1)
-            self.keys = KeyStateHandler()
-            self.viewer.window.push_handlers(self.keys)
-
-        self._draw_state()
-
-        return self.viewer.render(return_rgb_array=mode == 'rgb_array')
-
-    def _draw_state(self):
-        """Draw the current state (the reference pattern, the current pattern, and the agent's position)."""
-        self._draw_pattern(self.reference_pattern, (self.cell_size, self.window_height - self.cell_size))
-        self._draw_pattern(self.pattern, (self.window_width // 2 + self.cell_size, self.window_height - self.cell_size),
-                           draw_position_marker=True)
+        frame = self.rasterizer.render(self.pattern, self.reference_pattern, self.agent_position)
 
-    def _draw_pattern(self, pattern: np.ndarray, origin: Tuple[int, int], draw_position_marker: bool = False):
-        """Draw a pattern.
+        if self.observation_view:
+            frame = frame.view()
+            frame.flags.writeable = False
 
-        :param pattern: The pattern to draw.
-        :param origin: The pixel coordinates of the top left corner of where to draw the pattern.
-        :param draw_position_marker: Whether or not to draw the agent's position marker onto the pattern.
-        """
-        x, y = origin
-
-        for row in range(self.cols):
-            for col in range(self.rows):
-                self._draw_cell((x + col * self.cell_size, y - row * self.cell_size), filled=pattern[row, col] > 0)
-
-        if draw_position_marker:
-            row, col = self.agent_position
-            self._draw_position_marker((x + col * self.cell_size, y - (row + 1) * self.cell_size))
+            return frame
+        else:
+            return frame.copy()
 
-    def _draw_cell(self, origin, filled=True):
-        """Draw a 'cell', or something close to a pixel, of a pattern.
+    def _render(self, mode='human'):
+        """Render the environment to a window.
 
-        :param origin: The pixel coordinates of the top left corner of the cell to draw.
-        :param filled: Whether or not to colour in the shape.
+        :return: True if the display window is still open, otherwise false.
         """
-        x, y = origin
-        bl = [x, y]
-        br = [x + self.cell_size, y]
-        tl = [x, y - self.cell_size]
-        tr = [x + self.cell_size, y - self.cell_size]
-
-        self.viewer.draw_polygon([bl, tl, tr, br], filled, color=(0, 0, 0))
+        if self.viewer is None:
+            import pyglet
+            from gym.envs.classic_control import rendering
+            from learning2write.viewer import PatternsGeom
 
-    def _draw_position_marker(self, origin, filled=True, resolution=16):
-        """Draw a 'cell', or something close to a pixel, of a pattern.
+            self.viewer = rendering.Viewer(self.window_width, self.window_height)
 
-        :param origin: The pixel coordinates of the top left corner of the cell to draw.
-        :param filled: Whether or not to colour in the shape.
-        :param resolution: How many points to use for drawing the circle. Most points means a smoother circle.
-        """
-        radius = self.cell_size / 4
-        offset = self.cell_size // 2
+            pyglet.gl.glClearColor(1, 1, 1, 1)
+            self.keys = KeyStateHandler()
+            self.viewer.window.push_handlers(self.keys)
+            self.patterns_geom = PatternsGeom(self.pattern_shape, self.cell_size, self.window_width,
+                                              self.window_height)
+            self.viewer.add_geom(self.patterns_geom)
 
-        geom = self.viewer.draw_circle(radius, resolution, filled, color=(255, 0, 0))
+        self.patterns_geom.update(self.pattern, self.reference_pattern, self.agent_position)
 
-        for i, point in enumerate(geom.v):
-            geom.v[i] = (point[0] + origin[0] + offset, point[1] + origin[1] + offset)
+        return self.viewer.render()
 
 
 class KeyStateHandler:
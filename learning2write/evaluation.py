@@ -0,0 +1,265 @@
+"""This module defines the headless evaluation of agents in the learning2write environment.
+
+Episodes are run in a `BatchedWritingEnvironment` without rendering, so an agent's policy is queried once per step for
+a whole batch of observations. Nothing here depends on a particular RL library: an agent is either a function that maps
+a batch of observations to a batch of actions, or a model class with stable-baselines' `load`/`predict` interface.
+
+`AsyncEvaluator` runs evaluations in a separate process so that a model can be evaluated while it is training.
+"""
+import io
+import multiprocessing
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from learning2write.checkpoints import Snapshot
+from learning2write.env import get_action_mode, get_default_max_steps
+from learning2write.metrics import precision_recall_f1
+from learning2write.patterns import PatternSet, get_pattern_set
+from learning2write.vec_env import BatchedWritingEnvironment
+
+RESULT_KEYS = ['returns', 'lengths', 'f1', 'correct']
+
+
+def evaluate(predict: Callable[[np.ndarray], np.ndarray], pattern_set: PatternSet, n_episodes: int, n_envs=32,
+             max_steps: Optional[int] = None, seed: Optional[int] = None, action_mode='cells') -> dict:
+    """Run an agent for a number of episodes and record how it does.
+
+    :param predict: The agent's policy, a function that takes a batch of observations and returns an action for each.
+    :param pattern_set: The pattern set to evaluate the agent on.
+    :param n_episodes: How many episodes to run.
+    :param n_envs: How many environments to run at once.
+    :param max_steps: The maximum number of steps per episode. Defaults to the same limit as in training, see
+                      `learning2write.env.get_default_max_steps()`.
+    :param seed: The seed for choosing patterns.
+    :param action_mode: The action mode that the agent acts in, see `learning2write.env.ACTION_MODES`.
+    :return: A dictionary of arrays with the return, length, f1 score and whether the agent drew the reference
+             pattern exactly, of each episode.
+    """
+    n_envs = min(n_envs, n_episodes)
+    max_steps = max_steps if max_steps else get_default_max_steps((pattern_set.height, pattern_set.width), action_mode)
+    env = BatchedWritingEnvironment(n_envs, pattern_set, max_steps=max_steps, action_mode=action_mode)
+    env.seed(seed)
+
+    # Each environment runs a fixed number of episodes. Otherwise the environments that happen to get short episodes
+    # would run more of them, which would bias the results towards short episodes.
+    quotas = np.full(n_envs, n_episodes // n_envs)
+    quotas[:n_episodes % n_envs] += 1
+    n_finished = np.zeros(n_envs, dtype=int)
+    returns = np.zeros(n_envs)
+    lengths = np.zeros(n_envs, dtype=int)
+    results = {key: [] for key in RESULT_KEYS}
+
+    observations = env.reset()
+
+    while np.any(n_finished < quotas):
+        observations, rewards, dones, infos = env.step(predict(observations))
+        returns += rewards
+        lengths += 1
+
+        for i in np.flatnonzero(dones):
+            if n_finished[i] < quotas[i]:
+                # The environment has already been reset, so score the observation from the end of the episode.
+                terminal_observation = infos[i]['terminal_observation']
+                pattern, reference_pattern = terminal_observation[..., 0] == 1, terminal_observation[..., 1] == 1
+                _, _, f1 = precision_recall_f1(np.count_nonzero(pattern & reference_pattern),
+                                               np.count_nonzero(pattern & ~reference_pattern),
+                                               np.count_nonzero(reference_pattern), env.n_cells)
+
+                results['returns'].append(returns[i])
+                results['lengths'].append(lengths[i])
+                results['f1'].append(f1)
+                results['correct'].append(np.array_equal(pattern, reference_pattern))
+                n_finished[i] += 1
+
+            returns[i] = 0
+            lengths[i] = 0
+
+    return {key: np.array(values) for key, values in results.items()}
+
+
+def get_model_action_mode(model, pattern_set: PatternSet) -> str:
+    """Work out which action mode a model was trained in from its action space, see `learning2write.env.ACTION_MODES`.
+    """
+    return get_action_mode((pattern_set.height, pattern_set.width), model.action_space.n)
+
+
+def evaluate_model(model_class, model_path: str, pattern_set_name: str, n_episodes: int, n_envs=32,
+                   seed: Optional[int] = None, deterministic=False, rotate_patterns=False, flip_patterns=False,
+                   part=0, n_parts=1) -> dict:
+    """Load a saved model and evaluate it, see `evaluate()`.
+
+    This only takes picklable arguments so that it can be run in a worker process.
+
+    :param model_class: The class of the model, e.g. `stable_baselines.ACKTR`. This must have a `load` class method
+                        that takes the path of a saved model, and the model a `predict` method that returns the actions
+                        for a batch of observations as the first item of a tuple.
+    :param model_path: The path of the saved model.
+    :param pattern_set_name: The name of the pattern set to evaluate the model on.
+    :param n_episodes: How many episodes to run.
+    :param n_envs: How many environments to run at once.
+    :param seed: The seed for choosing patterns.
+    :param deterministic: Whether the model should choose the most likely actions instead of sampling them.
+    :param rotate_patterns: Whether or not the patterns should be randomly rotated.
+    :param flip_patterns: Whether or not the patterns should be randomly flipped.
+    :param part: Which part of the patterns to evaluate the model on, see `PatternSet.set_part()`. When the episodes
+                 are split between several processes, giving each process its own part means that the EMNIST pattern
+                 sets, which read the images in order, evaluate the model on different images in each process.
+    :param n_parts: How many parts the patterns are split into.
+    :return: The results of each episode, see `evaluate()`.
+    """
+    model = model_class.load(model_path)
+    pattern_set = get_pattern_set(pattern_set_name, rotate_patterns, flip_patterns=flip_patterns)
+    pattern_set.set_part(part, n_parts)
+
+    def predict(observations):
+        actions, _ = model.predict(observations, deterministic=deterministic)
+
+        return actions
+
+    try:
+        return evaluate(predict, pattern_set, n_episodes, n_envs, seed=seed,
+                        action_mode=get_model_action_mode(model, pattern_set))
+    finally:
+        pattern_set.close()
+
+
+def merge_results(results: List[dict]) -> dict:
+    """Combine the results of several evaluations, e.g. from several worker processes.
+
+    :param results: The results of each evaluation, see `evaluate()`.
+    :return: The results of all of the episodes.
+    """
+    return {key: np.concatenate([result[key] for result in results]) for key in RESULT_KEYS}
+
+
+def summarise(results: dict) -> dict:
+    """Summarise the results of an evaluation.
+
+    :param results: The results of each episode, see `evaluate()`.
+    :return: A JSON-serialisable dictionary with the number of episodes, the accuracy (the fraction of episodes where
+             the agent drew the reference pattern exactly), the mean f1 score, and the distributions of the returns and
+             episode lengths.
+    """
+    def distribution(values):
+        return {'mean': float(np.mean(values)), 'std': float(np.std(values)), 'min': float(np.min(values)),
+                'p25': float(np.percentile(values, 25)), 'p50': float(np.percentile(values, 50)),
+                'p75': float(np.percentile(values, 75)), 'max': float(np.max(values))}
+
+    return {
+        'n_episodes': len(results['returns']),
+        'accuracy': float(np.mean(results['correct'])),
+        'f1': float(np.mean(results['f1'])),
+        'return': distribution(results['returns']),
+        'length': distribution(results['lengths'])
+    }
+
+
+class AsyncEvaluator:
+    """Evaluates snapshots of a model in a separate process, see `evaluate()`.
+
+    The evaluation process keeps one copy of the model and loads the parameters of each snapshot into it, so only the
+    first snapshot pays for building the model. Every evaluation uses the same seed, and so the same patterns, so that
+    the results of different snapshots can be compared.
+    """
+
+    def __init__(self, model_class, pattern_set_name: str, n_episodes=1000, n_envs=64, seed=0, deterministic=True,
+                 rotate_patterns=False, flip_patterns=False):
+        """Start the evaluation process.
+
+        :param model_class: The class of the model, e.g. `stable_baselines.ACKTR`. This must have stable-baselines'
+                            `load` class method, and the model `load_parameters` and `predict` methods.
+        :param pattern_set_name: The name of the pattern set to evaluate the model on.
+        :param n_episodes: How many episodes to run per evaluation.
+        :param n_envs: How many environments to run at once.
+        :param seed: The seed for choosing patterns.
+        :param deterministic: Whether the model should choose the most likely actions instead of sampling them.
+        :param rotate_patterns: Whether or not the patterns should be randomly rotated.
+        :param flip_patterns: Whether or not the patterns should be randomly flipped.
+        """
+        # TensorFlow does not cope with being forked, so the process is started fresh.
+        context = multiprocessing.get_context('spawn')
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_evaluation_worker,
+                                        args=(self._requests, self._results, model_class, pattern_set_name,
+                                              n_episodes, n_envs, seed, deterministic, rotate_patterns,
+                                              flip_patterns),
+                                        daemon=True)
+        self._process.start()
+        self.n_pending = 0
+
+    @property
+    def is_busy(self) -> bool:
+        return self.n_pending > 0
+
+    def submit(self, key, snapshot_: Snapshot):
+        """Start evaluating a snapshot of the model.
+
+        :param key: What to identify the results of the evaluation by, e.g. the number of updates of the snapshot.
+        :param snapshot_: The snapshot of the model, see `checkpoints.snapshot()`.
+        """
+        # Pickled here, in the same format as a saved model, so that the evaluation process can load it like one.
+        buffer = io.BytesIO()
+        snapshot_.save_to_file(buffer, data=snapshot_.data, params=snapshot_.params)
+        self._requests.put((key, buffer.getvalue()))
+        self.n_pending += 1
+
+    def poll(self, block=False) -> List[Tuple[object, dict]]:
+        """Get the results of the evaluations that have finished.
+
+        :param block: Whether to wait for every evaluation that has been submitted to finish.
+        :return: The key and the summary (see `summarise()`) of each evaluation that has finished, in the order that
+                 they were submitted. Raises RuntimeError if an evaluation failed.
+        """
+        results = []
+
+        while self.n_pending > 0 and (block or not self._results.empty()):
+            key, summary, error = self._results.get()
+            self.n_pending -= 1
+
+            if error is not None:
+                raise RuntimeError('Evaluation of \'%s\' failed:\n%s' % (key, error))
+
+            results.append((key, summary))
+
+        return results
+
+    def close(self) -> List[Tuple[object, dict]]:
+        """Wait for the evaluations that have been submitted and stop the evaluation process.
+
+        :return: The results of the evaluations that had not been polled yet, see `poll()`.
+        """
+        try:
+            return self.poll(block=True)
+        finally:
+            self._requests.put(None)
+            self._process.join()
+
+
+def _evaluation_worker(requests, results, model_class, pattern_set_name: str, n_episodes: int, n_envs: int, seed: int,
+                       deterministic: bool, rotate_patterns: bool, flip_patterns: bool):
+    """Evaluate the snapshots of a model until told to stop, see `AsyncEvaluator`."""
+    pattern_set = get_pattern_set(pattern_set_name, rotate_patterns, flip_patterns=flip_patterns)
+    model = None
+
+    def predict(observations):
+        actions, _ = model.predict(observations, deterministic=deterministic)
+
+        return actions
+
+    try:
+        for key, saved_model in iter(requests.get, None):
+            try:
+                if model is None:
+                    model = model_class.load(io.BytesIO(saved_model))
+                else:
+                    model.load_parameters(io.BytesIO(saved_model))
+
+                results.put((key, summarise(evaluate(predict, pattern_set, n_episodes, n_envs, seed=seed,
+                                                     action_mode=get_model_action_mode(model, pattern_set))), None))
+            except Exception:
+                results.put((key, None, traceback.format_exc()))
+    finally:
+        pattern_set.close()
@@ -0,0 +1,230 @@
+"""This module runs saved MLP policies with NumPy, without TensorFlow.
+
+A stable-baselines model file holds the model's settings and the values of its TensorFlow variables. `export_policy`
+copies the variables of the policy network into a compressed `.npz` file, and `NumpyPolicy` loads such a file and does
+the policy's forward pass with a few matrix products. This is much quicker to start and to call than the TensorFlow
+model for the small networks used here, e.g.:
+
+    python -m learning2write.inference models/acktr_mlp_5x5.pkl
+    python test.py models/acktr_mlp_5x5.npz -pattern-set 5x5
+
+Any `FeedForwardPolicy` with an MLP feature extractor and the default tanh activation can be exported, which covers
+`MlpPolicy`, `MlpPolicy5x5` and `MlpPolicyEmnist` and their masked variants (see `train.ActionMaskMixin`). The network
+is rebuilt from the variables' names:
+
+    observation -> shared_fc0 -> shared_fc1 ... -> pi_fc0 -> pi_fc1 ... -> pi (action logits)
+                                               \\-> vf_fc0 -> vf_fc1 ... -> vf (value)
+"""
+import os
+import pickle
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import plac
+from gym import spaces
+
+from learning2write.env import get_action_masks, get_action_mode, get_positions
+from learning2write.strokes import StrokeActions
+
+# The name of the variables in the policy network, e.g. 'model/pi_fc0/w:0'.
+VARIABLE_PATTERN = re.compile(r'^model/(?P<layer>(shared|pi|vf)_fc\d+|pi|vf|q)/(?P<param>[wb]):0$')
+LAYER_PATTERN = re.compile(r'^(?P<branch>shared|pi|vf)_fc(?P<index>\d+)$')
+# The modules whose objects are not needed to read the weights of a saved model. Skipping them means exporting a
+# model needs neither TensorFlow nor the code of the policy (e.g. `train.py`).
+SKIPPED_MODULES = {'stable_baselines', 'tensorflow', 'cloudpickle', 'train', '__main__'}
+# The logit given to masked actions, low enough that they are never chosen.
+MASKED_LOGIT = -1e9
+# The entries of an exported policy that are not parameters of the network.
+METADATA_KEYS = {'observation_shape', 'mask_actions'}
+
+
+class _Placeholder:
+    """Stands in for the objects of the skipped modules when reading a saved model."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Placeholder()
+
+    def __setstate__(self, state):
+        pass
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    """Reads a saved stable-baselines model, replacing the objects of the skipped modules with placeholders."""
+
+    def find_class(self, module, name):
+        if module.split('.')[0] in SKIPPED_MODULES:
+            return type(name, (_Placeholder,), {'__module__': module})
+
+        return super().find_class(module, name)
+
+
+def load_model_parameters(model_path: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Read the settings and the parameters of a saved stable-baselines model.
+
+    :param model_path: The path of the saved model.
+    :return: The model's settings, where the objects of the skipped modules (e.g. the policy class) are placeholders,
+             and its parameters by TensorFlow variable name.
+    """
+    with open(model_path, 'rb') as file:
+        data, params = _ModelUnpickler(file).load()
+
+    return data, dict(params)
+
+
+def export_policy(model_path: str, output_path: Optional[str] = None) -> str:
+    """Save the policy network of a saved stable-baselines model for use with `NumpyPolicy`.
+
+    :param model_path: The path of the saved model.
+    :param output_path: Where to save the policy. Defaults to the model's path with the extension '.npz'.
+    :return: The path the policy was saved to.
+    """
+    output_path = output_path if output_path else os.path.splitext(model_path)[0] + '.npz'
+    data, params = load_model_parameters(model_path)
+    arrays = {}
+
+    for name, value in params.items():
+        match = VARIABLE_PATTERN.match(name)
+
+        if match is None:
+            raise ValueError('Unrecognised policy variable \'%s\', only MLP policies can be exported' % name)
+
+        arrays['%s/%s' % (match.group('layer'), match.group('param'))] = value.astype(np.float32)
+
+    arrays['observation_shape'] = np.array(data['observation_space'].shape)
+    # The masked policies record that they mask actions in their keyword arguments, since their classes are not
+    # available here.
+    arrays['mask_actions'] = np.array(bool((data.get('policy_kwargs') or {}).get('mask_actions', False)))
+    np.savez_compressed(output_path, **arrays)
+
+    return output_path
+
+
+class NumpyPolicy:
+    """An MLP policy that runs with NumPy, loaded from a file saved by `export_policy`.
+
+    This has the same `load` and `predict` interface as a stable-baselines model, so it can be used in its place for
+    inference, e.g. with `learning2write.evaluation.evaluate_model`.
+    """
+
+    def __init__(self, params: Dict[str, np.ndarray], observation_shape: Tuple[int, ...], seed: Optional[int] = None,
+                 mask_actions=False):
+        """Create a policy.
+
+        :param params: The parameters of each layer by '<layer>/<w or b>', see `export_policy`.
+        :param observation_shape: The shape of a single observation.
+        :param seed: The seed for sampling actions.
+        :param mask_actions: Whether to mask out pointless actions, see `learning2write.env.get_action_masks()`. This
+                             must match how the policy was trained.
+        """
+        self.observation_shape = tuple(observation_shape)
+        self.mask_actions = mask_actions
+        self.shared_layers = self._get_layers(params, 'shared')
+        self.pi_layers = self._get_layers(params, 'pi')
+        self.vf_layers = self._get_layers(params, 'vf')
+        self.pi_head = (params['pi/w'], params['pi/b'])
+        self.vf_head = (params['vf/w'], params['vf/b'])
+        self.n_actions = self.pi_head[1].shape[0]
+        self.action_space = spaces.Discrete(self.n_actions)
+        pattern_shape = self.observation_shape[:2]
+        self.stroke_actions = (StrokeActions(pattern_shape)
+                               if get_action_mode(pattern_shape, self.n_actions) == 'strokes' else None)
+        self.rng = np.random.RandomState(seed)
+
+    @classmethod
+    def load(cls, load_path: str, seed: Optional[int] = None) -> 'NumpyPolicy':
+        """Load a policy saved by `export_policy`.
+
+        :param load_path: The path of the '.npz' file.
+        :param seed: The seed for sampling actions.
+        :return: The policy.
+        """
+        with np.load(load_path) as file:
+            params = {key: file[key] for key in file.files if key not in METADATA_KEYS}
+            observation_shape = file['observation_shape']
+            # Policies exported before masking was added do not have this.
+            mask_actions = bool(file['mask_actions']) if 'mask_actions' in file.files else False
+
+        return cls(params, observation_shape, seed, mask_actions)
+
+    def predict(self, observations: np.ndarray, deterministic=True) -> Tuple[np.ndarray, None]:
+        """Choose actions.
+
+        :param observations: A single observation or a batch of observations.
+        :param deterministic: Whether to choose the most likely actions instead of sampling them.
+        :return: The action (or a batch of actions) and None, like stable-baselines' `predict`.
+        """
+        is_single = observations.shape == self.observation_shape
+        logits = self._logits(observations[np.newaxis] if is_single else observations)
+
+        if deterministic:
+            actions = logits.argmax(axis=1)
+        else:
+            probabilities = _softmax(logits)
+            actions = (probabilities.cumsum(axis=1) < self.rng.rand(len(logits), 1)).sum(axis=1)
+            actions = np.minimum(actions, self.n_actions - 1)
+
+        return (actions[0] if is_single else actions), None
+
+    def action_probability(self, observations: np.ndarray) -> np.ndarray:
+        """Get the probability of each action for a batch of observations."""
+        return _softmax(self._logits(observations))
+
+    def value(self, observations: np.ndarray) -> np.ndarray:
+        """Get the value estimate of a batch of observations."""
+        latent = _mlp(self._features(observations), self.vf_layers)
+
+        return (latent @ self.vf_head[0] + self.vf_head[1])[:, 0]
+
+    def _features(self, observations: np.ndarray) -> np.ndarray:
+        """Flatten a batch of observations and run them through the shared layers."""
+        return _mlp(observations.reshape(len(observations), -1).astype(np.float32), self.shared_layers)
+
+    def _logits(self, observations: np.ndarray) -> np.ndarray:
+        latent = _mlp(self._features(observations), self.pi_layers)
+        logits = latent @ self.pi_head[0] + self.pi_head[1]
+
+        if self.mask_actions:
+            logits[~get_action_masks(observations[..., 0], get_positions(observations), self.stroke_actions)] = \
+                MASKED_LOGIT
+
+        return logits
+
+    @staticmethod
+    def _get_layers(params: Dict[str, np.ndarray], branch: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Get the weights and biases of the hidden layers of one branch of the network, in order."""
+        matches = (LAYER_PATTERN.match(key.split('/')[0]) for key in params)
+        indices = sorted({int(match.group('index')) for match in matches if match and match.group('branch') == branch})
+
+        return [(params['%s_fc%d/w' % (branch, i)], params['%s_fc%d/b' % (branch, i)]) for i in indices]
+
+
+def _mlp(x: np.ndarray, layers: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """Run a batch through fully connected layers with tanh activations."""
+    for w, b in layers:
+        x = np.tanh(x @ w + b)
+
+    return x
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+@plac.annotations(
+    model_paths=plac.Annotation('The paths of the saved stable-baselines models to export. Each policy is saved next '
+                                'to its model with the extension \'.npz\'.', type=str, kind='positional')
+)
+def main(*model_paths):
+    """Export the policies of saved models for running without TensorFlow."""
+    for model_path in model_paths:
+        print('Exported \'%s\' to \'%s\'.' % (model_path, export_policy(model_path)))
+
+
+if __name__ == '__main__':
+    plac.call(main)
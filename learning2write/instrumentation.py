@@ -0,0 +1,121 @@
+"""This module defines opt-in timing instrumentation for the learning2write environments.
+
+An instrumented environment times the phases of its hot path (reset, sample, step, reward, observation and render)
+with `time.perf_counter` and keeps, for each phase, a count, the total time, the maximum time and a histogram of the
+times. An environment that is not instrumented only pays for checking that its `stats` attribute is None.
+
+The statistics of an environment are read with its `get_stats()` method, and can be gathered from the worker
+processes of a `SubprocVecEnv` with `get_vec_env_stats`.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+PHASES = ['reset', 'sample', 'step', 'reward', 'observation', 'render']
+
+# Bucket `i` of the histograms counts the times in [2^(i-1), 2^i) microseconds, with bucket 0 for times under a
+# microsecond and the last bucket for everything from about a second up.
+N_BUCKETS = 22
+BUCKET_UPPER_BOUNDS = [2 ** i * 1e-6 for i in range(N_BUCKETS)]
+
+
+class Stats:
+    """Counters and histograms of how long each phase of an environment takes."""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[str, float] = {}
+        self.maxima: Dict[str, float] = {}
+        self.histograms: Dict[str, List[int]] = {}
+
+    def record(self, phase: str, duration: float):
+        """Record how long a phase took.
+
+        :param phase: The name of the phase, see `PHASES`.
+        :param duration: How long the phase took, in seconds.
+        """
+        if phase not in self.counts:
+            self.counts[phase] = 0
+            self.totals[phase] = 0.0
+            self.maxima[phase] = 0.0
+            self.histograms[phase] = [0] * N_BUCKETS
+
+        self.counts[phase] += 1
+        self.totals[phase] += duration
+
+        if duration > self.maxima[phase]:
+            self.maxima[phase] = duration
+
+        self.histograms[phase][min(int(duration * 1e6).bit_length(), N_BUCKETS - 1)] += 1
+
+    def clear(self):
+        """Forget everything that has been recorded."""
+        self.__init__()
+
+    def as_dict(self) -> dict:
+        """Get the statistics as a dictionary that can be pickled (e.g. to send it from a worker process).
+
+        :return: A dictionary mapping each phase to its count, total, mean and maximum time (in seconds), approximate
+                 50th and 99th percentile times (the upper bound of the histogram bucket they fall in), and histogram.
+        """
+        return {phase: _summarise(self.counts[phase], self.totals[phase], self.maxima[phase], self.histograms[phase])
+                for phase in self.counts}
+
+
+def merge_stats(stats: List[dict]) -> dict:
+    """Combine the statistics of several environments, e.g. the results of `env_method('get_stats')`.
+
+    :param stats: The statistics of each environment, as given by `Stats.as_dict()`.
+    :return: The combined statistics, in the same format.
+    """
+    merged = {}
+
+    for phase in PHASES + sorted({phase for stats_ in stats for phase in stats_} - set(PHASES)):
+        phase_stats = [stats_[phase] for stats_ in stats if phase in stats_]
+
+        if phase_stats:
+            merged[phase] = _summarise(sum(s['count'] for s in phase_stats),
+                                       sum(s['total'] for s in phase_stats),
+                                       max(s['max'] for s in phase_stats),
+                                       np.sum([s['histogram'] for s in phase_stats], axis=0).tolist())
+
+    return merged
+
+
+def get_vec_env_stats(env) -> dict:
+    """Get the combined statistics of all the environments of a vectorised environment.
+
+    :param env: A `BatchedWritingEnvironment`, or a vectorised environment (e.g. `SubprocVecEnv`) of instrumented
+                `WritingEnvironment` instances.
+    :return: The combined statistics, see `Stats.as_dict()`.
+    """
+    if hasattr(env, 'get_stats'):
+        # The batched environment keeps one set of statistics for all of its environments.
+        return env.get_stats()
+    else:
+        return merge_stats(env.env_method('get_stats'))
+
+
+def _summarise(count: int, total: float, maximum: float, histogram: List[int]) -> dict:
+    """Summarise the statistics of one phase.
+
+    :param count: How many times the phase was recorded.
+    :param total: The total time of the phase.
+    :param maximum: The longest time of the phase.
+    :param histogram: The histogram of the times.
+    :return: The summary, see `Stats.as_dict()`.
+    """
+    cumulative_counts = np.cumsum(histogram)
+
+    def percentile(q):
+        return BUCKET_UPPER_BOUNDS[int(np.searchsorted(cumulative_counts, q * count))] if count else 0.0
+
+    return {
+        'count': count,
+        'total': total,
+        'mean': total / count if count else 0.0,
+        'max': maximum,
+        'p50': percentile(0.5),
+        'p99': percentile(0.99),
+        'histogram': list(histogram)
+    }
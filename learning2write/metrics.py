@@ -0,0 +1,63 @@
+"""This module defines the metrics used to score how well a pattern reproduces a reference pattern."""
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+# Use a small value to avoid zero division, zero division is treated as if it produces zero for the sake of
+# numerical stability and to prevent the whole program from crashing and burning.
+EPS = 1e-128
+# The most cells that a grid can have for its f1 scores to be tabulated, see `get_f1_table()`. This covers the 3x3 and
+# 5x5 pattern sets, whereas the table for a 28x28 EMNIST grid would have 785^3 entries.
+MAX_TABLE_CELLS = 25
+
+
+def precision_recall_f1(true_positives, false_positives, n_targets, n_cells) -> Tuple[np.ndarray, np.ndarray,
+                                                                                       np.ndarray]:
+    """Calculate the precision, recall and f1 metrics from the number of filled cells in a pattern.
+
+    This gives exactly the same results as `WritingEnvironment._precision_recall_f1`, but works on counts rather than
+    whole patterns. The counts may be scalars or arrays, in which case the metrics are calculated element-wise.
+
+    :param true_positives: The number of filled cells that are also filled in the target pattern.
+    :param false_positives: The number of filled cells that are empty in the target pattern.
+    :param n_targets: The number of filled cells in the target pattern.
+    :param n_cells: The total number of cells in a pattern.
+    :return: A 3-tuple containing the precision, recall and f1-score.
+    """
+    n_targets = np.asarray(n_targets)
+
+    # If there are no target (or non-target) cells then there can be no true (or false) positives, so clamping the
+    # denominator to one gives a rate of zero without dividing by zero.
+    true_positive_rate = np.true_divide(true_positives, np.maximum(n_targets, 1))
+    false_negative_rate = 1 - true_positive_rate
+    false_positive_rate = np.true_divide(false_positives, np.maximum(n_cells - n_targets, 1))
+
+    precision = true_positive_rate / (true_positive_rate + false_positive_rate + EPS)
+    recall = true_positive_rate / (true_positive_rate + false_negative_rate + EPS)
+    f1 = 2 * ((precision * recall) / (precision + recall + EPS)) - 2 * EPS
+
+    return precision, recall, f1
+
+
+@lru_cache(maxsize=None)
+def get_f1_table(n_cells: int) -> np.ndarray:
+    """Tabulate the f1 score of every possible count of true positives, false positives and targets in a grid.
+
+    Looking up the f1 scores in the table is much quicker than calculating them, for a single pattern or a whole batch
+    of them. The table is shared by every environment with the same grid size, so it is read-only.
+
+    :param n_cells: The total number of cells in a pattern, at most `MAX_TABLE_CELLS`.
+    :return: An array with the shape (n_cells + 1, n_cells + 1, n_cells + 1) where `[tp, fp, n_targets]` holds exactly
+             the same f1 score as `precision_recall_f1(tp, fp, n_targets, n_cells)`.
+    """
+    if n_cells > MAX_TABLE_CELLS:
+        raise ValueError('Unrecognised grid size \'%d\', f1 scores are only tabulated for up to %d cells'
+                         % (n_cells, MAX_TABLE_CELLS))
+
+    counts = np.arange(n_cells + 1)
+    _, _, f1 = precision_recall_f1(counts[:, np.newaxis, np.newaxis], counts[np.newaxis, :, np.newaxis],
+                                   counts[np.newaxis, np.newaxis, :], n_cells)
+    f1.flags.writeable = False
+
+    return f1
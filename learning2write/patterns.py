@@ -1,36 +1,50 @@
 """This module defines the patterns (or symbols) to use in the learning2write environment."""
 import abc
-import random
+import queue
+import threading
+import time
 from abc import ABC
+from itertools import chain
+from typing import Optional
 
 import numpy as np
-from mnist import MNIST
+
+from learning2write.augment import augment, augmented_table, get_transforms, IDENTITY
+from learning2write.bitpack import pack, unpack
 
 SIMPLE_PATTERN_SETS = {'3x3', '5x5'}
 EMNIST_PATTERN_SETS = {'mnist', 'digits', 'letters', 'emnist'}
 VALID_PATTERN_SETS = SIMPLE_PATTERN_SETS.union(EMNIST_PATTERN_SETS)
 
 
-def get_pattern_set(pattern_set_name, rotate_patterns=False, batch_size=32):
+def get_pattern_set(pattern_set_name, rotate_patterns=False, batch_size=32, packed=False, prefetch=0,
+                    flip_patterns=False, materialize_augmentations=False):
     """Get an instance of a pattern set.
 
     :param pattern_set_name: The name of a pattern set. Valid names are those in `VALID_PATTERN_SETS`.
     :param rotate_patterns: Whether or not patterns returned by `sample()` should be randomly rotated.
     :param batch_size: In the case of a MNIST based pattern set, batch size is the number of images to keep in memory.
+    :param packed: Whether or not the patterns should be stored as packed bits (see `learning2write.bitpack`).
+    :param prefetch: In the case of a MNIST based pattern set, how many batches of images to load in the background.
+    :param flip_patterns: Whether or not patterns returned by `sample()` should be randomly flipped.
+    :param materialize_augmentations: In the case of a simple pattern set, whether or not to precompute the distinct
+                                      rotations and/or flips of the patterns, see `PatternSet`.
     :return: An instance of the pattern set corresponding to the given name.
     """
     if pattern_set_name not in VALID_PATTERN_SETS:
         raise ValueError('Unrecognised pattern set \'%s\'' % pattern_set_name)
 
     if pattern_set_name == '3x3':
-        return Patterns3x3(rotate_patterns)
+        return Patterns3x3(rotate_patterns, packed, flip_patterns, materialize_augmentations)
     elif pattern_set_name == '5x5':
-        return Patterns5x5(rotate_patterns)
+        return Patterns5x5(rotate_patterns, packed, flip_patterns, materialize_augmentations)
     elif pattern_set_name in EMNIST_PATTERN_SETS:
         if pattern_set_name == 'emnist':
-            return PatternsMNIST('byclass', batch_size, rotate_patterns)
+            return PatternsMNIST('byclass', batch_size, rotate_patterns, packed, prefetch,
+                                 flip_patterns=flip_patterns)
         else:
-            return PatternsMNIST(pattern_set_name, batch_size, rotate_patterns)
+            return PatternsMNIST(pattern_set_name, batch_size, rotate_patterns, packed, prefetch,
+                                 flip_patterns=flip_patterns)
 
 
 class PatternSet(ABC):
@@ -38,38 +52,101 @@ class PatternSet(ABC):
 
     patterns = np.array([])
     width, height = 0, 0
+    packed = False
 
-    def __init__(self, rotate_patterns=False):
+    def __init__(self, rotate_patterns=False, packed=False, flip_patterns=False, materialize_augmentations=False):
         """Create a new pattern set.
 
         :param rotate_patterns: Whether or not patterns returned by `sample()` should be randomly rotated.
+        :param packed: Whether or not `patterns` should be stored as packed bits (see `learning2write.bitpack`).
+                       Indexing and sampling the pattern set still gives unpacked patterns.
+        :param flip_patterns: Whether or not patterns returned by `sample()` should be randomly flipped.
+        :param materialize_augmentations: Whether or not to replace `patterns` with a table of the distinct rotations
+                                          and/or flips of the patterns (see `learning2write.augment`), which are then
+                                          sampled uniformly instead of being augmented by `sample()`.
         """
         self.rotate_patterns = rotate_patterns
+        self.flip_patterns = flip_patterns
+        # The transforms (see `learning2write.augment`) that `sample()` chooses from.
+        self.transforms = get_transforms(rotate_patterns, flip_patterns)
+        # Each pattern set has its own generator so that, e.g., the pattern sets of worker processes can be seeded
+        # independently. `numpy.random.Generator` needs NumPy 1.17, hence `RandomState`.
+        self.rng = np.random.RandomState()
+
+        if materialize_augmentations:
+            self.patterns = augmented_table(self.patterns, self.transforms)
+            self.transforms = IDENTITY
+
+        if packed:
+            self.patterns = pack(self.patterns)
+            self.packed = True
 
     @property
     @abc.abstractmethod
     def name(self) -> str:
         raise NotImplementedError
 
+    @property
+    def shape(self):
+        """The shape of a single (unpacked) pattern."""
+        return self.height, self.width
+
+    def __len__(self):
+        return len(self.patterns)
+
     def __getitem__(self, item):
-        return self.patterns[item]
+        return unpack(self.patterns[item], self.shape) if self.packed else self.patterns[item]
 
-    @staticmethod
-    def seed(a=None):
+    def seed(self, seed=None):
         """Seed the random number generator used for sampling patterns.
-        This behaves the same as the built-in `random`.
 
-        :param a: The seed to use. If `None` then no seed is used.
+        :param seed: The seed to use. If `None` then the generator is seeded from the operating system's entropy.
         """
-        random.seed(a)
+        self.rng.seed(seed)
 
     def sample(self) -> np.ndarray:
         """Choose a random pattern.
 
         :return: A randomly chosen pattern.
         """
-        pattern = random.choice(self.patterns)
-        return np.rot90(pattern, k=random.randint(0, 3)) if self.rotate_patterns else pattern
+        return self._augment(self[self.rng.randint(len(self))])
+
+    def sample_batch(self, n: int) -> np.ndarray:
+        """Choose `n` random patterns at once.
+
+        :param n: The number of patterns to choose.
+        :return: The randomly chosen patterns with the shape (n, height, width).
+        """
+        return self._augment(self[self.rng.randint(len(self), size=n)])
+
+    def set_part(self, part: int, n_parts: int):
+        """Make the pattern set start from its own part of the patterns, e.g. in one of several worker processes.
+
+        This only matters for pattern sets that read the patterns in order (see `PatternsMNIST`), so that several of
+        them do not read the same patterns at the same time. The other pattern sets choose each pattern independently,
+        so this does nothing.
+
+        :param part: The index of the part, from zero.
+        :param n_parts: How many parts the patterns are split into.
+        """
+        pass
+
+    def close(self):
+        """Release any resources held by the pattern set."""
+        pass
+
+    def _augment(self, patterns: np.ndarray) -> np.ndarray:
+        """Apply randomly chosen transforms to a pattern or a batch of patterns.
+
+        :param patterns: A single pattern or a batch of patterns.
+        :return: The augmented pattern(s).
+        """
+        if len(self.transforms) == 1 and self.transforms[0] == 0:
+            return patterns
+
+        size = None if patterns.ndim == 2 else len(patterns)
+
+        return augment(patterns, self.transforms[self.rng.randint(len(self.transforms), size=size)])
 
 
 class Patterns3x3(PatternSet):
@@ -608,7 +685,8 @@ class Patterns5x5(PatternSet):
 class PatternsMNIST(PatternSet):
     width = height = 28
 
-    def __init__(self, dataset, batch_size=32, rotate_patterns=False):
+    def __init__(self, dataset, batch_size=32, rotate_patterns=False, packed=False, prefetch=0,
+                 data_path='emnist_data', flip_patterns=False):
         """Create a new EMNIST pattern set.
 
         :param rotate_patterns: Whether or not patterns returned by `sample()` should be randomly rotated.
@@ -621,20 +699,73 @@ class PatternsMNIST(PatternSet):
                         - digits    : 280,000 characters. 10 balanced classes.
                         - mnist     : 70,000 characters. 10 balanced classes.
 
-        :param batch_size: The number of images to load into memory.
+        :param batch_size: The number of images to shuffle together. Images are read in order in batches of this size
+                           and shuffled within each batch.
+        :param packed: Whether or not the patterns should be stored as packed bits, which takes an eighth of the
+                       memory (see `learning2write.bitpack`).
+        :param prefetch: How many shuffled batches of images a background thread should keep ready. If zero, each
+                         batch is loaded by `sample()` when the previous batch runs out.
+        :param data_path: The directory containing the EMNIST data.
+        :param flip_patterns: Whether or not patterns returned by `sample()` should be randomly flipped.
         """
-        super().__init__(rotate_patterns)
+        super().__init__(rotate_patterns, flip_patterns=flip_patterns)
 
-        self.emnist = MNIST('emnist_data', mode='rounded_binarized', return_type='numpy')
-        self.emnist.select_emnist(dataset)
+        self.packed = packed
+        self.dataset = dataset
+        self.data_path = data_path
         self.batch_size = batch_size
-        self.images = self._image_gen()
+        self.prefetch = prefetch
+        # Imported here so that only the processes that use EMNIST pay for importing the loader.
+        from learning2write.emnist import load_patterns
+
+        # The patterns are memory-mapped, so they are only read from disk as they are needed and are shared between
+        # all of the processes that use the same dataset.
+        self.patterns = load_patterns(dataset, packed=packed, data_path=data_path)
+        # Where each epoch starts in the dataset, see `set_part()`.
+        self.start = 0
         self._name = 'emnist' if dataset in {'byclass', 'bymerge', 'balanced'} else dataset
+        # Prefetching is started by the first call to `sample()`.
+        self._prefetch_queue: Optional[queue.Queue] = None
+        self._prefetch_thread: Optional[threading.Thread] = None
+        self._stop_prefetching: Optional[threading.Event] = None
+        # How many batches `sample()` has used, and how many times (and for how long) it had to wait for one.
+        self.n_batches = 0
+        self.n_waits = 0
+        self.wait_time = 0.0
+        self.images = self._image_gen()
 
     @property
     def name(self) -> str:
         return self._name
 
+    @property
+    def prefetch_stats(self) -> dict:
+        """Get the counts of how many batches `sample()` has used and how often it had to wait for a batch to load.
+
+        :return: A dictionary with the number of batches used, the number of waits and the total wait time (seconds).
+        """
+        return {'batches': self.n_batches, 'waits': self.n_waits, 'wait_time': self.wait_time}
+
+    def __getstate__(self):
+        # Pickling a memory-mapped array copies all of its data, so reopen the pattern file instead (e.g. in the
+        # worker processes of `SubprocVecEnv`). The image generator and the prefetching thread cannot be pickled either.
+        state = self.__dict__.copy()
+
+        for key in ['patterns', 'images', '_prefetch_queue', '_prefetch_thread', '_stop_prefetching']:
+            del state[key]
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        from learning2write.emnist import load_patterns
+
+        self.patterns = load_patterns(self.dataset, packed=self.packed, data_path=self.data_path)
+        self._prefetch_queue = None
+        self._prefetch_thread = None
+        self._stop_prefetching = None
+        self.images = self._image_gen()
+
     def sample(self) -> np.ndarray:
         try:
             image = next(self.images)
@@ -643,12 +774,124 @@ class PatternsMNIST(PatternSet):
             self.images = self._image_gen()
             image = next(self.images)
 
-        return np.rot90(image, k=random.randint(0, 3)) if self.rotate_patterns else image
+        return self._augment(image)
+
+    def sample_batch(self, n: int) -> np.ndarray:
+        """Choose the next `n` patterns.
+
+        Unlike the other pattern sets, the patterns are not drawn independently but are the next `n` patterns that
+        `sample()` would give, so the whole dataset is still used once per epoch.
+
+        :param n: The number of patterns to choose.
+        :return: The patterns with the shape (n, height, width).
+        """
+        patterns = np.empty((n,) + self.shape, dtype=np.uint8)
+
+        for i in range(n):
+            try:
+                patterns[i] = next(self.images)
+            except StopIteration:
+                self.images = self._image_gen()
+                patterns[i] = next(self.images)
+
+        return self._augment(patterns)
+
+    def seed(self, seed=None):
+        """Seed the random number generator and start again from the beginning of the dataset, so that the patterns
+        that are sampled only depend on the seed.
+
+        :param seed: The seed to use. If `None` then the generator is seeded from the operating system's entropy.
+        """
+        super().seed(seed)
+        # The prefetching thread shuffles with a generator seeded when it starts, and may have loaded batches ahead.
+        self._stop_prefetch_thread()
+        self.images = self._image_gen()
+
+    def set_part(self, part: int, n_parts: int):
+        """Start each epoch from the beginning of a part of the dataset, wrapping around at the end of the dataset.
+
+        Each epoch still covers the whole dataset, so several pattern sets (e.g. in worker processes) read the images
+        in the same distribution as a single pattern set, but start far apart from each other. The epoch starts from
+        the beginning of the part again when the pattern set is seeded.
+
+        :param part: The index of the part, from zero.
+        :param n_parts: How many parts the dataset is split into.
+        """
+        self.start = part * len(self) // n_parts
+        self._stop_prefetch_thread()
+        self.images = self._image_gen()
+
+    def close(self):
+        """Stop the prefetching thread, if it is running."""
+        if self._prefetch_thread is not None:
+            self._stop_prefetch_thread()
+            # Start again from the beginning (and restart prefetching) if the pattern set is sampled again.
+            self.images = self._image_gen()
+
+    def _stop_prefetch_thread(self):
+        """Stop the prefetching thread, if it is running, and drop the batches that it has loaded."""
+        if self._prefetch_thread is not None:
+            self._stop_prefetching.set()
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+            self._prefetch_queue = None
+            self._stop_prefetching = None
 
     def _image_gen(self):
-        for images, _ in self.emnist.load_training_in_batches(self.batch_size):
-            random.shuffle(images)
-            self.patterns = images.reshape(-1, self.width, self.height)
+        for images in self._prefetched_batch_gen() if self.prefetch > 0 else self._batch_gen(self.rng):
+            self.n_batches += 1
 
-            for image in self.patterns:
+            for image in images:
                 yield image
+
+    def _batch_gen(self, rng: np.random.RandomState):
+        """Load the images in order, in shuffled batches.
+
+        :param rng: The random number generator to shuffle the batches with.
+        """
+        # An epoch runs from `self.start` to the end of the dataset and then from the beginning up to `self.start`.
+        for start in chain(range(self.start, len(self), self.batch_size), range(0, self.start, self.batch_size)):
+            images = self[start:min(start + self.batch_size, len(self) if start >= self.start else self.start)]
+
+            yield images[rng.permutation(len(images))]
+
+    def _prefetched_batch_gen(self):
+        """Get the batches loaded by the prefetching thread, starting the thread first."""
+        self._prefetch_queue = queue.Queue(maxsize=self.prefetch)
+        self._stop_prefetching = threading.Event()
+        # The thread shuffles with its own generator, seeded from the pattern set's, so that the order of the images
+        # does not depend on how the two threads are scheduled.
+        rng = np.random.RandomState(self.rng.randint(2 ** 31))
+        self._prefetch_thread = threading.Thread(target=self._prefetch,
+                                                 args=(self._prefetch_queue, self._stop_prefetching, rng), daemon=True)
+        self._prefetch_thread.start()
+
+        while True:
+            try:
+                images = self._prefetch_queue.get_nowait()
+            except queue.Empty:
+                self.n_waits += 1
+                start = time.perf_counter()
+                images = self._prefetch_queue.get()
+                self.wait_time += time.perf_counter() - start
+
+            yield images
+
+    def _prefetch(self, batches: queue.Queue, stop: threading.Event, rng: np.random.RandomState):
+        """Keep a queue of batches full, looping over the dataset, until told to stop. This runs in its own thread.
+
+        :param batches: The queue to put the batches in.
+        :param stop: The event that signals the thread to stop.
+        :param rng: The random number generator to shuffle the batches with.
+        """
+        while not stop.is_set():
+            for images in self._batch_gen(rng):
+                while not stop.is_set():
+                    try:
+                        batches.put(images, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+                if stop.is_set():
+                    return
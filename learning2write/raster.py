@@ -0,0 +1,101 @@
+"""This module defines a headless renderer that draws environment states into RGB arrays with NumPy.
+
+The frames look the same as the ones drawn by `WritingEnvironment` in a window: the reference pattern on the left, the
+current pattern on the right, filled cells in black on a white background with each cell outlined, and the agent's
+position marked with a red dot. Since no window or OpenGL context is needed, this works without a display (e.g.
+without `xvfb-run`) and can draw a whole batch of states at once.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+BACKGROUND_COLOUR = (255, 255, 255)
+CELL_COLOUR = (0, 0, 0)
+MARKER_COLOUR = (255, 0, 0)
+
+
+class Rasterizer:
+    """Draws states of the writing environment into RGB arrays."""
+
+    def __init__(self, pattern_shape: Tuple[int, int], cell_size: int):
+        """Create a rasterizer for patterns of a given shape.
+
+        :param pattern_shape: The shape (rows, cols) of the patterns.
+        :param cell_size: The size in pixels of the squares representing a cell of a pattern.
+        """
+        self.pattern_shape = pattern_shape
+        self.cell_size = cell_size
+
+        rows, cols = pattern_shape
+        # Same layout as `WritingEnvironment`: one cell of padding around each pattern, and the current pattern
+        # starts one cell after the middle of the frame.
+        self.height = (rows + 2) * cell_size
+        self.width = (2 * cols + 4) * cell_size
+        self.reference_origin = (cell_size, cell_size)
+        self.pattern_origin = (cell_size, self.width // 2 + cell_size)
+
+        # The background of every frame, with the outlines of the cells already drawn.
+        self.background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.background[:] = BACKGROUND_COLOUR
+
+        for top, left in [self.reference_origin, self.pattern_origin]:
+            grid = self.background[top:top + rows * cell_size + 1, left:left + cols * cell_size + 1]
+            grid[::cell_size, :] = CELL_COLOUR
+            grid[:, ::cell_size] = CELL_COLOUR
+
+        # The pixel offsets, relative to the top left corner of a cell, of the agent's marker.
+        y, x = np.mgrid[:cell_size, :cell_size] - cell_size // 2
+        self._marker_rows, self._marker_cols = np.nonzero(y ** 2 + x ** 2 <= (cell_size / 4) ** 2)
+
+        self._frames: Optional[np.ndarray] = None
+
+    def render(self, patterns: np.ndarray, reference_patterns: np.ndarray, agent_positions: np.ndarray,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Draw a state, or a batch of states, of the writing environment.
+
+        :param patterns: The current pattern(s) with the shape (rows, cols), or (n, rows, cols) for a batch.
+        :param reference_patterns: The reference pattern(s), with the same shape as `patterns`.
+        :param agent_positions: The position(s) (row, col) of the agent, with the shape (2,), or (n, 2) for a batch.
+        :param out: The array to draw the frame(s) into. By default, the frames are drawn into a buffer that is kept
+                    between calls and is overwritten by the next call.
+        :return: The frame(s) with the shape (height, width, 3), or (n, height, width, 3) for a batch.
+        """
+        if np.ndim(patterns) == 2:
+            frames = self.render(np.asarray(patterns)[np.newaxis], np.asarray(reference_patterns)[np.newaxis],
+                                 np.asarray(agent_positions)[np.newaxis],
+                                 None if out is None else out[np.newaxis])
+
+            return frames[0]
+
+        n = len(patterns)
+
+        if out is None:
+            if self._frames is None or len(self._frames) != n:
+                self._frames = np.empty((n, self.height, self.width, 3), dtype=np.uint8)
+
+            out = self._frames
+
+        out[:] = self.background
+        self._draw_cells(out, reference_patterns, self.reference_origin)
+        self._draw_cells(out, patterns, self.pattern_origin)
+
+        # The marker is drawn on top of the current pattern.
+        agent_positions = np.asarray(agent_positions)
+        top, left = self.pattern_origin
+        rows = top + agent_positions[:, 0:1] * self.cell_size + self._marker_rows
+        cols = left + agent_positions[:, 1:2] * self.cell_size + self._marker_cols
+        out[np.arange(n)[:, np.newaxis], rows, cols] = MARKER_COLOUR
+
+        return out
+
+    def _draw_cells(self, frames: np.ndarray, patterns: np.ndarray, origin: Tuple[int, int]):
+        """Fill in the filled cells of a batch of patterns by upscaling each cell to a block of pixels.
+
+        :param frames: The frames to draw into.
+        :param patterns: The patterns to draw.
+        :param origin: The pixel coordinates (row, col) of the top left corner of the patterns.
+        """
+        rows, cols = self.pattern_shape
+        top, left = origin
+        is_filled = np.repeat(np.repeat(np.asarray(patterns) > 0, self.cell_size, axis=1), self.cell_size, axis=2)
+        frames[:, top:top + rows * self.cell_size, left:left + cols * self.cell_size][is_filled] = CELL_COLOUR
@@ -0,0 +1,121 @@
+"""This module defines a store that shares a single copy of a pattern set's patterns between processes.
+
+Without it, each worker process of a `SubprocVecEnv` gets its own copy of the pattern set that it was created with.
+The store instead writes the patterns once to shared memory (a file in `/dev/shm` where available) and hands out a
+lightweight `SharedPatterns` pattern set that maps them into each worker's memory without copying.
+
+EMNIST pattern sets are already memory-mapped and only pickle the location of their patterns, so the store hands them
+out as they are. They keep reading the images in epochs, shuffled in batches, rather than sampling them uniformly like
+`SharedPatterns`.
+"""
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from learning2write.patterns import PatternSet, PatternsMNIST
+
+# Files in this directory live in memory, so mapping them into several processes shares the same physical pages.
+SHARED_MEMORY_PATH = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedPatterns(PatternSet):
+    """A pattern set whose patterns are memory-mapped from a file shared between processes.
+
+    Pickling this pattern set (e.g. to send it to a worker process) only pickles the location of the patterns, which
+    are mapped again when it is unpickled.
+    """
+
+    def __init__(self, path: str, name: str, width: int, height: int, rotate_patterns=False, packed=False,
+                 flip_patterns=False):
+        """Create a pattern set from shared patterns. Usually this is done via `SharedPatternStore`.
+
+        :param path: The path of the `.npy` file containing the patterns.
+        :param name: The name of the original pattern set.
+        :param width: The width of a pattern.
+        :param height: The height of a pattern.
+        :param rotate_patterns: Whether or not patterns returned by `sample()` should be randomly rotated.
+        :param packed: Whether or not the patterns are stored as packed bits.
+        :param flip_patterns: Whether or not patterns returned by `sample()` should be randomly flipped.
+        """
+        super().__init__(rotate_patterns, flip_patterns=flip_patterns)
+
+        self.path = path
+        self.width, self.height = width, height
+        self.packed = packed
+        self.patterns = np.load(path, mmap_mode='r')
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['patterns']
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.patterns = np.load(self.path, mmap_mode='r')
+
+
+class SharedPatternStore:
+    """Owns the shared copy of a pattern set's patterns.
+
+    EMNIST pattern sets are shared as they are. If the patterns of another pattern set are already memory-mapped from a
+    `.npy` file then that file is shared as is. Otherwise the patterns are copied into a new file in shared memory,
+    which is removed when the store is closed. Processes that have already mapped the patterns can keep using them
+    after that.
+    """
+
+    def __init__(self, pattern_set: PatternSet, path: Optional[str] = SHARED_MEMORY_PATH):
+        """Put a pattern set's patterns into shared memory.
+
+        :param pattern_set: The pattern set to share.
+        :param path: The directory to create the shared file in. Defaults to `/dev/shm` where available, otherwise
+                     the system's temporary directory.
+        """
+        patterns = pattern_set.patterns
+
+        if isinstance(pattern_set, PatternsMNIST):
+            # Already shared, see the module docstring.
+            self.path = patterns.filename
+            self._owns_file = False
+            self.patterns = pattern_set
+
+            return
+        elif isinstance(patterns, np.memmap) and patterns.filename and patterns.filename.endswith('.npy') \
+                and np.load(patterns.filename, mmap_mode='r').shape == patterns.shape:
+            self.path = patterns.filename
+            self._owns_file = False
+        else:
+            file, self.path = tempfile.mkstemp(prefix='learning2write-patterns-', suffix='.npy', dir=path)
+            os.close(file)
+            self._owns_file = True
+
+            shared_patterns = np.lib.format.open_memmap(self.path, mode='w+', dtype=patterns.dtype,
+                                                        shape=patterns.shape)
+            shared_patterns[:] = patterns
+            shared_patterns.flush()
+            del shared_patterns
+
+        self.patterns = SharedPatterns(self.path, pattern_set.name, pattern_set.width, pattern_set.height,
+                                       pattern_set.rotate_patterns, pattern_set.packed, pattern_set.flip_patterns)
+        # The patterns may already be augmented (see `PatternSet`), in which case they should not be augmented again.
+        self.patterns.transforms = pattern_set.transforms
+
+    def close(self):
+        """Remove the shared file if it was created by this store."""
+        if self._owns_file and os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._owns_file = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
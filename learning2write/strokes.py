@@ -0,0 +1,102 @@
+"""This module defines the actions of the 'strokes' action mode of the writing environment.
+
+In the default 'cells' action mode the agent moves one cell at a time and fills cells one at a time, so drawing a 28x28
+EMNIST character takes hundreds of steps. In the 'strokes' action mode an action moves the agent in a straight line,
+in one of eight directions (the four moves of the 'cells' mode and the four diagonals) for any number of cells, with
+the pen either up (only moving) or down (filling every cell along the way, including the first and last cells). There
+are two more actions: filling only the current cell (a dot) and quitting. A character then takes tens of steps.
+
+The actions are numbered:
+
+    stroke (pen, direction, length) -> (pen * N_DIRECTIONS + direction) * max_length + length - 1
+    dot                             -> n_strokes
+    quit                            -> n_strokes + 1
+"""
+from typing import Tuple
+
+import numpy as np
+
+PEN_UP = 0
+PEN_DOWN = 1
+
+# The change in the agent's position (row, col) for each direction. The first four are the same as the moves of the
+# 'cells' action mode (see `learning2write.env.MOVE_UP` etc.), then the diagonals.
+DIRECTIONS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [-1, -1], [-1, 1], [1, -1], [1, 1]])
+N_DIRECTIONS = len(DIRECTIONS)
+
+
+class StrokeActions:
+    """The stroke actions for a grid of a given size, and the vectorised operations on batches of them."""
+
+    def __init__(self, pattern_shape: Tuple[int, int]):
+        """Create the stroke actions for a grid.
+
+        :param pattern_shape: The shape (height, width) of the grid.
+        """
+        self.pattern_shape = tuple(pattern_shape)
+        # The longest stroke that fits in the grid.
+        self.max_length = max(max(self.pattern_shape) - 1, 1)
+        self.n_strokes = 2 * N_DIRECTIONS * self.max_length
+        self.dot_action = self.n_strokes
+        self.quit_action = self.n_strokes + 1
+        self.n_actions = self.n_strokes + 2
+
+        # The pen, direction and length of each stroke, indexed by action.
+        strokes = np.arange(self.n_strokes)
+        self.pens = strokes // (N_DIRECTIONS * self.max_length)
+        self.directions = strokes // self.max_length % N_DIRECTIONS
+        self.lengths = strokes % self.max_length + 1
+        # The change in the agent's position (row, col) at the end of each stroke.
+        self.end_offsets = DIRECTIONS[self.directions] * self.lengths[:, np.newaxis]
+        # Which actions are allowed from each cell, apart from the dot which also depends on the drawn pattern.
+        positions = np.indices(self.pattern_shape).reshape(2, -1).T
+        ends = positions[:, np.newaxis, :] + self.end_offsets
+        self._position_masks = np.ones(self.pattern_shape + (self.n_actions,), dtype=bool)
+        self._position_masks[..., :self.n_strokes] = np.all((0 <= ends) & (ends < self.pattern_shape),
+                                                            axis=2).reshape(self.pattern_shape + (-1,))
+
+    def encode(self, pen: int, direction: int, length: int) -> int:
+        """Get the action of a stroke.
+
+        :param pen: Either `PEN_UP` or `PEN_DOWN`.
+        :param direction: The index of the direction in `DIRECTIONS`.
+        :param length: How many cells to move, from 1 to `max_length`.
+        :return: The action.
+        """
+        if not 1 <= length <= self.max_length:
+            raise ValueError('Unrecognised stroke length \'%d\', it must be between 1 and %d'
+                             % (length, self.max_length))
+
+        return (pen * N_DIRECTIONS + direction) * self.max_length + length - 1
+
+    def get_cells(self, positions: np.ndarray, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the cells that a batch of strokes pass through, from their first to their last cell.
+
+        A dot only passes through the cell that the agent is in.
+
+        :param positions: The agents' positions (row, col) at the start of the strokes, with the shape (n, 2).
+        :param actions: The strokes or dots.
+        :return: A 3-tuple of the index in the batch, the row and the column of each cell.
+        """
+        is_stroke = actions < self.n_strokes
+        strokes = np.where(is_stroke, actions, 0)
+        lengths = np.where(is_stroke, self.lengths[strokes], 0)
+        batch, step = np.nonzero(np.arange(self.max_length + 1) <= lengths[:, np.newaxis])
+        offsets = DIRECTIONS[self.directions[strokes[batch]]] * step[:, np.newaxis]
+
+        return batch, positions[batch, 0] + offsets[:, 0], positions[batch, 1] + offsets[:, 1]
+
+    def get_masks(self, patterns: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        """Find which actions are worth taking in a batch of states, see `learning2write.env.get_action_masks()`.
+
+        Strokes that would leave the grid are masked out, as is a dot on a cell that is already filled.
+
+        :param patterns: The drawn patterns with the shape (n, height, width).
+        :param positions: The agents' positions (row, col) with the shape (n, 2).
+        :return: A boolean array with the shape (n, n_actions) that is True for the actions that are allowed.
+        """
+        rows, cols = positions[:, 0], positions[:, 1]
+        masks = self._position_masks[rows, cols]
+        masks[:, self.dot_action] = patterns[np.arange(len(patterns)), rows, cols] == 0
+
+        return masks
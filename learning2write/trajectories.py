@@ -0,0 +1,470 @@
+"""This module records the episodes run in the writing environment to disk, for offline RL and behaviour cloning.
+
+Wrap an environment in a `TrajectoryRecorder` (or a vectorised environment in a `VecTrajectoryRecorder`) and each
+finished episode is appended to a directory of recordings. The episodes are written in chunks of roughly `chunk_size`
+steps, and each chunk is a directory of `.npy` arrays that is written once and never changed afterwards.
+
+The observations are not stored as they are. A writing environment only changes a few cells of its observation per
+step, so an episode is stored as:
+
+    - its reference pattern, once, packed into bits (see `learning2write.bitpack`),
+    - the agent's position at each step,
+    - the cells of the drawn pattern that change at each step (usually none or one),
+    - the action and reward of each step.
+
+Episodes always start with an empty drawing, and the last step of an episode is the one where it is done. This takes
+about 16 bytes per step, instead of the 75 bytes of a raw 5x5 observation or the 2352 bytes of a 28x28 one.
+
+The drawn pattern is stored as deltas, but the agent's position is not. A position fits in two bytes for any grid of up
+to 256x256 cells, the same as a delta would, and storing it as it is means that reading a step does not have to add up
+the moves from the start of its episode. The rewards are stored as float64, the type the environment returns them in,
+so that the rewards read back are exactly the ones the agent was given.
+
+`TrajectoryReader` memory-maps the chunks of a recording and rebuilds the observations on demand, so any transition or
+episode can be read without loading the whole recording into memory:
+
+    reader = TrajectoryReader('trajectories/5x5')
+    observations, actions, rewards, next_observations, dones = reader.get_transitions([0, 10, 1000])
+    episode = reader.get_episode(42)
+"""
+import glob
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import gym
+import numpy as np
+from stable_baselines.common.vec_env import VecEnvWrapper
+
+from learning2write.bitpack import pack, unpack
+from learning2write.env import get_positions
+
+METADATA_FILENAME = 'trajectories.json'
+CHUNK_PREFIX = 'chunk_'
+DEFAULT_CHUNK_SIZE = 100000
+# The arrays of a chunk. The first three have an entry per episode and the rest have an entry per step, apart from
+# 'delta_cells' which has an entry per changed cell.
+EPISODE_ARRAYS = ['references', 'episode_ends', 'final_positions']
+STEP_ARRAYS = ['actions', 'rewards', 'positions', 'delta_ends']
+CHUNK_ARRAYS = EPISODE_ARRAYS + STEP_ARRAYS + ['delta_cells']
+
+
+def _compact(values) -> np.ndarray:
+    """Convert non-negative integers to an array of the smallest unsigned integer type that fits all of them."""
+    values = np.asarray(values)
+
+    return values.astype(np.min_scalar_type(values.max() if values.size > 0 else 0))
+
+
+class _EpisodeBuffer:
+    """The steps of an episode that is being recorded."""
+
+    def __init__(self, reference_pattern: np.ndarray, position: Tuple[int, int]):
+        """Start recording an episode.
+
+        :param reference_pattern: The episode's reference pattern.
+        :param position: The agent's position at the start of the episode.
+        """
+        self.reference_pattern = reference_pattern.copy()
+        self.actions = []
+        self.rewards = []
+        self.positions = [position]
+        self.deltas = []
+
+    def add(self, action: int, reward: float, position: Tuple[int, int], changed_cells: np.ndarray):
+        """Record a step.
+
+        :param action: The action taken.
+        :param reward: The reward for the action.
+        :param position: The agent's position after the action.
+        :param changed_cells: The flat indices of the cells of the drawn pattern that the action changed.
+        """
+        self.actions.append(action)
+        self.rewards.append(reward)
+        self.positions.append(position)
+        self.deltas.append(changed_cells)
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class TrajectoryWriter:
+    """Appends episodes to a directory of recordings in chunks."""
+
+    def __init__(self, path: str, pattern_shape: Tuple[int, int], chunk_size=DEFAULT_CHUNK_SIZE):
+        """Open a directory of recordings, creating it if it does not exist yet.
+
+        New chunks are added after the chunks that are already in the directory.
+
+        :param path: The directory to write the recordings to.
+        :param pattern_shape: The shape (height, width) of the patterns of the environment being recorded.
+        :param chunk_size: How many steps to hold in memory before they are written as a chunk. Chunks only hold whole
+                           episodes, so they are usually a little larger than this.
+        """
+        self.path = path
+        self.pattern_shape = tuple(pattern_shape)
+        self.chunk_size = chunk_size
+        self._episodes: List[_EpisodeBuffer] = []
+        self._n_buffered_steps = 0
+
+        os.makedirs(path, exist_ok=True)
+        metadata_path = os.path.join(path, METADATA_FILENAME)
+
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as file:
+                recorded_shape = tuple(json.load(file)['pattern_shape'])
+
+            if recorded_shape != self.pattern_shape:
+                raise ValueError('Cannot add %s patterns to the recordings of %s patterns in \'%s\''
+                                 % (self.pattern_shape, recorded_shape, path))
+        else:
+            with open(metadata_path, 'w') as file:
+                json.dump({'pattern_shape': self.pattern_shape}, file)
+
+        self._n_chunks = len(_list_chunks(path))
+
+    def add_episode(self, episode: _EpisodeBuffer):
+        """Add a finished episode, writing a chunk if enough steps have been added."""
+        self._episodes.append(episode)
+        self._n_buffered_steps += len(episode)
+
+        if self._n_buffered_steps >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the episodes added so far as a new chunk."""
+        if not self._episodes:
+            return
+
+        episodes, self._episodes, self._n_buffered_steps = self._episodes, [], 0
+        deltas = [delta for episode in episodes for delta in episode.deltas]
+        arrays = {
+            'references': pack(np.stack([episode.reference_pattern for episode in episodes])),
+            'episode_ends': np.cumsum([len(episode) for episode in episodes]).astype(np.uint32),
+            'final_positions': _compact([episode.positions[-1] for episode in episodes]),
+            'actions': _compact([action for episode in episodes for action in episode.actions]),
+            'rewards': np.array([reward for episode in episodes for reward in episode.rewards], dtype=np.float64),
+            'positions': _compact([position for episode in episodes for position in episode.positions[:-1]]),
+            'delta_ends': np.cumsum([len(delta) for delta in deltas]).astype(np.uint32),
+            'delta_cells': _compact(np.concatenate(deltas))
+        }
+
+        # Write the chunk under a temporary name first so that a reader never sees a partly written chunk.
+        chunk_path = os.path.join(self.path, '%s%06d' % (CHUNK_PREFIX, self._n_chunks))
+        temp_path = chunk_path + '.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, name + '.npy'), array)
+
+        os.rename(temp_path, chunk_path)
+        self._n_chunks += 1
+
+    def close(self):
+        """Write the remaining episodes."""
+        self.flush()
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    """Records the episodes of a writing environment, see the module docstring.
+
+    Only finished episodes are recorded, so the episode that is running when the recorder is closed is left out.
+    """
+
+    def __init__(self, env: gym.Env, path: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Wrap an environment.
+
+        :param env: The writing environment to record.
+        :param path: The directory to write the recordings to, see `TrajectoryWriter`.
+        :param chunk_size: Roughly how many steps to write to each chunk.
+        """
+        super().__init__(env)
+
+        self.writer = TrajectoryWriter(path, env.observation_space.shape[:2], chunk_size)
+        self._episode: Optional[_EpisodeBuffer] = None
+        # The drawn pattern of the last observation, flattened.
+        self._pattern: Optional[np.ndarray] = None
+
+    def reset(self, **kwargs):
+        observation = self.env.reset(**kwargs)
+        self._episode = _EpisodeBuffer(observation[..., 1], tuple(get_positions(observation[np.newaxis])[0]))
+        self._pattern = observation[..., 0].ravel()
+
+        return observation
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+
+        if self._episode is not None:
+            pattern = observation[..., 0].ravel()
+            self._episode.add(int(action), reward, tuple(get_positions(observation[np.newaxis])[0]),
+                              np.flatnonzero(pattern != self._pattern))
+            self._pattern = pattern
+
+            if done:
+                self.writer.add_episode(self._episode)
+                self._episode = None
+
+        return observation, reward, done, info
+
+    def flush(self):
+        """Write the finished episodes that have not been written yet.
+
+        The workers of a `SubprocVecEnv` exit without closing their environments, so call this through
+        `env_method('flush')` before closing one.
+        """
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+        return self.env.close()
+
+
+class VecTrajectoryRecorder(VecEnvWrapper):
+    """Records the episodes of a vectorised writing environment, see the module docstring.
+
+    The environment needs to report the last observation of each episode as `info['terminal_observation']`, as
+    `BatchedWritingEnvironment` does. The workers of a `SubprocVecEnv` reset their environments without passing on the
+    last observation, so record them by wrapping each worker's environment in a `TrajectoryRecorder` instead.
+    """
+
+    def __init__(self, venv, path: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Wrap a vectorised environment.
+
+        :param venv: The vectorised writing environment to record.
+        :param path: The directory to write the recordings of all of the environments to, see `TrajectoryWriter`.
+        :param chunk_size: Roughly how many steps to write to each chunk.
+        """
+        super().__init__(venv)
+
+        self.writer = TrajectoryWriter(path, venv.observation_space.shape[:2], chunk_size)
+        self._episodes: List[Optional[_EpisodeBuffer]] = [None] * self.num_envs
+        # The drawn patterns of the last observations, flattened.
+        self._patterns: Optional[np.ndarray] = None
+        self._actions: Optional[np.ndarray] = None
+
+    def reset(self):
+        observations = self.venv.reset()
+        self._patterns = observations[..., 0].reshape(self.num_envs, -1).copy()
+
+        for i, position in enumerate(get_positions(observations).tolist()):
+            self._episodes[i] = _EpisodeBuffer(observations[i, ..., 1], tuple(position))
+
+        return observations
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.venv.step_wait()
+        finished = np.flatnonzero(dones)
+        # The observations of the environments that finished an episode are already from the next episode.
+        last_observations = observations.copy() if finished.size > 0 else observations
+
+        for i in finished:
+            if 'terminal_observation' not in infos[i]:
+                raise ValueError('Cannot record an environment that does not report the terminal observation of its '
+                                 'episodes, see `VecTrajectoryRecorder`')
+
+            last_observations[i] = infos[i]['terminal_observation']
+
+        # Find the changed cells of every environment at once, and split them up by environment.
+        last_patterns = last_observations[..., 0].reshape(self.num_envs, -1)
+        changed_envs, changed_cells = np.nonzero(last_patterns != self._patterns)
+        deltas = [changed_cells[:0]] * self.num_envs
+
+        if changed_envs.size > 0:
+            boundaries = np.flatnonzero(np.diff(changed_envs)) + 1
+
+            starts = np.concatenate([[0], boundaries])
+
+            for i, cells in zip(changed_envs[starts].tolist(), np.split(changed_cells, boundaries)):
+                deltas[i] = cells
+
+        self._patterns = observations[..., 0].reshape(self.num_envs, -1).copy()
+        last_positions = get_positions(last_observations).tolist()
+
+        for i, (action, reward) in enumerate(zip(self._actions.tolist(), rewards.tolist())):
+            if self._episodes[i] is not None:
+                self._episodes[i].add(action, reward, tuple(last_positions[i]), deltas[i])
+
+        if finished.size > 0:
+            positions = get_positions(observations[finished]).tolist()
+
+            for i, position in zip(finished.tolist(), positions):
+                if self._episodes[i] is not None:
+                    self.writer.add_episode(self._episodes[i])
+
+                self._episodes[i] = _EpisodeBuffer(observations[i, ..., 1], tuple(position))
+
+        return observations, rewards, dones, infos
+
+    def seed(self, seed=None):
+        return self.venv.seed(seed)
+
+    def close(self):
+        self.writer.close()
+
+        return self.venv.close()
+
+
+def _list_chunks(path: str) -> List[str]:
+    """Find the chunks directly inside a directory of recordings, in the order they were written."""
+    return sorted(chunk_path for chunk_path in glob.glob(os.path.join(path, CHUNK_PREFIX + '*'))
+                  if not chunk_path.endswith('.tmp'))
+
+
+class _Chunk:
+    """The memory-mapped arrays of a chunk."""
+
+    def __init__(self, chunk_path: str):
+        self.arrays: Dict[str, np.ndarray] = {name: np.load(os.path.join(chunk_path, name + '.npy'), mmap_mode='r')
+                                              for name in CHUNK_ARRAYS}
+        self.n_steps = len(self.arrays['actions'])
+        self.n_episodes = len(self.arrays['episode_ends'])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+class TrajectoryReader:
+    """Reads recordings written by `TrajectoryRecorder` or `VecTrajectoryRecorder`.
+
+    The steps and episodes of every recording under a directory (e.g. one per worker process) are numbered in order of
+    the recordings' paths and then the order they were written in.
+    """
+
+    def __init__(self, path: str):
+        """Open the recordings under a directory.
+
+        :param path: The directory of a recording, or a directory that contains recordings in its subdirectories.
+        """
+        metadata_paths = sorted(glob.glob(os.path.join(path, '**', METADATA_FILENAME), recursive=True))
+
+        if not metadata_paths:
+            raise ValueError('No recordings found in \'%s\'' % path)
+
+        self.pattern_shape: Optional[Tuple[int, int]] = None
+        self.chunks: List[_Chunk] = []
+
+        for metadata_path in metadata_paths:
+            with open(metadata_path) as file:
+                pattern_shape = tuple(json.load(file)['pattern_shape'])
+
+            if self.pattern_shape is not None and pattern_shape != self.pattern_shape:
+                raise ValueError('The recordings in \'%s\' have patterns of different shapes, %s and %s'
+                                 % (path, self.pattern_shape, pattern_shape))
+
+            self.pattern_shape = pattern_shape
+            self.chunks += [_Chunk(chunk_path) for chunk_path in _list_chunks(os.path.dirname(metadata_path))]
+
+        # The index of the first step and the first episode of each chunk, and the total counts at the end.
+        self._step_offsets = np.cumsum([0] + [chunk.n_steps for chunk in self.chunks])
+        self._episode_offsets = np.cumsum([0] + [chunk.n_episodes for chunk in self.chunks])
+
+    @property
+    def n_steps(self) -> int:
+        return int(self._step_offsets[-1])
+
+    @property
+    def n_episodes(self) -> int:
+        return int(self._episode_offsets[-1])
+
+    @property
+    def n_cells(self) -> int:
+        return self.pattern_shape[0] * self.pattern_shape[1]
+
+    def __len__(self):
+        return self.n_steps
+
+    def get_transitions(self, indices) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Read a batch of steps.
+
+        :param indices: The indices of the steps, from 0 to `n_steps` - 1.
+        :return: A 5-tuple of the batch's observations, actions, rewards, next observations and whether the episode
+                 ended, in the same format as the environment's.
+        """
+        indices = np.atleast_1d(indices)
+
+        if np.any((indices < 0) | (indices >= self.n_steps)):
+            raise IndexError('Step indices must be between 0 and %d' % (self.n_steps - 1))
+
+        observations = np.zeros((len(indices),) + self.pattern_shape + (3,), dtype=np.uint8)
+        next_observations = np.zeros_like(observations)
+        actions = np.zeros(len(indices), dtype=np.int64)
+        rewards = np.zeros(len(indices), dtype=np.float64)
+        dones = np.zeros(len(indices), dtype=bool)
+
+        for i, index in enumerate(indices):
+            chunk_index = np.searchsorted(self._step_offsets, index, side='right') - 1
+            chunk = self.chunks[chunk_index]
+            step = index - self._step_offsets[chunk_index]
+            episode = np.searchsorted(chunk['episode_ends'], step, side='right')
+            episode_start = chunk['episode_ends'][episode - 1] if episode > 0 else 0
+            episode_end = chunk['episode_ends'][episode]
+
+            reference_pattern = unpack(chunk['references'][episode], self.pattern_shape)
+            observations[i, ..., 1] = reference_pattern
+            next_observations[i, ..., 1] = reference_pattern
+
+            # Replay the changes to the drawn pattern from the start of the episode up to and including this step.
+            delta_start = chunk['delta_ends'][episode_start - 1] if episode_start > 0 else 0
+            delta_step = chunk['delta_ends'][step - 1] if step > 0 else 0
+            delta_end = chunk['delta_ends'][step]
+            observations[i, ..., 0] = self._replay(chunk['delta_cells'][delta_start:delta_step])
+            next_observations[i, ..., 0] = self._replay(chunk['delta_cells'][delta_start:delta_end])
+
+            dones[i] = step + 1 == episode_end
+            row, col = chunk['positions'][step]
+            observations[i, row, col, 2] = 1
+            row, col = chunk['final_positions'][episode] if dones[i] else chunk['positions'][step + 1]
+            next_observations[i, row, col, 2] = 1
+
+            actions[i] = chunk['actions'][step]
+            rewards[i] = chunk['rewards'][step]
+
+        return observations, actions, rewards, next_observations, dones
+
+    def get_episode(self, index: int) -> dict:
+        """Read a whole episode.
+
+        :param index: The index of the episode, from 0 to `n_episodes` - 1.
+        :return: A dictionary with the episode's observations (including the terminal observation, so there is one
+                 more observation than there are steps), actions and rewards.
+        """
+        if not 0 <= index < self.n_episodes:
+            raise IndexError('Episode indices must be between 0 and %d' % (self.n_episodes - 1))
+
+        chunk_index = np.searchsorted(self._episode_offsets, index, side='right') - 1
+        chunk = self.chunks[chunk_index]
+        episode = index - self._episode_offsets[chunk_index]
+        start = chunk['episode_ends'][episode - 1] if episode > 0 else 0
+        end = chunk['episode_ends'][episode]
+
+        observations = np.zeros((end - start + 1,) + self.pattern_shape + (3,), dtype=np.uint8)
+        observations[..., 1] = unpack(chunk['references'][episode], self.pattern_shape)
+        positions = np.concatenate([chunk['positions'][start:end], chunk['final_positions'][episode:episode + 1]])
+        observations[np.arange(len(observations)), positions[:, 0], positions[:, 1], 2] = 1
+
+        pattern = np.zeros(self.n_cells, dtype=np.uint8)
+        delta_start = chunk['delta_ends'][start - 1] if start > 0 else 0
+
+        for step in range(start, end):
+            delta_end = chunk['delta_ends'][step]
+            pattern[chunk['delta_cells'][delta_start:delta_end]] ^= 1
+            observations[step - start + 1, ..., 0] = pattern.reshape(self.pattern_shape)
+            delta_start = delta_end
+
+        return {'observations': observations,
+                'actions': np.array(chunk['actions'][start:end], dtype=np.int64),
+                'rewards': np.array(chunk['rewards'][start:end])}
+
+    def _replay(self, cells: np.ndarray) -> np.ndarray:
+        """Get the drawn pattern after a sequence of changes to an empty pattern."""
+        counts = np.bincount(cells, minlength=self.n_cells) if cells.size > 0 else np.zeros(self.n_cells, dtype=int)
+
+        return (counts % 2).astype(np.uint8).reshape(self.pattern_shape)
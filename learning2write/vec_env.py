@@ -0,0 +1,423 @@
+"""This module defines a vectorised version of the learning2write environment that runs in a single process."""
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+from gym import spaces
+from stable_baselines.common.tile_images import tile_images
+from stable_baselines.common.vec_env import SubprocVecEnv, VecEnv
+
+from learning2write.env import WritingEnvironment, FILL_SQUARE, QUIT, PENALTY_PER_STEP, CORRECT_FILL_REWARD, \
+    CORRECT_PATTERN_REWARD, OUT_OF_BOUNDS_PENALTY, ACTION_MODES, get_action_masks, get_fill_reward_table
+from learning2write.instrumentation import Stats
+from learning2write.metrics import MAX_TABLE_CELLS, get_f1_table, precision_recall_f1
+from learning2write.patterns import PatternSet, Patterns3x3
+from learning2write.raster import Rasterizer
+from learning2write.strokes import StrokeActions, PEN_DOWN
+
+
+class BatchedWritingEnvironment(VecEnv):
+    """A batch of writing environments that are all stepped at once with vectorised NumPy operations.
+
+    This behaves like a `SubprocVecEnv` of `WritingEnvironment` instances, including resetting environments as soon as
+    their episode ends, but the state of every environment is kept in a few arrays with the environments along the
+    first axis. Stepping all of the environments costs a handful of array operations instead of a round trip to a
+    worker process per environment, which is much faster for the small grids.
+    """
+
+    # The change in the agent's position (row, col) for each of the move actions, indexed by action.
+    MOVE_OFFSETS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1]])
+
+    def __init__(self, n_envs: int, pattern_set: Optional[PatternSet] = None, max_steps=1000, observation_view=False,
+                 cell_size: Optional[int] = None, target_window_height=480, instrument=False, action_mode='cells',
+                 report_action_mask=False):
+        """Create a batch of writing environments.
+
+        :param n_envs: The number of environments to run.
+        :param pattern_set: The set of patterns to use. Defaults to 3x3.
+        :param max_steps: The maximum number of steps per episode.
+        :param observation_view: Whether observations (and rendered images) should be read-only views of the
+                                 environments' buffers instead of copies, see `WritingEnvironment`.
+        :param cell_size: The size in pixels of the squares representing a cell in rendered images. By default a cell
+                          size is automatically chosen.
+        :param target_window_height: The desired height of rendered images. Ignored if cell_size is set.
+        :param instrument: Whether or not to time each phase of resetting, stepping and rendering the environments,
+                           see `WritingEnvironment`. Each phase is timed once for the whole batch.
+        :param action_mode: Either 'cells' or 'strokes', see `WritingEnvironment`.
+        :param report_action_mask: Whether `step()` should pass the action mask of each environment as
+                                   `info['action_mask']`, see `action_masks` and `WritingEnvironment`.
+        """
+        if action_mode not in ACTION_MODES:
+            raise ValueError('Unrecognised action mode \'%s\'' % action_mode)
+
+        self.pattern_set = pattern_set if pattern_set else Patterns3x3()
+        self.pattern_shape = (self.pattern_set.height, self.pattern_set.width)
+        self.max_steps = max_steps
+        self.observation_view = observation_view
+        self.report_action_mask = report_action_mask
+        self.action_mode = action_mode
+        self.stroke_actions = StrokeActions(self.pattern_shape) if action_mode == 'strokes' else None
+
+        super().__init__(n_envs,
+                         spaces.Box(low=0, high=1, shape=self.pattern_shape + (3,), dtype=np.uint8),
+                         spaces.Discrete(self.stroke_actions.n_actions if self.stroke_actions
+                                         else WritingEnvironment.N_DISCRETE_ACTIONS))
+
+        # Environment State
+        # Same as `WritingEnvironment`, the observations are kept in one buffer that is updated in place and the
+        # patterns are views of its channels.
+        self._observations = np.zeros((n_envs,) + self.pattern_shape + (3,), dtype=np.uint8)
+        self.patterns: np.ndarray = self._observations[..., 0]
+        self.reference_patterns: np.ndarray = self._observations[..., 1]
+        self.steps = np.zeros(n_envs, dtype=int)
+        # Running counts for calculating the f1 scores, see `WritingEnvironment`.
+        self._true_positives = np.zeros(n_envs, dtype=int)
+        self._false_positives = np.zeros(n_envs, dtype=int)
+        self._n_targets = np.zeros(n_envs, dtype=int)
+        # Same as `WritingEnvironment`, the f1 scores and the rewards for filling a cell of the smaller grids are looked
+        # up in tables, for the whole batch at once.
+        self._f1_table = get_f1_table(self.n_cells) if self.n_cells <= MAX_TABLE_CELLS else None
+        self._fill_rewards = get_fill_reward_table(self.n_cells) if self.n_cells <= MAX_TABLE_CELLS else None
+        # Agent State
+        self.agent_positions = np.zeros((n_envs, 2), dtype=int)
+        self._observations[:, 0, 0, 2] = 1
+
+        self._actions: Optional[np.ndarray] = None
+        # Rendering, same as `WritingEnvironment`.
+        self.cell_size = cell_size if cell_size else int(target_window_height / (2 + self.pattern_shape[0]))
+        self.rasterizer: Optional[Rasterizer] = None
+        # Instrumentation
+        self.stats: Optional[Stats] = Stats() if instrument else None
+
+    @property
+    def action_masks(self) -> np.ndarray:
+        """Get which actions are worth taking in the current state of each environment, see
+        `learning2write.env.get_action_masks()`.
+
+        :return: A boolean array with the shape (n_envs, n_actions) that is True for the actions that are allowed.
+                 Each row is also passed as `info['action_mask']` by `step()` if `report_action_mask` is set, for the
+                 observation that is returned (i.e. for the first state of the next episode if the environment was
+                 reset).
+        """
+        return get_action_masks(self.patterns, self.agent_positions, self.stroke_actions)
+
+    @property
+    def n_cells(self) -> int:
+        return self.pattern_shape[0] * self.pattern_shape[1]
+
+    def seed(self, seed=None):
+        self.pattern_set.seed(seed)
+
+        return [seed] * self.num_envs
+
+    def get_stats(self) -> dict:
+        """Get the timings of each phase of the environments, if they are instrumented.
+
+        :return: The statistics of each phase, see `learning2write.instrumentation.Stats.as_dict()`. Empty if the
+                 environments are not instrumented.
+        """
+        return self.stats.as_dict() if self.stats is not None else {}
+
+    def reset_stats(self):
+        """Forget the timings recorded so far."""
+        if self.stats is not None:
+            self.stats.clear()
+
+    def reset(self):
+        self._reset(np.arange(self.num_envs))
+
+        return self._get_observations()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self):
+        if self.stats is not None:
+            start = perf_counter()
+
+        actions, self._actions = self._actions, None
+
+        is_unrecognised = (actions < 0) | (actions >= self.action_space.n)
+
+        if is_unrecognised.any():
+            raise ValueError('Unrecognised action(s): %s' % str(actions[is_unrecognised]))
+
+        rewards = np.full(self.num_envs, PENALTY_PER_STEP, dtype=np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        if self.stroke_actions:
+            self._strokes(actions, rewards, dones)
+        else:
+            self._cell_actions(actions, rewards, dones)
+
+        envs = np.arange(self.num_envs)
+        self.steps += 1
+        dones |= self.steps >= self.max_steps
+
+        infos = [dict() for _ in range(self.num_envs)]
+        finished = envs[dones]
+
+        if finished.size > 0:
+            for env in finished:
+                infos[env]['terminal_observation'] = self._observations[env].copy()
+
+            self._reset(finished)
+
+        if self.report_action_mask:
+            for info, action_mask in zip(infos, self.action_masks):
+                info['action_mask'] = action_mask
+
+        observations = self._get_observations()
+
+        if self.stats is not None:
+            self.stats.record('step', perf_counter() - start)
+
+        return observations, rewards, dones, infos
+
+    def close(self):
+        self.pattern_set.close()
+
+    def get_images(self) -> np.ndarray:
+        """Render every environment without a window, see `learning2write.raster`.
+
+        :return: The images with the shape (n_envs, height, width, 3).
+        """
+        if self.stats is not None:
+            start = perf_counter()
+
+        if self.rasterizer is None:
+            self.rasterizer = Rasterizer(self.pattern_shape, self.cell_size)
+
+        images = self.rasterizer.render(self.patterns, self.reference_patterns, self.agent_positions)
+
+        if self.observation_view:
+            images = images.view()
+            images.flags.writeable = False
+        else:
+            images = images.copy()
+
+        if self.stats is not None:
+            self.stats.record('render', perf_counter() - start)
+
+        return images
+
+    def render(self, mode='rgb_array', *args, **kwargs):
+        """Render all of the environments tiled into one image.
+
+        :param mode: Only 'rgb_array' is supported.
+        :return: The tiled image.
+        """
+        if mode == 'rgb_array':
+            return tile_images(self.get_images())
+        else:
+            raise NotImplementedError
+
+    def get_attr(self, attr_name, indices=None):
+        """Return an attribute of the environments.
+
+        Since all of the environments share the one object, the same value is returned for every index.
+        """
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        """Set an attribute of the environments.
+
+        Since all of the environments share the one object, the attribute is set for all environments.
+        """
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Call a method of the environments.
+
+        Since all of the environments share the one object, the method is called once and its result is returned for
+        every index.
+        """
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+
+        return [result for _ in self._get_indices(indices)]
+
+    def _cell_actions(self, actions: np.ndarray, rewards: np.ndarray, dones: np.ndarray):
+        """Carry out a batch of actions of the 'cells' action mode.
+
+        :param actions: The action of each environment.
+        :param rewards: The reward of each environment, updated in place.
+        :param dones: Whether the episode of each environment has ended, updated in place.
+        """
+        envs = np.arange(self.num_envs)
+        rows, cols = self.agent_positions[:, 0], self.agent_positions[:, 1]
+
+        fills = envs[(actions == FILL_SQUARE) & (self.patterns[envs, rows, cols] == 0)]
+        quits = envs[actions == QUIT]
+
+        if self.stats is not None:
+            reward_start = perf_counter()
+
+        if fills.size > 0:
+            self.patterns[fills, rows[fills], cols[fills]] = 1
+            is_target = self.reference_patterns[fills, rows[fills], cols[fills]] == 1
+
+            # Same as `WritingEnvironment.step`, the reward is proportional to the change in the f1 score.
+            if self._fill_rewards is not None:
+                rewards[fills] = self._fill_rewards[self._true_positives[fills], self._false_positives[fills],
+                                                    self._n_targets[fills], is_target.astype(int)]
+                self._true_positives[fills] += is_target
+                self._false_positives[fills] += ~is_target
+            else:
+                f1 = self._f1(fills)
+                self._true_positives[fills] += is_target
+                self._false_positives[fills] += ~is_target
+                rewards[fills] = (self._f1(fills) - f1) * CORRECT_FILL_REWARD
+
+        self._quit(quits, rewards, dones)
+
+        if self.stats is not None:
+            self.stats.record('reward', perf_counter() - reward_start)
+
+        movers = envs[actions < FILL_SQUARE]
+
+        if movers.size > 0:
+            new_positions = self.agent_positions[movers] + self.MOVE_OFFSETS[actions[movers]]
+            is_valid = np.all((0 <= new_positions) & (new_positions < self.pattern_shape), axis=1)
+            self._set_agent_positions(movers[is_valid], new_positions[is_valid])
+            rewards[movers[~is_valid]] = OUT_OF_BOUNDS_PENALTY
+            dones[movers[~is_valid]] = True
+
+    def _strokes(self, actions: np.ndarray, rewards: np.ndarray, dones: np.ndarray):
+        """Carry out a batch of actions of the 'strokes' action mode, see `WritingEnvironment._stroke()`.
+
+        The cells of every stroke in the batch are filled with one update of the patterns.
+
+        :param actions: The action of each environment.
+        :param rewards: The reward of each environment, updated in place.
+        :param dones: Whether the episode of each environment has ended, updated in place.
+        """
+        stroke_actions = self.stroke_actions
+        envs = np.arange(self.num_envs)
+        strokers = envs[actions < stroke_actions.n_strokes]
+        ends = self.agent_positions[strokers] + stroke_actions.end_offsets[actions[strokers]]
+        is_valid = np.all((0 <= ends) & (ends < self.pattern_shape), axis=1)
+        rewards[strokers[~is_valid]] = OUT_OF_BOUNDS_PENALTY
+        dones[strokers[~is_valid]] = True
+        strokers, ends = strokers[is_valid], ends[is_valid]
+
+        if self.stats is not None:
+            reward_start = perf_counter()
+
+        is_pen_down = stroke_actions.pens[actions[strokers]] == PEN_DOWN
+        fillers = np.concatenate([strokers[is_pen_down], envs[actions == stroke_actions.dot_action]])
+        batch, rows, cols = stroke_actions.get_cells(self.agent_positions[fillers], actions[fillers])
+        fill_envs = fillers[batch]
+        is_new = self.patterns[fill_envs, rows, cols] == 0
+        fill_envs, rows, cols = fill_envs[is_new], rows[is_new], cols[is_new]
+
+        if fill_envs.size > 0:
+            fills = np.unique(fill_envs)
+            f1 = self._f1(fills)
+            self.patterns[fill_envs, rows, cols] = 1
+            n_targets_filled = np.bincount(fill_envs, weights=self.reference_patterns[fill_envs, rows, cols] == 1,
+                                           minlength=self.num_envs).astype(int)
+            n_filled = np.bincount(fill_envs, minlength=self.num_envs)
+            self._true_positives += n_targets_filled
+            self._false_positives += n_filled - n_targets_filled
+            rewards[fills] = (self._f1(fills) - f1) * CORRECT_FILL_REWARD
+
+        self._quit(envs[actions == stroke_actions.quit_action], rewards, dones)
+
+        if self.stats is not None:
+            self.stats.record('reward', perf_counter() - reward_start)
+
+        self._set_agent_positions(strokers, ends)
+
+    def _quit(self, quits: np.ndarray, rewards: np.ndarray, dones: np.ndarray):
+        """End the episodes of the environments whose agents quit, with a reward for how accurate their drawing is.
+
+        :param quits: The indices of the environments whose agents quit.
+        :param rewards: The reward of each environment, updated in place.
+        :param dones: Whether the episode of each environment has ended, updated in place.
+        """
+        if quits.size > 0:
+            f1 = self._f1(quits)
+            rewards[quits] = f1 * CORRECT_PATTERN_REWARD - (1 - f1) * CORRECT_PATTERN_REWARD
+            dones[quits] = True
+
+    def _reset(self, envs: np.ndarray):
+        """Reset a subset of the environments.
+
+        :param envs: The indices of the environments to reset.
+        """
+        if self.stats is not None:
+            start = perf_counter()
+
+        self.patterns[envs] = 0
+        self._set_agent_positions(envs, np.zeros((len(envs), 2), dtype=int))
+        self.steps[envs] = 0
+
+        if self.stats is not None:
+            sample_start = perf_counter()
+            self.reference_patterns[envs] = self.pattern_set.sample_batch(len(envs))
+            self.stats.record('sample', perf_counter() - sample_start)
+        else:
+            self.reference_patterns[envs] = self.pattern_set.sample_batch(len(envs))
+
+        self._true_positives[envs] = 0
+        self._false_positives[envs] = 0
+        self._n_targets[envs] = np.count_nonzero(self.reference_patterns[envs] == 1, axis=(1, 2))
+
+        if self.stats is not None:
+            self.stats.record('reset', perf_counter() - start)
+
+    def _set_agent_positions(self, envs: np.ndarray, positions: np.ndarray):
+        """Update the agents' positions and the position channel of the observation buffer.
+
+        :param envs: The indices of the environments whose agents moved.
+        :param positions: The new positions (row, col) of the agents.
+        """
+        self._observations[envs, self.agent_positions[envs, 0], self.agent_positions[envs, 1], 2] = 0
+        self._observations[envs, positions[:, 0], positions[:, 1], 2] = 1
+        self.agent_positions[envs] = positions
+
+    def _get_observations(self) -> np.ndarray:
+        """Get the current state of the environments.
+
+        :return: The states as a batch of HWC tensors, the same as `WritingEnvironment.state`.
+        """
+        if self.stats is not None:
+            start = perf_counter()
+
+        if self.observation_view:
+            observations = self._observations.view()
+            observations.flags.writeable = False
+        else:
+            observations = self._observations.copy()
+
+        if self.stats is not None:
+            self.stats.record('observation', perf_counter() - start)
+
+        return observations
+
+    def _f1(self, envs: np.ndarray) -> np.ndarray:
+        """Calculate the f1 score of a subset of the environments' patterns from the running counts of filled cells.
+
+        :param envs: The indices of the environments to score.
+        :return: The f1 score of each environment.
+        """
+        if self._f1_table is not None:
+            return self._f1_table[self._true_positives[envs], self._false_positives[envs], self._n_targets[envs]]
+
+        _, _, f1 = precision_recall_f1(self._true_positives[envs], self._false_positives[envs], self._n_targets[envs],
+                                       self.n_cells)
+
+        return f1
+
+
+def seed_vec_env(env: VecEnv, seed: Optional[int]):
+    """Seed a vectorised environment, giving each worker process of a `SubprocVecEnv` its own seed.
+
+    :param env: The vectorised environment.
+    :param seed: The seed. Worker `i` of a `SubprocVecEnv` is seeded with `seed + i`.
+    """
+    if isinstance(env, SubprocVecEnv):
+        for i in range(env.num_envs):
+            env.env_method('seed', None if seed is None else seed + i, indices=i)
+    else:
+        env.seed(seed)
@@ -0,0 +1,152 @@
+"""This module defines the drawing of the learning2write environment in an interactive window.
+
+Drawing each cell as its own shape means creating and drawing thousands of one-off geoms every frame on the larger
+patterns. Instead, the cells of both patterns are kept in a persistent pyglet vertex list that is created once per
+window, and only the colours of the cells that changed since the last frame are updated.
+"""
+from typing import Tuple
+
+import numpy as np
+import pyglet
+from gym.envs.classic_control import rendering
+from pyglet import gl
+
+EMPTY_COLOUR = (255, 255, 255)
+FILLED_COLOUR = (0, 0, 0)
+OUTLINE_COLOUR = (0, 0, 0)
+MARKER_COLOUR = (255, 0, 0)
+
+
+class PatternsGeom(rendering.Geom):
+    """Draws the reference pattern, the current pattern and the agent's position marker in one batch."""
+
+    def __init__(self, pattern_shape: Tuple[int, int], cell_size: int, window_width: int, window_height: int,
+                 marker_resolution=16):
+        """Create the vertex lists for drawing the patterns.
+
+        The layout is the same as `learning2write.raster`: the reference pattern on the left and the current pattern
+        on the right, each with one cell of padding.
+
+        :param pattern_shape: The shape (rows, cols) of the patterns.
+        :param cell_size: The size in pixels of the squares representing a cell of a pattern.
+        :param window_width: The width of the window.
+        :param window_height: The height of the window.
+        :param marker_resolution: How many triangles to draw the agent's position marker with.
+        """
+        super().__init__()
+
+        self.pattern_shape = pattern_shape
+        self.cell_size = cell_size
+        self.batch = pyglet.graphics.Batch()
+
+        rows, cols = pattern_shape
+        # The pixel coordinates of the top left corner of each pattern. OpenGL's y-axis points up.
+        self.reference_origin = (cell_size, window_height - cell_size)
+        self.pattern_origin = (window_width // 2 + cell_size, window_height - cell_size)
+
+        cells = pyglet.graphics.OrderedGroup(0)
+        outlines = pyglet.graphics.OrderedGroup(1)
+        markers = pyglet.graphics.OrderedGroup(2)
+        n_cells = rows * cols
+        colours = np.tile(EMPTY_COLOUR, 4 * n_cells).tolist()
+
+        self.reference_cells = self.batch.add(4 * n_cells, gl.GL_QUADS, cells,
+                                              ('v2f/static', self._cell_vertices(self.reference_origin).tolist()),
+                                              ('c3B/stream', colours))
+        self.pattern_cells = self.batch.add(4 * n_cells, gl.GL_QUADS, cells,
+                                            ('v2f/static', self._cell_vertices(self.pattern_origin).tolist()),
+                                            ('c3B/stream', colours))
+
+        for origin in [self.reference_origin, self.pattern_origin]:
+            vertices = self._outline_vertices(origin)
+            self.batch.add(len(vertices), gl.GL_LINES, outlines, ('v2f/static', vertices.ravel().tolist()),
+                           ('c3B/static', np.tile(OUTLINE_COLOUR, len(vertices)).tolist()))
+
+        # The marker is a fan of triangles around the centre of a cell, which is moved by updating its vertices.
+        angles = 2 * np.pi * np.arange(marker_resolution + 1) / marker_resolution
+        ring = cell_size / 4 * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        self._marker_offsets = np.stack([np.zeros_like(ring[1:]), ring[:-1], ring[1:]], axis=1).reshape(-1, 2)
+        self.marker = self.batch.add(len(self._marker_offsets), gl.GL_TRIANGLES, markers,
+                                     ('v2f/stream', self._marker_offsets.ravel().tolist()),
+                                     ('c3B/static', np.tile(MARKER_COLOUR, len(self._marker_offsets)).tolist()))
+
+        # What is currently in the vertex lists, so that only the cells that change need to be updated.
+        self._reference_pattern = np.zeros(pattern_shape, dtype=bool)
+        self._pattern = np.zeros(pattern_shape, dtype=bool)
+        self._agent_position = None
+
+    def update(self, pattern: np.ndarray, reference_pattern: np.ndarray, agent_position: Tuple[int, int]):
+        """Update the colours of the cells that changed and the position of the marker.
+
+        :param pattern: The current pattern.
+        :param reference_pattern: The reference pattern.
+        :param agent_position: The agent's position (row, col).
+        """
+        self._update_cells(self.reference_cells, self._reference_pattern, reference_pattern)
+        self._update_cells(self.pattern_cells, self._pattern, pattern)
+
+        if agent_position != self._agent_position:
+            row, col = agent_position
+            x, y = self.pattern_origin
+            centre = (x + (col + 0.5) * self.cell_size, y - (row + 0.5) * self.cell_size)
+            self.marker.vertices[:] = (self._marker_offsets + centre).ravel().tolist()
+            self._agent_position = tuple(agent_position)
+
+    def render1(self):
+        self.batch.draw()
+
+    @staticmethod
+    def _update_cells(vertex_list, drawn: np.ndarray, pattern: np.ndarray):
+        """Update the colours of the cells of one pattern.
+
+        :param vertex_list: The vertex list of the cells of the pattern.
+        :param drawn: Which cells are currently drawn as filled. This is updated in place.
+        :param pattern: The pattern to draw.
+        """
+        is_filled = pattern > 0
+        changed = np.flatnonzero(is_filled != drawn)
+
+        if changed.size == 0:
+            return
+
+        is_filled = is_filled.ravel()
+
+        if changed.size > drawn.size // 4:
+            # Many cells changed (e.g. after a reset), so it is cheaper to replace all of the colours at once.
+            colours = np.where(is_filled[:, np.newaxis], FILLED_COLOUR, EMPTY_COLOUR)
+            vertex_list.colors[:] = np.repeat(colours, 4, axis=0).ravel().tolist()
+        else:
+            for cell in changed:
+                # Each cell has 4 vertices with 3 colour components each.
+                colour = FILLED_COLOUR if is_filled[cell] else EMPTY_COLOUR
+                vertex_list.colors[12 * cell:12 * (cell + 1)] = colour * 4
+
+        drawn[:] = is_filled.reshape(drawn.shape)
+
+    def _cell_vertices(self, origin: Tuple[int, int]) -> np.ndarray:
+        """Get the corners of every cell of a pattern.
+
+        :param origin: The pixel coordinates of the top left corner of the pattern.
+        :return: The flattened (x, y) coordinates of the 4 corners of each cell, in row-major order of the cells.
+        """
+        rows, cols = self.pattern_shape
+        x, y = origin
+        row, col = np.mgrid[:rows, :cols]
+        left, top = x + col.ravel() * self.cell_size, y - row.ravel() * self.cell_size
+        right, bottom = left + self.cell_size, top - self.cell_size
+
+        return np.stack([left, bottom, left, top, right, top, right, bottom], axis=1).ravel()
+
+    def _outline_vertices(self, origin: Tuple[int, int]) -> np.ndarray:
+        """Get the end points of the lines between (and around) the cells of a pattern.
+
+        :param origin: The pixel coordinates of the top left corner of the pattern.
+        :return: The (x, y) coordinates of the end points of each line, with the shape (n_lines * 2, 2).
+        """
+        rows, cols = self.pattern_shape
+        x, y = origin
+        width, height = cols * self.cell_size, rows * self.cell_size
+        lines = [[x, y - row * self.cell_size, x + width, y - row * self.cell_size] for row in range(rows + 1)] + \
+                [[x + col * self.cell_size, y, x + col * self.cell_size, y - height] for col in range(cols + 1)]
+
+        return np.array(lines, dtype=float).reshape(-1, 2)
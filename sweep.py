@@ -0,0 +1,241 @@
+import json
+import math
+import multiprocessing
+import os
+import shutil
+from datetime import datetime
+from typing import List, Optional
+
+import plac
+
+from experiments import Run, expand_spec
+from learning2write import get_pattern_set
+from learning2write.evaluation import evaluate, summarise
+from learning2write.vec_env import seed_vec_env
+
+# The train.py options that a sweep spec can set, with their defaults.
+SWEEP_OPTIONS = {
+    'pattern_set': '3x3',
+    'rotate_patterns': False,
+    'flip_patterns': False,
+    'materialize_augmentations': False,
+    'packed_patterns': False,
+    'emnist_batch_size': 512,
+    'emnist_prefetch': 0,
+    'model_type': 'acktr',
+    'policy_type': 'mlp',
+    'mask_actions': False,
+    'action_mode': 'cells',
+    'er_buffer_size': 1000000,
+    'n_workers': 4,
+    'vec_env_type': 'subproc'
+}
+METRICS = ['accuracy', 'f1', 'return']
+
+
+def get_rung_steps(min_steps: int, eta: int, max_steps: int, rung: int) -> int:
+    """Get how many steps a configuration has been trained for in total by the end of a rung.
+
+    :param min_steps: How many steps to train for in the first rung.
+    :param eta: How much longer each rung is than the previous one.
+    :param max_steps: The most steps to train a configuration for.
+    :param rung: The index of the rung.
+    :return: The number of steps.
+    """
+    return min(min_steps * eta ** rung, max_steps)
+
+
+def get_score(summary: dict, metric: str) -> float:
+    """Get the score of a configuration from the summary of its evaluation, see `evaluation.summarise()`."""
+    return summary['return']['mean'] if metric == 'return' else summary[metric]
+
+
+def get_ranking_key(summary: dict, metric: str) -> tuple:
+    """Get the key to rank a configuration by: its score, with the other metrics to break ties (e.g. early on, when
+    no configuration draws any of the patterns exactly)."""
+    return (get_score(summary, metric),) + tuple(get_score(summary, other) for other in METRICS if other != metric)
+
+
+def train_rung(run: Run, rung: int, model_path: Optional[str], steps: int, save_path: str, n_eval_episodes: int,
+               n_eval_envs: int) -> dict:
+    """Train a configuration for one rung and evaluate it.
+
+    This only takes picklable arguments so that it can be run in a worker process.
+
+    :param run: The configuration.
+    :param rung: The index of the rung.
+    :param model_path: The model saved at the end of the previous rung, or None to train a new model.
+    :param steps: How many steps to train for.
+    :param save_path: Where to save the model at the end of the rung.
+    :param n_eval_episodes: How many episodes to evaluate the model for.
+    :param n_eval_envs: How many environments to evaluate the model with at once.
+    :return: The summary of the evaluation, see `evaluation.summarise()`.
+    """
+    # Imported here so that TensorFlow is only loaded by the worker processes that train.
+    from train import get_env, get_model
+
+    args = dict(SWEEP_OPTIONS, **run.args)
+    pattern_set = get_pattern_set(args['pattern_set'], args['rotate_patterns'], args['emnist_batch_size'],
+                                  args['packed_patterns'], args['emnist_prefetch'], args['flip_patterns'],
+                                  args['materialize_augmentations'])
+    env = get_env(args['n_workers'], pattern_set, args['vec_env_type'], action_mode=args['action_mode'])
+    seed_vec_env(env, run.seed + rung)
+
+    try:
+        model = get_model(env, model_path, args['model_type'], pattern_set, args['policy_type'],
+                          args['er_buffer_size'], tensorboard_log_path='./tensorboard/',
+                          mask_actions=args['mask_actions'])
+        model.learn(total_timesteps=steps, tb_log_name='%s_RUNG%d' % (run.name.upper(), rung),
+                    reset_num_timesteps=model_path is None, seed=run.seed + rung)
+        model.save(save_path)
+    finally:
+        env.close()
+        pattern_set.close()
+
+    # Evaluate on the training distribution, but with a separate pattern set so that it does not disturb the one
+    # used for training.
+    eval_pattern_set = get_pattern_set(args['pattern_set'], args['rotate_patterns'], args['emnist_batch_size'],
+                                       flip_patterns=args['flip_patterns'])
+
+    def predict(observations):
+        actions, _ = model.predict(observations)
+
+        return actions
+
+    try:
+        return summarise(evaluate(predict, eval_pattern_set, n_eval_episodes, n_eval_envs, seed=run.seed,
+                                  action_mode=args['action_mode']))
+    finally:
+        eval_pattern_set.close()
+
+
+def _train_rung_task(task: tuple) -> tuple:
+    """Run `train_rung()` on a tuple of its arguments, for `Pool.imap_unordered()`.
+
+    :return: The configuration and the summary of its evaluation.
+    """
+    return task[0], train_rung(*task)
+
+
+def load_results(results_path: str) -> List[dict]:
+    """Load the results of the rungs of a sweep that have already been run, or an empty list if there are none."""
+    if not os.path.exists(results_path):
+        return []
+
+    with open(results_path) as file:
+        return json.load(file)
+
+
+def save_results(results_path: str, results: List[dict]):
+    """Save the results of the rungs of a sweep, replacing the previous results in one step."""
+    temp_path = results_path + '.tmp'
+
+    with open(temp_path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    os.replace(temp_path, results_path)
+
+
+@plac.annotations(
+    spec_path=plac.Annotation('The path to the JSON experiment spec of the configurations to compare, see '
+                              '`experiments.expand_spec()`. Each configuration is trained for at most the spec\'s '
+                              '\'steps\'.', type=str, kind='positional'),
+    min_steps=plac.Annotation('How many steps to train every configuration for in the first rung.', type=int,
+                              kind='option'),
+    eta=plac.Annotation('The reduction factor. Only the best 1/eta of the configurations are kept after each rung, '
+                        'and each rung trains for eta times as many steps as the previous one.', type=int,
+                        kind='option'),
+    metric=plac.Annotation('The metric to rank the configurations by.', choices=METRICS, type=str, kind='option'),
+    n_eval_episodes=plac.Annotation('How many episodes to evaluate each configuration for after each rung.', type=int,
+                                    kind='option'),
+    n_eval_envs=plac.Annotation('How many environments to evaluate each configuration with at once.', type=int,
+                                kind='option'),
+    n_parallel=plac.Annotation('How many configurations to train at once, each in its own process.', type=int,
+                               kind='option'),
+    sweep_path=plac.Annotation('The directory to save the models and results of the sweep to. Defaults to '
+                               '\'sweeps/<spec name>/\'.', type=str, kind='option')
+)
+def main(spec_path, min_steps=500000, eta=3, metric='accuracy', n_eval_episodes=1000, n_eval_envs=64, n_parallel=1,
+         sweep_path=None):
+    """Find the best of a set of training configurations with successive halving.
+
+    Every configuration is trained for a few steps and evaluated, and only the best of them are trained further. The
+    survivors of a rung carry on training from the models saved at the end of the previous rung. Running the sweep
+    again skips the rungs that have already been run.
+    """
+    if eta < 2:
+        raise ValueError('The reduction factor must be at least 2, got %d' % eta)
+
+    with open(spec_path) as file:
+        runs = expand_spec(json.load(file))
+
+    for run in runs:
+        for key in run.args:
+            if key not in SWEEP_OPTIONS:
+                raise ValueError('Unrecognised sweep option \'%s\'' % key)
+
+    sweep_path = sweep_path if sweep_path else os.path.join('sweeps', os.path.splitext(os.path.basename(spec_path))[0])
+    results_path = os.path.join(sweep_path, 'results.json')
+    results = load_results(results_path)
+    survivors = runs
+    rung = 0
+
+    # TensorFlow does not cope with being forked, so the workers are started fresh, and each configuration gets a new
+    # process so that its TensorFlow graph is freed afterwards.
+    with multiprocessing.get_context('spawn').Pool(n_parallel, maxtasksperchild=1) as pool:
+        while True:
+            if rung == len(results):
+                results.append({'rung': rung, 'results': {}})
+
+            rung_results = results[rung]['results']
+            tasks = []
+
+            for run in survivors:
+                save_path = os.path.join(sweep_path, run.name, 'rung%d.pkl' % rung)
+
+                if run.name in rung_results and os.path.exists(save_path):
+                    continue
+
+                previous_steps = get_rung_steps(min_steps, eta, run.steps, rung - 1) if rung > 0 else 0
+                model_path = os.path.join(sweep_path, run.name, 'rung%d.pkl' % (rung - 1)) if rung > 0 else None
+                steps = get_rung_steps(min_steps, eta, run.steps, rung) - previous_steps
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+                if steps == 0:
+                    # The configuration has already been trained for all of its steps, so carry its model and result
+                    # forward instead of evaluating the same model again.
+                    shutil.copyfile(model_path, save_path)
+                    rung_results[run.name] = results[rung - 1]['results'][run.name]
+                    save_results(results_path, results)
+                else:
+                    tasks.append((run, rung, model_path, steps, save_path, n_eval_episodes, n_eval_envs))
+
+            print('[%s] Rung %d: training %d of %d configurations.' % (datetime.now(), rung, len(tasks),
+                                                                        len(survivors)))
+
+            # Save the results as each configuration finishes, so that a stopped sweep only repeats the configurations
+            # that were training.
+            for run, summary in pool.imap_unordered(_train_rung_task, tasks):
+                rung_results[run.name] = dict(steps=get_rung_steps(min_steps, eta, run.steps, rung), **summary)
+                save_results(results_path, results)
+
+            ranking = sorted(survivors, key=lambda r: get_ranking_key(rung_results[r.name], metric), reverse=True)
+
+            for run in ranking:
+                print('    %-40s steps %9d  %s %.4f' % (run.name, rung_results[run.name]['steps'], metric,
+                                                         get_score(rung_results[run.name], metric)))
+
+            if len(ranking) == 1 or all(rung_results[run.name]['steps'] >= run.steps for run in ranking):
+                break
+
+            survivors = ranking[:max(1, math.ceil(len(ranking) / eta))]
+            rung += 1
+
+    best = ranking[0]
+    print('Best configuration: \'%s\' (%s %.4f), saved to \'%s\'.'
+          % (best.name, metric, get_score(rung_results[best.name], metric),
+             os.path.join(sweep_path, best.name, 'rung%d.pkl' % rung)))
+
+
+if __name__ == '__main__':
+    plac.call(main)
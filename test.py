@@ -1,19 +1,22 @@
 from datetime import datetime
 from statistics import mean
+from typing import Optional
 
 import numpy as np
 import plac
 
 from learning2write import get_pattern_set, VALID_PATTERN_SETS
 from learning2write.env import WritingEnvironment
-from train import get_model_type
+from learning2write.evaluation import get_model_action_mode
+from learning2write.inference import NumpyPolicy
 
 
 @plac.annotations(
-    model_path=plac.Annotation('The path and the filename of the saved model to run.',
-                               type=str, kind='positional'),
-    model_type=plac.Annotation('The type of model that is being loaded.', choices=['acktr', 'acer', 'ppo'],
+    model_path=plac.Annotation('The path and the filename of the saved model to run. This can also be a policy '
+                               'exported with `python -m learning2write.inference`, which runs without TensorFlow.',
                                type=str, kind='positional'),
+    model_type=plac.Annotation('The type of model that is being loaded. Not needed for exported policies.',
+                               choices=['acktr', 'acer', 'ppo'], type=str, kind='positional'),
     pattern_set=plac.Annotation('The set of patterns to use in the environment.', choices=VALID_PATTERN_SETS,
                                 kind='option', type=str),
     rotate_patterns=plac.Annotation('Flag indicating that patterns should be randomly rotated.', kind='flag'),
@@ -21,16 +24,17 @@ from train import get_model_type
     max_steps=plac.Annotation('The maximum number of steps to perform per episode.', type=int, kind='option'),
     fps=plac.Annotation('How many steps to perform per second.', type=float, kind='option')
 )
-def main(model_path, model_type, pattern_set='3x3', rotate_patterns=False, max_updates=1000, max_steps=100, fps=10.0):
+def main(model_path, model_type=None, pattern_set='3x3', rotate_patterns=False, max_updates=1000, max_steps=100,
+         fps=10.0):
     """Run a model in the writing environment in test mode (i.e. no training, just predictions).
 
     Press `Q` or `ESCAPE` to quit at any time.
     """
 
     pattern_set = get_pattern_set(pattern_set, rotate_patterns)
-    model = get_model_type(model_type).load(model_path)
+    model = load_model(model_path, model_type)
 
-    with WritingEnvironment(pattern_set) as env:
+    with WritingEnvironment(pattern_set, action_mode=get_model_action_mode(model, pattern_set)) as env:
         episode = 0
         updates = 0
         rewards = []
@@ -53,6 +57,24 @@ def main(model_path, model_type, pattern_set='3x3', rotate_patterns=False, max_u
                 break
 
 
+def load_model(model_path: str, model_type: Optional[str]):
+    """Load a saved model, or an exported policy if the path ends with '.npz'.
+
+    :param model_path: The path of the saved model or exported policy.
+    :param model_type: The type of model that is being loaded, see `train.get_model_type()`.
+    :return: The model.
+    """
+    if model_path.endswith('.npz'):
+        return NumpyPolicy.load(model_path)
+    elif model_type is None:
+        raise ValueError('The model type is needed to load \'%s\'' % model_path)
+
+    # Only import TensorFlow (through train.py) if it is needed.
+    from train import get_model_type
+
+    return get_model_type(model_type).load(model_path)
+
+
 def run_episode(env, episode, fps, updates, max_updates, max_steps, model):
     observation = env.reset()
     step = 0
@@ -0,0 +1,45 @@
+"""Fixtures and helpers shared by the tests."""
+import numpy as np
+import pytest
+
+from learning2write.emnist import get_patterns_path
+from learning2write.patterns import PatternSet
+
+N_FAKE_PATTERNS = 1000
+
+
+class RandomPatterns(PatternSet):
+    """Random patterns of any size, e.g. to stand in for EMNIST without its data."""
+
+    name = 'random'
+
+    def __init__(self, height: int, width: int, n_patterns=32, seed=0):
+        self.height, self.width = height, width
+        rng = np.random.RandomState(seed)
+        # Include empty and full patterns, where the rates have zero denominators.
+        self.patterns = (rng.rand(n_patterns, height, width) < rng.rand(n_patterns, 1, 1)).astype(np.uint8)
+        self.patterns[0] = 0
+        self.patterns[1] = 1
+        super().__init__()
+
+
+def get_indices(patterns: np.ndarray) -> np.ndarray:
+    """Get the index in the fake EMNIST dataset (see `data_path`) of each of a batch of patterns."""
+    return (patterns[..., 0, :10].astype(int) << np.arange(10)).sum(axis=-1)
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    """A directory with a small fake 'mnist' pattern file, so that the EMNIST data is not needed.
+
+    Every pattern is different: the index of each pattern is written in binary along its first row. The working
+    directory is changed to the directory above, so that the default EMNIST data path ('emnist_data') finds it too.
+    """
+    path = tmp_path / 'emnist_data'
+    path.mkdir()
+    patterns = np.zeros((N_FAKE_PATTERNS, 28, 28), dtype=np.uint8)
+    patterns[:, 0, :10] = np.arange(N_FAKE_PATTERNS)[:, np.newaxis] >> np.arange(10) & 1
+    np.save(get_patterns_path('mnist', data_path=str(path)), patterns)
+    monkeypatch.chdir(tmp_path)
+
+    return str(path)
@@ -0,0 +1,142 @@
+"""Tests that the action masks allow exactly the actions that change the state without ending the episode early."""
+import itertools
+from typing import Optional
+
+import numpy as np
+import pytest
+
+from learning2write.env import WritingEnvironment, FILL_SQUARE, QUIT, OUT_OF_BOUNDS_PENALTY, get_action_masks, \
+    get_position_masks
+from learning2write.patterns import get_pattern_set
+from learning2write.vec_env import BatchedWritingEnvironment
+
+
+def set_state(env: WritingEnvironment, pattern: np.ndarray, position):
+    """Put an environment in a state with the given drawn pattern and agent position."""
+    env.reset()
+    env.pattern[:] = pattern
+    env._set_agent_position(tuple(position))
+
+
+def get_states(shape, n_patterns: Optional[int] = None):
+    """Get drawn patterns and agent positions to check the masks in: every position with either every pattern, or
+    with random patterns.
+
+    :param shape: The shape (height, width) of the grid.
+    :param n_patterns: The number of random patterns, or None for every pattern.
+    :return: The patterns with the shape (n, height, width) and the positions with the shape (n, 2).
+    """
+    if n_patterns is None:
+        patterns = np.array(list(itertools.product([0, 1], repeat=9)), dtype=np.uint8).reshape(-1, 3, 3)
+    else:
+        patterns = np.random.RandomState(0).randint(2, size=(n_patterns,) + shape).astype(np.uint8)
+
+    positions = np.array(list(itertools.product(range(shape[0]), range(shape[1]))))
+    patterns, positions = np.repeat(patterns, len(positions), axis=0), np.tile(positions, (len(patterns), 1))
+
+    return patterns, positions
+
+
+def get_outcomes(pattern_set, patterns, positions, action_mode='cells') -> np.ndarray:
+    """Take every action in every state and see which ones are worth taking.
+
+    :return: A boolean array with the shape (n, n_actions) that is True for the actions that either quit, or change the
+             state without ending the episode.
+    """
+    env = WritingEnvironment(pattern_set, max_steps=1000000, action_mode=action_mode)
+    quit_action = env.stroke_actions.quit_action if env.stroke_actions else QUIT
+    outcomes = np.zeros((len(patterns), env.action_space.n), dtype=bool)
+
+    for i, (pattern, position) in enumerate(zip(patterns, positions)):
+        for action in range(env.action_space.n):
+            set_state(env, pattern, position)
+            observation = env.state
+            next_observation, reward, done, _ = env.step(action)
+            went_off_grid = done and reward == OUT_OF_BOUNDS_PENALTY
+            changed_state = not np.array_equal(observation, next_observation)
+            outcomes[i, action] = action == quit_action or (changed_state and not went_off_grid)
+
+    return outcomes
+
+
+# Every state of a 3x3 grid in the 'cells' action mode, and random states otherwise since there are many more actions.
+STATES = [((3, 3), 'cells', None), ((5, 5), 'cells', 100), ((3, 3), 'strokes', 20), ((5, 5), 'strokes', 10)]
+
+
+@pytest.mark.parametrize('shape, action_mode, n_patterns', STATES)
+def test_masks_match_the_outcome_of_every_action(shape, action_mode, n_patterns):
+    pattern_set = get_pattern_set('%dx%d' % shape)
+    patterns, positions = get_states(shape, n_patterns)
+    outcomes = get_outcomes(pattern_set, patterns, positions, action_mode)
+    env = WritingEnvironment(pattern_set, action_mode=action_mode)
+
+    np.testing.assert_array_equal(get_action_masks(patterns, positions, env.stroke_actions), outcomes)
+
+    for pattern, position, outcome in zip(patterns, positions, outcomes):
+        set_state(env, pattern, position)
+        np.testing.assert_array_equal(env.action_mask, outcome)
+
+    # The masked policies look the masks up by position, and then mask filling the agent's cell if it is filled.
+    fill_action = env.stroke_actions.dot_action if env.stroke_actions else FILL_SQUARE
+    position_masks = get_position_masks(shape, env.stroke_actions)[np.ravel_multi_index(positions.T, shape)]
+    can_fill = patterns[np.arange(len(patterns)), positions[:, 0], positions[:, 1]] == 0
+    masks = position_masks & (can_fill[:, np.newaxis] | (np.arange(env.action_space.n) != fill_action))
+    np.testing.assert_array_equal(masks, outcomes)
+
+
+@pytest.mark.parametrize('shape, action_mode, n_patterns', STATES)
+def test_mask_tensor_matches_the_outcome_of_every_action(shape, action_mode, n_patterns):
+    tf = pytest.importorskip('tensorflow')
+    from train import get_action_mask_tensor
+
+    pattern_set = get_pattern_set('%dx%d' % shape)
+    patterns, positions = get_states(shape, n_patterns)
+    outcomes = get_outcomes(pattern_set, patterns, positions, action_mode)
+    observations = np.zeros(patterns.shape + (3,), dtype=np.float32)
+    observations[..., 0] = patterns
+    observations[np.arange(len(positions)), positions[:, 0], positions[:, 1], 2] = 1
+
+    with tf.Graph().as_default(), tf.Session() as session:
+        observations_ph = tf.placeholder(tf.float32, (None,) + shape + (3,))
+        masks = session.run(get_action_mask_tensor(observations_ph, outcomes.shape[1]),
+                            {observations_ph: observations})
+
+    np.testing.assert_array_equal(masks, outcomes)
+
+
+@pytest.mark.parametrize('action_mode', ['cells', 'strokes'])
+@pytest.mark.parametrize('report_action_mask', [False, True])
+def test_masks_are_only_reported_when_asked_for(report_action_mask, action_mode):
+    n_envs = 8
+    pattern_set = get_pattern_set('5x5')
+    single = WritingEnvironment(pattern_set, max_steps=20, action_mode=action_mode,
+                                report_action_mask=report_action_mask)
+    batched = BatchedWritingEnvironment(n_envs, pattern_set, max_steps=20, action_mode=action_mode,
+                                        report_action_mask=report_action_mask)
+    rng = np.random.RandomState(0)
+    single.reset()
+    batched.reset()
+
+    for _ in range(100):
+        action = rng.randint(single.action_space.n)
+        _, _, done, info = single.step(action)
+
+        if report_action_mask:
+            # The mask is for the state that was stepped into.
+            np.testing.assert_array_equal(info['action_mask'], get_outcomes(pattern_set, single.pattern[np.newaxis],
+                                                                            [single.agent_position], action_mode)[0])
+        else:
+            assert 'action_mask' not in info
+
+        if done:
+            single.reset()
+
+        _, _, _, infos = batched.step(rng.randint(batched.action_space.n, size=n_envs))
+
+        if report_action_mask:
+            np.testing.assert_array_equal([info['action_mask'] for info in infos], batched.action_masks)
+            np.testing.assert_array_equal(batched.action_masks,
+                                          get_outcomes(pattern_set, batched.patterns, batched.agent_positions,
+                                                       action_mode))
+        else:
+            assert all('action_mask' not in info for info in infos)
@@ -0,0 +1,187 @@
+"""Tests for writing checkpoints in the background and the policy for which checkpoints to keep."""
+import os
+import threading
+
+import pytest
+
+import experiments
+from learning2write.checkpoints import Checkpoint, CheckpointWriter, RetentionPolicy, Snapshot, read_index, \
+    write_index
+
+
+def run_policy(policy: RetentionPolicy, metrics):
+    """Apply a retention policy after each checkpoint is saved, the same as `train.CheckpointHandler`.
+
+    :param policy: The retention policy.
+    :param metrics: The metric of each checkpoint, in the order they are saved.
+    :return: The indices of the checkpoints that are kept at the end.
+    """
+    checkpoints = []
+
+    for index, metric in enumerate(metrics):
+        checkpoints.append(Checkpoint('checkpoint_%05d.pkl' % index, index, metric=metric))
+        keep = policy.select(checkpoints)
+        checkpoints = [checkpoint for checkpoint in checkpoints if checkpoint.path in keep]
+
+    return [checkpoint.index for checkpoint in checkpoints]
+
+
+METRICS = [0.1, 0.5, 0.2, 0.9, 0.3, None, 0.7, 0.4, 0.8, 0.6, None, 0.05]
+
+
+def test_no_rules_keep_everything():
+    assert run_policy(RetentionPolicy(), METRICS) == list(range(len(METRICS)))
+
+
+def test_keep_last():
+    assert run_policy(RetentionPolicy(keep_last=3), METRICS) == [9, 10, 11]
+
+
+def test_keep_every():
+    assert run_policy(RetentionPolicy(keep_every=4), METRICS) == [0, 4, 8]
+
+
+def test_keep_best():
+    # A checkpoint that is dropped for not being among the best never comes back, and unscored ones are not kept.
+    assert run_policy(RetentionPolicy(keep_best=2), METRICS) == [3, 8]
+    assert run_policy(RetentionPolicy(keep_best=2, higher_is_better=False), METRICS) == [0, 11]
+
+
+def test_keep_best_keeps_checkpoints_that_may_still_be_scored():
+    # Checkpoints newer than the latest one with a metric may not have been evaluated yet.
+    assert run_policy(RetentionPolicy(keep_best=1), [0.5, 0.7, None, None]) == [1, 2, 3]
+
+
+def test_rules_are_combined():
+    assert run_policy(RetentionPolicy(keep_last=2, keep_every=5, keep_best=1), METRICS) == [0, 3, 5, 10, 11]
+
+
+def make_snapshot(save_to_file) -> Snapshot:
+    return Snapshot({'data': 1}, None, save_to_file)
+
+
+def test_writer_renames_finished_checkpoints(tmp_path):
+    path = str(tmp_path / 'checkpoint.pkl')
+    started, finish = threading.Event(), threading.Event()
+
+    def save_to_file(save_path, data=None, params=None):
+        with open(save_path, 'w') as file:
+            file.write('partial')
+            started.set()
+            finish.wait()
+            file.write(' and finished')
+
+    writer = CheckpointWriter()
+    writer.write(make_snapshot(save_to_file), path)
+    started.wait()
+
+    # While the checkpoint is being written it only exists under a temporary name.
+    assert writer.is_writing and not os.path.exists(path)
+
+    finish.set()
+    writer.wait()
+
+    assert not writer.is_writing
+    assert os.listdir(str(tmp_path)) == ['checkpoint.pkl']
+
+    with open(path) as file:
+        assert file.read() == 'partial and finished'
+
+
+def test_writer_keeps_the_previous_checkpoint_if_writing_fails(tmp_path):
+    path = str(tmp_path / 'checkpoint.pkl')
+
+    with open(path, 'w') as file:
+        file.write('previous')
+
+    def save_to_file(save_path, data=None, params=None):
+        with open(save_path, 'w') as file:
+            file.write('partial')
+
+        raise OSError('disk full')
+
+    writer = CheckpointWriter()
+    writer.write(make_snapshot(save_to_file), path)
+
+    with pytest.raises(OSError, match='disk full'):
+        writer.wait()
+
+    # The partly written temporary file is removed too.
+    assert os.listdir(str(tmp_path)) == ['checkpoint.pkl']
+
+    with open(path) as file:
+        assert file.read() == 'previous'
+
+    # The error is only raised once.
+    writer.wait()
+
+
+def write_checkpoints(checkpoint_path: str, timesteps):
+    """Write empty checkpoint files and their index, as if training had saved a checkpoint at each of the timesteps.
+
+    :return: The checkpoints.
+    """
+    os.makedirs(checkpoint_path, exist_ok=True)
+    checkpoints = [Checkpoint(os.path.join(checkpoint_path, 'checkpoint_%05d.pkl' % (10 * index)), index, 10 * index,
+                              timesteps_) for index, timesteps_ in enumerate(timesteps)]
+
+    for checkpoint in checkpoints:
+        open(checkpoint.path, 'w').close()
+
+    write_index(checkpoint_path, checkpoints)
+
+    return checkpoints
+
+
+def test_index_round_trip(tmp_path):
+    checkpoint_path = str(tmp_path)
+    checkpoints = write_checkpoints(checkpoint_path, [100, 200, 300])
+    # Written out of order, and with a checkpoint that has since been removed.
+    write_index(checkpoint_path, [checkpoints[2], checkpoints[0], checkpoints[1]])
+    os.remove(checkpoints[1].path)
+
+    assert read_index(checkpoint_path) == [checkpoints[0], checkpoints[2]]
+    assert read_index(str(tmp_path / 'missing')) == []
+
+
+class Popen:
+    """Records the commands that would have been started instead of starting them."""
+
+    commands = []
+
+    def __init__(self, command, **kwargs):
+        Popen.commands.append(command)
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    Popen.commands = []
+    monkeypatch.setattr(experiments.subprocess, 'Popen', Popen)
+
+    return Popen.commands
+
+
+def get_option(command, option):
+    return command[command.index(option) + 1] if option in command else None
+
+
+def test_runs_resume_from_latest_checkpoint(tmp_path, commands):
+    checkpoint_root, log_path = str(tmp_path / 'checkpoints'), str(tmp_path)
+    run = experiments.Run('run', {'model_type': 'acer'}, steps=1000, seed=0, cost=1)
+
+    assert isinstance(experiments.start_run(run, checkpoint_root, log_path), Popen)
+    assert get_option(commands[-1], '-model-path') is None
+    assert get_option(commands[-1], '-steps') == '1000'
+
+    checkpoints = write_checkpoints(os.path.join(checkpoint_root, 'run'), [250, 400, 600])
+    # The latest checkpoint has been removed, e.g. by hand.
+    os.remove(checkpoints[-1].path)
+    experiments.start_run(run, checkpoint_root, log_path)
+
+    assert get_option(commands[-1], '-model-path') == checkpoints[1].path
+    assert get_option(commands[-1], '-steps') == '600'
+
+    write_checkpoints(os.path.join(checkpoint_root, 'run'), [500, 1000])
+
+    assert experiments.start_run(run, checkpoint_root, log_path) is None
+    assert len(commands) == 2
@@ -0,0 +1,86 @@
+"""Tests for the headless evaluation harness, using a small fake EMNIST dataset (see `conftest.data_path`)."""
+import queue
+
+import numpy as np
+from gym import spaces
+
+from learning2write import evaluation
+from learning2write.bench import scripted_actions
+from learning2write.env import WritingEnvironment, QUIT
+from learning2write.evaluation import _evaluation_worker, evaluate_model
+from learning2write.patterns import get_pattern_set
+
+from conftest import N_FAKE_PATTERNS, get_indices
+
+
+class QuittingModel:
+    """A model that quits straight away, and remembers the reference patterns that it was shown."""
+
+    action_space = spaces.Discrete(WritingEnvironment.N_DISCRETE_ACTIONS)
+    references = []
+
+    @classmethod
+    def load(cls, load_path):
+        return cls()
+
+    def predict(self, observations, deterministic=False):
+        QuittingModel.references.extend(get_indices(observations[..., 1]))
+
+        return np.full(len(observations), QUIT), None
+
+
+def test_workers_evaluate_different_images(data_path):
+    n_workers, n_episodes = 4, 200
+    QuittingModel.references = []
+
+    for i in range(n_workers):
+        evaluate_model(QuittingModel, 'model.pkl', 'mnist', n_episodes, n_envs=10, seed=i, part=i, n_parts=n_workers)
+
+    assert len(QuittingModel.references) == n_workers * n_episodes
+    assert len(set(QuittingModel.references)) == n_workers * n_episodes <= N_FAKE_PATTERNS
+
+
+def test_flip_patterns_reaches_the_pattern_set(data_path, monkeypatch):
+    pattern_sets = []
+
+    def get_recorded_pattern_set(*args, **kwargs):
+        pattern_sets.append(get_pattern_set(*args, **kwargs))
+
+        return pattern_sets[-1]
+
+    monkeypatch.setattr(evaluation, 'get_pattern_set', get_recorded_pattern_set)
+    evaluate_model(QuittingModel, 'model.pkl', 'mnist', 10, flip_patterns=True)
+
+    assert len(pattern_sets) == 1 and pattern_sets[0].flip_patterns
+
+
+class ScriptedModel:
+    """A model that writes the reference pattern cell by cell, see `learning2write.bench.scripted_actions()`."""
+
+    action_space = spaces.Discrete(WritingEnvironment.N_DISCRETE_ACTIONS)
+
+    @classmethod
+    def load(cls, load_path):
+        return cls()
+
+    def load_parameters(self, load_path_or_dict):
+        pass
+
+    def predict(self, observations, deterministic=False):
+        return scripted_actions(observations), None
+
+
+def test_evaluations_of_the_same_model_are_identical(data_path):
+    # The evaluation process reuses its pattern set for every snapshot, so it has to start again from the same
+    # patterns each time for the results to be comparable.
+    requests, results = queue.Queue(), queue.Queue()
+
+    for key in range(2):
+        requests.put((key, b''))
+
+    requests.put(None)
+    _evaluation_worker(requests, results, ScriptedModel, 'mnist', 100, 8, 0, True, False, False)
+    (_, first, first_error), (_, second, second_error) = results.get(), results.get()
+
+    assert first_error is None and second_error is None
+    assert first == second
@@ -0,0 +1,126 @@
+"""Tests that the running counts of filled cells, and the tables of f1 scores and rewards looked up with them, score
+patterns exactly like rescoring the whole grid."""
+import numpy as np
+import pytest
+
+from learning2write.env import WritingEnvironment, CORRECT_FILL_REWARD, CORRECT_PATTERN_REWARD, FILL_SQUARE, QUIT
+from learning2write.metrics import MAX_TABLE_CELLS, get_f1_table, precision_recall_f1
+from learning2write.patterns import PatternSet
+from learning2write.vec_env import BatchedWritingEnvironment
+
+from conftest import RandomPatterns
+
+
+@pytest.mark.parametrize('shape', [(3, 3), (5, 5), (28, 28)])
+def test_running_counts_match_full_grid(shape):
+    env = WritingEnvironment(RandomPatterns(*shape), max_steps=10 * shape[0] * shape[1])
+    env.seed(0)
+    env.reset()
+    rng = np.random.RandomState(0)
+    # Mostly fills so that the patterns get crowded, with enough moves and quits to cover every kind of step.
+    probabilities = np.array([0.1, 0.1, 0.1, 0.1, 0.55, 0.05])
+    n_fills = n_quits = 0
+
+    for _ in range(5000):
+        action = rng.choice(WritingEnvironment.N_DISCRETE_ACTIONS, p=probabilities)
+        row, col = env.agent_position
+        is_new_fill = action == FILL_SQUARE and env.pattern[row, col] == 0
+        _, _, f1_before = WritingEnvironment._precision_recall_f1(env.reference_pattern, env.pattern)
+
+        _, reward, done, _ = env.step(action)
+
+        expected = WritingEnvironment._precision_recall_f1(env.reference_pattern, env.pattern)
+        assert precision_recall_f1(env._true_positives, env._false_positives, env._n_targets, env.n_cells) == expected
+        assert env._f1() == expected[2]
+
+        if is_new_fill:
+            assert reward == (expected[2] - f1_before) * CORRECT_FILL_REWARD
+            n_fills += 1
+        elif action == QUIT:
+            assert reward == expected[2] * CORRECT_PATTERN_REWARD - (1 - expected[2]) * CORRECT_PATTERN_REWARD
+            n_quits += 1
+
+        if done:
+            env.reset()
+
+    assert n_fills > 0 and n_quits > 0
+
+
+def get_counts(n_cells: int):
+    """Get every possible count of true positives, false positives and targets in a grid.
+
+    :return: The counts as three arrays.
+    """
+    counts = [(tp, fp, n_targets) for n_targets in range(n_cells + 1) for tp in range(n_targets + 1)
+              for fp in range(n_cells - n_targets + 1)]
+
+    return tuple(np.array(counts).T)
+
+
+def assert_bits_equal(actual, expected):
+    np.testing.assert_array_equal(np.asarray(actual, dtype=np.float64).view(np.uint64),
+                                  np.asarray(expected, dtype=np.float64).view(np.uint64))
+
+
+@pytest.mark.parametrize('n_cells', range(1, MAX_TABLE_CELLS + 1))
+def test_f1_table_matches_calculation(n_cells):
+    true_positives, false_positives, n_targets = get_counts(n_cells)
+    expected = [precision_recall_f1(tp, fp, n, n_cells)[2] for tp, fp, n in zip(*get_counts(n_cells))]
+
+    assert_bits_equal(get_f1_table(n_cells)[true_positives, false_positives, n_targets], expected)
+
+
+def get_rewards(pattern_set: PatternSet, is_batched: bool, use_tables: bool, counts, is_target=None) -> np.ndarray:
+    """Fill a cell (or quit if `is_target` is None) from each of the given counts and get the rewards."""
+    n = len(counts[0])
+    env = BatchedWritingEnvironment(n, pattern_set) if is_batched else WritingEnvironment(pattern_set)
+    assert env._f1_table is not None and env._fill_rewards is not None
+
+    if not use_tables:
+        env._f1_table = env._fill_rewards = None
+
+    if is_batched:
+        env.reset()
+        env._true_positives[:], env._false_positives[:], env._n_targets[:] = counts
+        rewards, dones = np.zeros(n), np.zeros(n, dtype=bool)
+
+        if is_target is None:
+            env._quit(np.arange(n), rewards, dones)
+        else:
+            env.reference_patterns[:, 0, 0] = is_target
+            env._cell_actions(np.full(n, FILL_SQUARE), rewards, dones)
+
+        return rewards
+
+    rewards = []
+
+    for tp, fp, n_targets in zip(*counts):
+        env.reset()
+        env._true_positives, env._false_positives, env._n_targets = int(tp), int(fp), int(n_targets)
+
+        if is_target is None:
+            rewards.append(env._quit_reward())
+        else:
+            env.reference_pattern[0, 0] = is_target
+            rewards.append(env._cell_action(FILL_SQUARE)[0])
+
+    return np.array(rewards)
+
+
+@pytest.mark.parametrize('n_cells', range(1, MAX_TABLE_CELLS + 1))
+@pytest.mark.parametrize('is_batched', [False, True])
+def test_table_rewards_match_calculation(n_cells, is_batched):
+    pattern_set = RandomPatterns(1, n_cells)
+    counts = get_counts(n_cells)
+    true_positives, false_positives, n_targets = counts
+
+    assert_bits_equal(get_rewards(pattern_set, is_batched, True, counts),
+                      get_rewards(pattern_set, is_batched, False, counts))
+
+    # A target (or non-target) cell can only be filled if there are targets (or non-targets) left to fill.
+    for is_target, can_fill in [(1, true_positives < n_targets), (0, false_positives < n_cells - n_targets)]:
+        fill_counts = tuple(count[can_fill] for count in counts)
+
+        if len(fill_counts[0]) > 0:
+            assert_bits_equal(get_rewards(pattern_set, is_batched, True, fill_counts, is_target),
+                              get_rewards(pattern_set, is_batched, False, fill_counts, is_target))
@@ -0,0 +1,67 @@
+"""Tests for sampling the EMNIST pattern set, using a small fake dataset (see `conftest.data_path`)."""
+import pickle
+
+import numpy as np
+import pytest
+
+from learning2write.patterns import PatternsMNIST
+from learning2write.shared import SharedPatternStore
+
+from conftest import get_indices
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_seed_makes_sampling_reproducible(data_path, prefetch):
+    pattern_set = PatternsMNIST('mnist', batch_size=32, prefetch=prefetch, data_path=data_path)
+
+    try:
+        pattern_set.seed(1)
+        first = get_indices(pattern_set.sample_batch(96))
+        pattern_set.sample_batch(150)
+        pattern_set.seed(1)
+        second = get_indices(pattern_set.sample_batch(96))
+        pattern_set.seed(2)
+        other = get_indices(pattern_set.sample_batch(96))
+    finally:
+        pattern_set.close()
+
+    np.testing.assert_array_equal(first, second)
+    assert not np.array_equal(first, other)
+    # Every seed still starts from the beginning of the dataset.
+    assert set(other) == set(first)
+
+
+def test_parts_are_disjoint_and_each_epoch_covers_the_dataset(data_path):
+    pattern_sets = [PatternsMNIST('mnist', batch_size=32, data_path=data_path) for _ in range(4)]
+    indices = []
+
+    for part, pattern_set in enumerate(pattern_sets):
+        pattern_set.set_part(part, len(pattern_sets))
+        pattern_set.seed(part)
+        indices.append(get_indices(pattern_set.sample_batch(224)))
+
+    assert len(set(np.concatenate(indices))) == 4 * 224
+    # The rest of the epoch wraps around to the beginning of the dataset and stops where the part started.
+    rest = get_indices(pattern_sets[1].sample_batch(len(pattern_sets[1]) - 224))
+    assert sorted(np.concatenate([indices[1], rest])) == list(range(len(pattern_sets[1])))
+
+
+def test_shared_store_keeps_emnist_sampling(data_path):
+    pattern_set = PatternsMNIST('mnist', batch_size=16, prefetch=2, data_path=data_path)
+
+    with SharedPatternStore(pattern_set) as pattern_store:
+        shared_pattern_set = pickle.loads(pickle.dumps(pattern_store.patterns))
+
+    assert isinstance(shared_pattern_set, PatternsMNIST)
+    assert (shared_pattern_set.batch_size, shared_pattern_set.prefetch) == (16, 2)
+
+    shared_pattern_set.set_part(1, 2)
+    pattern_set.set_part(1, 2)
+    shared_pattern_set.seed(0)
+    pattern_set.seed(0)
+
+    try:
+        np.testing.assert_array_equal(shared_pattern_set.sample_batch(50), pattern_set.sample_batch(50))
+    finally:
+        shared_pattern_set.close()
+        pattern_set.close()
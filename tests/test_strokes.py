@@ -0,0 +1,167 @@
+"""Tests for the actions of the 'strokes' action mode."""
+import numpy as np
+import pytest
+
+from learning2write.env import WritingEnvironment, FILL_SQUARE, QUIT, PENALTY_PER_STEP, OUT_OF_BOUNDS_PENALTY, \
+    get_default_max_steps
+from learning2write.strokes import PEN_UP, PEN_DOWN, DIRECTIONS, StrokeActions
+
+from conftest import RandomPatterns
+
+UP, DOWN, LEFT, RIGHT, UP_LEFT, UP_RIGHT, DOWN_LEFT, DOWN_RIGHT = range(len(DIRECTIONS))
+
+
+def get_envs(shape=(5, 5), seed=0):
+    """Create an environment in each action mode that start their episodes with the same reference patterns."""
+    envs = []
+
+    for action_mode in ['strokes', 'cells']:
+        env = WritingEnvironment(RandomPatterns(*shape, seed=seed), action_mode=action_mode)
+        env.seed(seed)
+        env.reset()
+        envs.append(env)
+
+    return envs
+
+
+def test_actions_are_numbered_as_documented():
+    stroke_actions = StrokeActions((5, 7))
+    assert stroke_actions.max_length == 6
+    assert stroke_actions.n_actions == 2 * len(DIRECTIONS) * 6 + 2
+    assert stroke_actions.dot_action == stroke_actions.n_actions - 2
+    assert stroke_actions.quit_action == stroke_actions.n_actions - 1
+
+    action = stroke_actions.encode(PEN_DOWN, DOWN_LEFT, 3)
+    assert (stroke_actions.pens[action], stroke_actions.directions[action], stroke_actions.lengths[action]) == \
+        (PEN_DOWN, DOWN_LEFT, 3)
+
+    with pytest.raises(ValueError):
+        stroke_actions.encode(PEN_DOWN, DOWN, 7)
+
+
+def test_strokes_reach_the_grid_edge_but_do_not_cross_it():
+    env, _ = get_envs()
+    encode = env.stroke_actions.encode
+
+    # A stroke that ends on the edge fills every cell from the agent's cell up to and including the edge.
+    _, _, done, _ = env.step(encode(PEN_DOWN, DOWN_RIGHT, 4))
+    assert not done
+    assert env.agent_position == (4, 4)
+    np.testing.assert_array_equal(env.pattern, np.eye(5))
+
+    # Same as a move off the grid, a stroke that would cross the edge ends the episode without drawing anything.
+    for direction in [DOWN, RIGHT, DOWN_RIGHT, DOWN_LEFT]:
+        env.reset()
+        env._set_agent_position((4, 4))
+        _, reward, done, _ = env.step(encode(PEN_DOWN, direction, 1))
+        assert done and reward == OUT_OF_BOUNDS_PENALTY
+        assert env.agent_position == (4, 4)
+        assert not env.pattern.any()
+
+    env.reset()
+    _, _, done, _ = env.step(encode(PEN_DOWN, RIGHT, 4))
+    assert not done
+    _, reward, done, _ = env.step(encode(PEN_UP, UP, 1))
+    assert done and reward == OUT_OF_BOUNDS_PENALTY
+    np.testing.assert_array_equal(env.pattern[0], 1)
+
+
+def test_get_cells_includes_the_first_and_last_cells():
+    stroke_actions = StrokeActions((5, 5))
+    actions = np.array([stroke_actions.encode(PEN_DOWN, UP_RIGHT, 4), stroke_actions.encode(PEN_UP, LEFT, 2),
+                        stroke_actions.dot_action])
+    batch, rows, cols = stroke_actions.get_cells(np.array([[4, 0], [2, 3], [1, 1]]), actions)
+
+    assert list(zip(batch, rows, cols)) == [(0, 4, 0), (0, 3, 1), (0, 2, 2), (0, 1, 3), (0, 0, 4),
+                                            (1, 2, 3), (1, 2, 2), (1, 2, 1),
+                                            (2, 1, 1)]
+
+
+def test_pen_up_only_moves():
+    env, _ = get_envs()
+    _, reward, done, _ = env.step(env.stroke_actions.encode(PEN_UP, DOWN_RIGHT, 3))
+
+    assert not done and reward == PENALTY_PER_STEP
+    assert env.agent_position == (3, 3)
+    assert not env.pattern.any()
+
+
+def test_pen_down_fills_and_moves():
+    env, _ = get_envs()
+    env.step(env.stroke_actions.encode(PEN_DOWN, RIGHT, 2))
+    env.step(env.stroke_actions.encode(PEN_DOWN, DOWN, 2))
+
+    assert env.agent_position == (2, 2)
+    np.testing.assert_array_equal(np.argwhere(env.pattern), [[0, 0], [0, 1], [0, 2], [1, 2], [2, 2]])
+
+
+def test_dot_fills_only_the_agents_cell():
+    env, _ = get_envs()
+    env.step(env.stroke_actions.encode(PEN_UP, DOWN, 2))
+    _, _, done, _ = env.step(env.stroke_actions.dot_action)
+
+    assert not done
+    assert env.agent_position == (2, 0)
+    np.testing.assert_array_equal(np.argwhere(env.pattern), [[2, 0]])
+
+    # Drawing a dot on a filled cell is the same as filling a filled cell in the 'cells' action mode.
+    _, reward, done, _ = env.step(env.stroke_actions.dot_action)
+    assert not done and reward == PENALTY_PER_STEP
+    np.testing.assert_array_equal(np.argwhere(env.pattern), [[2, 0]])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_quit_rewards_are_the_same_in_both_action_modes(seed):
+    strokes_env, cells_env = get_envs(seed=seed)
+    np.testing.assert_array_equal(strokes_env.reference_pattern, cells_env.reference_pattern)
+
+    strokes_env.step(strokes_env.stroke_actions.encode(PEN_DOWN, DOWN_RIGHT, 4))
+
+    for i in range(5):
+        cells_env._set_agent_position((i, i))
+        cells_env.step(FILL_SQUARE)
+
+    _, strokes_reward, strokes_done, _ = strokes_env.step(strokes_env.stroke_actions.quit_action)
+    _, cells_reward, cells_done, _ = cells_env.step(QUIT)
+
+    assert strokes_done and cells_done
+    assert strokes_reward == pytest.approx(cells_reward)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_stroke_rewards_are_the_same_as_filling_the_cells_one_at_a_time(seed):
+    strokes_env, cells_env = get_envs((7, 7), seed)
+    stroke_actions = strokes_env.stroke_actions
+    rng = np.random.RandomState(seed)
+
+    for _ in range(30):
+        # Draw a stroke (or a dot) that stays on the grid.
+        mask = strokes_env.action_mask
+        mask[stroke_actions.quit_action] = False
+        action = rng.choice(np.flatnonzero(mask))
+        _, rows, cols = stroke_actions.get_cells(np.array([strokes_env.agent_position]), np.array([action]))
+        is_pen_down = action == stroke_actions.dot_action or stroke_actions.pens[action] == PEN_DOWN
+        _, stroke_reward, done, _ = strokes_env.step(action)
+        assert not done
+
+        # Fill the same cells one at a time, skipping those that are already filled.
+        fill_rewards = []
+
+        for row, col in zip(rows, cols):
+            if is_pen_down and cells_env.pattern[row, col] == 0:
+                cells_env._set_agent_position((row, col))
+                fill_rewards.append(cells_env.step(FILL_SQUARE)[1])
+
+        cells_env._set_agent_position(strokes_env.agent_position)
+
+        np.testing.assert_array_equal(strokes_env.pattern, cells_env.pattern)
+        assert stroke_reward == pytest.approx(sum(fill_rewards) if fill_rewards else PENALTY_PER_STEP)
+
+
+def test_default_max_steps():
+    # Enough moves to cover the grid twice, or enough strokes to cross it twice in each direction.
+    assert get_default_max_steps((5, 5)) == 50
+    assert get_default_max_steps((28, 28)) == 1568
+    assert get_default_max_steps((5, 5), 'strokes') == 20
+    assert get_default_max_steps((28, 28), 'strokes') == 112
+    assert get_default_max_steps((3, 7), 'strokes') == 20
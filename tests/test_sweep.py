@@ -0,0 +1,112 @@
+"""Tests for successive halving sweeps, with the training and evaluation of each configuration faked."""
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import sweep
+from experiments import Run
+
+
+def test_rung_steps_grow_until_the_maximum():
+    assert [sweep.get_rung_steps(100, 3, 1000, rung) for rung in range(5)] == [100, 300, 900, 1000, 1000]
+
+
+def get_summary(score: float, f1=None, mean_return=None) -> dict:
+    return {'accuracy': score, 'f1': score if f1 is None else f1,
+            'return': {'mean': score if mean_return is None else mean_return}}
+
+
+def test_ranking_breaks_ties_with_the_other_metrics():
+    summaries = {'a': get_summary(0.0, f1=0.5), 'b': get_summary(0.0, f1=0.7), 'c': get_summary(0.1, f1=0.1),
+                 'd': get_summary(0.0, f1=0.5, mean_return=3)}
+    ranking = sorted(summaries, key=lambda name: sweep.get_ranking_key(summaries[name], 'accuracy'), reverse=True)
+
+    assert ranking == ['c', 'b', 'd', 'a']
+    assert sweep.get_score(summaries['d'], 'return') == 3
+
+
+class Pool:
+    """Runs the tasks in this process instead of in a pool of worker processes."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @staticmethod
+    def imap_unordered(function, tasks):
+        return map(function, tasks)
+
+
+# The configurations, from best to worst. 'short' is only trained for 200 steps, the others for 800.
+SCORES = {'short_seed0': 0.9, 'p1_seed0': 0.8, 'p2_seed0': 0.7, 'p3_seed0': 0.6, 'p4_seed0': 0.5, 'p5_seed0': 0.4,
+          'p6_seed0': 0.3, 'p7_seed0': 0.2}
+
+
+@pytest.fixture
+def trained(tmp_path, monkeypatch):
+    """Fake the training of each rung, recording the (configuration, rung, steps) that were trained."""
+    trained = []
+
+    def train_rung_task(task):
+        run, rung, model_path, steps, save_path, _, _ = task
+        assert (model_path is None) == (rung == 0)
+        assert model_path is None or os.path.exists(model_path)
+        trained.append((run.name, rung, steps))
+        open(save_path, 'w').close()
+
+        return run, get_summary(SCORES[run.name])
+
+    monkeypatch.setattr(sweep.multiprocessing, 'get_context', lambda method: SimpleNamespace(Pool=Pool))
+    monkeypatch.setattr(sweep, '_train_rung_task', train_rung_task)
+
+    return trained
+
+
+def run_sweep(tmp_path):
+    spec_path = str(tmp_path / 'spec.json')
+
+    with open(spec_path, 'w') as file:
+        json.dump({'runs': [{'policy_type': 'short', 'steps': 200},
+                            {'policy_type': ['p%d' % i for i in range(1, 8)]}], 'steps': 800}, file)
+
+    sweep.main(spec_path, min_steps=100, eta=2, sweep_path=str(tmp_path / 'sweep'))
+
+    with open(str(tmp_path / 'sweep' / 'results.json')) as file:
+        return json.load(file)
+
+
+def test_survivors_that_reached_their_steps_are_not_trained_again(tmp_path, trained):
+    results = run_sweep(tmp_path)
+
+    assert sorted(trained) == sorted([(name, 0, 100) for name in SCORES] +
+                                     [(name, 1, 100) for name in ['short_seed0', 'p1_seed0', 'p2_seed0', 'p3_seed0']] +
+                                     [('p1_seed0', 2, 200)])
+    assert [sorted(rung['results']) for rung in results] == [sorted(SCORES),
+                                                              ['p1_seed0', 'p2_seed0', 'p3_seed0', 'short_seed0'],
+                                                              ['p1_seed0', 'short_seed0'], ['short_seed0']]
+    assert results[3]['results']['short_seed0'] == results[2]['results']['short_seed0'] == \
+        results[1]['results']['short_seed0']
+    assert results[2]['results']['p1_seed0']['steps'] == 400
+    # The best configuration's model is where the sweep says it is saved.
+    assert os.path.exists(str(tmp_path / 'sweep' / 'short_seed0' / 'rung3.pkl'))
+
+
+def test_resume_only_trains_what_is_missing(tmp_path, trained):
+    results = run_sweep(tmp_path)
+    del trained[:]
+
+    assert run_sweep(tmp_path) == results
+    assert trained == []
+
+    # Stopped while the last rung was training.
+    os.remove(str(tmp_path / 'sweep' / 'p1_seed0' / 'rung2.pkl'))
+
+    assert run_sweep(tmp_path) == results
+    assert trained == [('p1_seed0', 2, 200)]
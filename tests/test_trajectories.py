@@ -0,0 +1,113 @@
+"""Tests that the recorded episodes read back exactly as they were run."""
+import numpy as np
+import pytest
+
+from learning2write.env import WritingEnvironment
+from learning2write.patterns import get_pattern_set
+from learning2write.trajectories import TrajectoryReader, TrajectoryRecorder, VecTrajectoryRecorder
+from learning2write.vec_env import BatchedWritingEnvironment
+
+
+def run_single(path, seed, n_steps=300, chunk_size=50):
+    """Run a recorded single environment with random actions.
+
+    :return: The finished episodes as dictionaries of their observations, actions and rewards.
+    """
+    env = TrajectoryRecorder(WritingEnvironment(get_pattern_set('5x5'), max_steps=20), path, chunk_size)
+    env.seed(seed)
+    rng = np.random.RandomState(seed)
+    episodes = []
+    observations, actions, rewards = [env.reset()], [], []
+
+    for _ in range(n_steps):
+        action = rng.randint(env.action_space.n)
+        observation, reward, done, _ = env.step(action)
+        observations.append(observation)
+        actions.append(action)
+        rewards.append(reward)
+
+        if done:
+            episodes.append({'observations': np.array(observations), 'actions': actions, 'rewards': rewards})
+            observations, actions, rewards = [env.reset()], [], []
+
+    env.close()
+
+    return episodes
+
+
+def run_batched(path, seed, n_envs=4, n_steps=100, chunk_size=50):
+    """Run a recorded batched environment with random actions.
+
+    :return: The finished episodes, in the order they finished (and by environment for those that finish together).
+    """
+    env = VecTrajectoryRecorder(BatchedWritingEnvironment(n_envs, get_pattern_set('5x5'), max_steps=20), path,
+                                chunk_size)
+    env.seed(seed)
+    rng = np.random.RandomState(seed)
+    episodes = []
+    last_observations = env.reset()
+    running = [{'observations': [observation], 'actions': [], 'rewards': []} for observation in last_observations]
+
+    for _ in range(n_steps):
+        actions = rng.randint(env.action_space.n, size=n_envs)
+        last_observations, rewards, dones, infos = env.step(actions)
+
+        for i, episode in enumerate(running):
+            episode['observations'].append(infos[i]['terminal_observation'] if dones[i] else last_observations[i])
+            episode['actions'].append(actions[i])
+            episode['rewards'].append(rewards[i])
+
+            if dones[i]:
+                episodes.append(episode)
+                running[i] = {'observations': [last_observations[i]], 'actions': [], 'rewards': []}
+
+    env.close()
+
+    return episodes
+
+
+def assert_recorded(path, episodes):
+    """Check that a recording holds exactly the given episodes, both as whole episodes and as transitions."""
+    reader = TrajectoryReader(path)
+    assert reader.n_episodes == len(episodes)
+    assert reader.n_steps == sum(len(episode['actions']) for episode in episodes)
+
+    for index, episode in enumerate(episodes):
+        recorded = reader.get_episode(index)
+        np.testing.assert_array_equal(recorded['observations'], episode['observations'])
+        np.testing.assert_array_equal(recorded['actions'], episode['actions'])
+        # The rewards are stored with the same precision the environment returns them in.
+        assert recorded['rewards'].dtype == np.float64
+        np.testing.assert_array_equal(recorded['rewards'], episode['rewards'])
+
+    observations = np.concatenate([episode['observations'][:-1] for episode in episodes])
+    next_observations = np.concatenate([episode['observations'][1:] for episode in episodes])
+    actions = np.concatenate([episode['actions'] for episode in episodes])
+    rewards = np.concatenate([episode['rewards'] for episode in episodes])
+    dones = np.concatenate([np.arange(len(episode['actions'])) == len(episode['actions']) - 1
+                            for episode in episodes])
+    # Read the transitions out of order, across chunks and across the recordings that were appended.
+    indices = np.random.RandomState(0).permutation(reader.n_steps)
+    transitions = reader.get_transitions(indices)
+
+    for recorded, expected in zip(transitions, [observations, actions, rewards, next_observations, dones]):
+        np.testing.assert_array_equal(recorded, expected[indices])
+
+
+@pytest.mark.parametrize('run', [run_single, run_batched])
+def test_recordings_read_back_and_can_be_appended_to(run, tmp_path):
+    path = str(tmp_path / 'trajectories')
+    episodes = run(path, seed=0)
+    assert_recorded(path, episodes)
+
+    # Opening the recording again adds new chunks after the existing ones.
+    episodes += run(path, seed=1)
+    assert_recorded(path, episodes)
+
+
+def test_recordings_of_different_patterns_cannot_be_mixed(tmp_path):
+    path = str(tmp_path / 'trajectories')
+    run_single(path, seed=0, n_steps=10)
+
+    with pytest.raises(ValueError):
+        TrajectoryRecorder(WritingEnvironment(get_pattern_set('3x3')), path)
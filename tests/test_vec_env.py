@@ -0,0 +1,96 @@
+"""Tests that the batched environment behaves exactly like a batch of single environments."""
+import numpy as np
+import pytest
+
+from learning2write.env import WritingEnvironment, QUIT, OUT_OF_BOUNDS_PENALTY
+from learning2write.patterns import PatternSet, get_pattern_set
+from learning2write.vec_env import BatchedWritingEnvironment
+
+from conftest import RandomPatterns
+
+
+class PatternQueue(PatternSet):
+    """Hands out the patterns of another pattern set in an order fixed by a seed.
+
+    Two queues with the same seed give the same patterns to environments that are reset in the same order, no matter
+    whether the patterns are sampled one at a time or in batches.
+    """
+
+    name = 'queue'
+
+    def __init__(self, pattern_set: PatternSet, seed: int, size=100000):
+        self.height, self.width = pattern_set.height, pattern_set.width
+        self.patterns = pattern_set.patterns
+        self.order = np.random.RandomState(seed).randint(len(self.patterns), size=size)
+        self.next = 0
+        super().__init__()
+
+    def sample(self) -> np.ndarray:
+        return self.sample_batch(1)[0]
+
+    def sample_batch(self, n: int) -> np.ndarray:
+        self.next += n
+
+        return self.patterns[self.order[self.next - n:self.next]]
+
+
+def get_patterns(shape):
+    return get_pattern_set('%dx%d' % shape) if shape in {(3, 3), (5, 5)} else RandomPatterns(*shape)
+
+
+def choose_actions(env: BatchedWritingEnvironment, rng: np.random.RandomState) -> np.ndarray:
+    """Choose random actions that mostly stay on the grid, so that episodes last long enough to hit the step limit."""
+    if env.stroke_actions is None:
+        # Mostly moves away from the top-left corner and fills.
+        return rng.choice(WritingEnvironment.N_DISCRETE_ACTIONS, size=env.num_envs,
+                          p=[0.1, 0.2, 0.1, 0.2, 0.35, 0.05])
+
+    # Mostly strokes that stay on the grid, chosen from the actions that are not masked out.
+    masks = env.action_masks | (rng.random_sample(env.num_envs) < 0.1)[:, np.newaxis]
+
+    return np.array([rng.choice(np.flatnonzero(mask)) for mask in masks])
+
+
+@pytest.mark.parametrize('action_mode', ['cells', 'strokes'])
+@pytest.mark.parametrize('shape', [(3, 3), (5, 5), (28, 28)])
+def test_batched_environment_matches_single_environments(shape, action_mode):
+    n_envs, max_steps = 16, 15
+    patterns = get_patterns(shape)
+    batched = BatchedWritingEnvironment(n_envs, PatternQueue(patterns, seed=0), max_steps=max_steps,
+                                        action_mode=action_mode)
+    # The single environments share a queue and are reset in order, same as the batched environment resets them.
+    single_patterns = PatternQueue(patterns, seed=0)
+    singles = [WritingEnvironment(single_patterns, max_steps=max_steps, action_mode=action_mode) for _ in range(n_envs)]
+    quit_action = batched.stroke_actions.quit_action if batched.stroke_actions else QUIT
+    rng = np.random.RandomState(0)
+    n_quits = n_out_of_bounds = n_timeouts = 0
+
+    observations = batched.reset()
+    np.testing.assert_array_equal(observations, [env.reset() for env in singles])
+
+    for _ in range(500):
+        actions = choose_actions(batched, rng)
+        observations, rewards, dones, infos = batched.step(actions)
+
+        for i, env in enumerate(singles):
+            observation, reward, done, _ = env.step(actions[i])
+
+            assert reward == rewards[i]
+            assert done == dones[i]
+
+            if done:
+                np.testing.assert_array_equal(infos[i]['terminal_observation'], observation)
+                n_quits += actions[i] == quit_action
+                n_out_of_bounds += reward == OUT_OF_BOUNDS_PENALTY
+                n_timeouts += actions[i] != quit_action and reward != OUT_OF_BOUNDS_PENALTY
+                observation = env.reset()
+            else:
+                assert 'terminal_observation' not in infos[i]
+
+            np.testing.assert_array_equal(observations[i], observation)
+            np.testing.assert_array_equal(batched.patterns[i], env.pattern)
+            np.testing.assert_array_equal(batched.reference_patterns[i], env.reference_pattern)
+            np.testing.assert_array_equal(batched.agent_positions[i], env.agent_position)
+            assert batched.steps[i] == env.steps
+
+    assert n_quits > 0 and n_out_of_bounds > 0 and n_timeouts > 0
@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from typing import Optional, Type, Tuple
+from typing import Callable, Dict, List, Optional, Type, Tuple, Union
 
 import numpy as np
 import plac
@@ -8,28 +8,66 @@ import tensorflow as tf
 from stable_baselines import ACKTR, PPO2, ACER
 from stable_baselines.a2c.utils import conv, conv_to_fc, linear
 from stable_baselines.common import ActorCriticRLModel
+from stable_baselines.common.distributions import CategoricalProbabilityDistribution
 from stable_baselines.common.policies import FeedForwardPolicy, MlpPolicy, CnnPolicy
-from stable_baselines.common.vec_env import SubprocVecEnv
+from stable_baselines.common.vec_env import SubprocVecEnv, VecEnv
 
 from learning2write import WritingEnvironment, get_pattern_set, EMNIST_PATTERN_SETS, VALID_PATTERN_SETS
+from learning2write.autotune import autotune
+from learning2write.checkpoints import Checkpoint, CheckpointWriter, RetentionPolicy, Snapshot, read_index, \
+    snapshot, write_index
+from learning2write.env import ACTION_MODES, FILL_SQUARE, get_action_mode, get_default_max_steps, get_position_masks
+from learning2write.evaluation import AsyncEvaluator
+from learning2write.inference import MASKED_LOGIT
 from learning2write.patterns import PatternSet
+from learning2write.shared import SharedPatternStore
+from learning2write.strokes import StrokeActions
+from learning2write.trajectories import TrajectoryRecorder, VecTrajectoryRecorder
+from learning2write.vec_env import BatchedWritingEnvironment, seed_vec_env
 
 
 class CheckpointHandler:
-    """Callback that handles saving training progress."""
+    """Callback that handles saving training progress.
 
-    def __init__(self, interval, checkpoint_path='checkpoints'):
+    Checkpoints are written in the background (see `learning2write.checkpoints`), so training only pauses for as long
+    as it takes to copy the model's parameters. Call `close()` at the end of training to wait for the last checkpoint.
+    """
+
+    def __init__(self, interval, checkpoint_path='checkpoints', retention_policy: Optional[RetentionPolicy] = None):
         """Create a new checkpoint callback.
 
         :param interval: How often (in updates) to save the model during training.
-        :param checkpoint_path: Where to save the checkpoint data. This directory is created if it does not exist.
+        :param checkpoint_path: Where to save the checkpoint data. This directory is created if it does not exist. If it
+                                already has checkpoints (i.e. training is being resumed from the latest one) then the
+                                checkpoints carry on from there.
+        :param retention_policy: Which of the periodic checkpoints to keep. By default every checkpoint is kept.
         """
         self._updates = 0
         self.interval = interval
         self.checkpoint_path = checkpoint_path
+        self.retention_policy = retention_policy if retention_policy else RetentionPolicy()
+        self.writer = CheckpointWriter()
+        # The periodic checkpoints that have been written and not yet removed by the retention policy.
+        self.checkpoints: List[Checkpoint] = read_index(checkpoint_path)
+        self._n_checkpoints = 0
+        # Saved models do not remember how many timesteps they were trained for, so this is added to the model's count.
+        self._timesteps_offset = 0
+
+        if self.checkpoints:
+            # Carry on from the latest checkpoint (i.e. training is being resumed from it), rather than overwriting
+            # the earlier checkpoints.
+            latest = self.checkpoints[-1]
+            self._updates = latest.updates + 1
+            self._n_checkpoints = latest.index + 1
+            self._timesteps_offset = latest.timesteps
 
         os.makedirs(self.checkpoint_path, exist_ok=True)
 
+    @property
+    def updates(self) -> int:
+        """The number of updates so far, including those before training was resumed."""
+        return self._updates
+
     def __call__(self, locals_: dict, globals_: dict, *args, **kwargs):
         """Save a checkpoint if the time is right ;)
 
@@ -44,17 +82,176 @@ class CheckpointHandler:
 
         return True
 
-    def save_model(self, model: ActorCriticRLModel, checkpoint_name=None):
-        """Save a checkpoint.
+    def save_model(self, model: ActorCriticRLModel, checkpoint_name=None, metric: Optional[float] = None):
+        """Save a checkpoint in the background.
+
+        If the previous checkpoint is still being written then this waits for it to finish first.
 
         :param model: The model to save.
         :param checkpoint_name: The name to save the checkpoint under. If None a name is automatically generated based
-                                on the number of updates.
+                                on the number of updates, and the checkpoint is subject to the retention policy.
+        :param metric: How well the model is doing (e.g. its evaluation accuracy), for the retention policy.
+        """
+        is_periodic = checkpoint_name is None
+        checkpoint_name = checkpoint_name if checkpoint_name else 'checkpoint_%05d' % self._updates
+        checkpoint = self._write(snapshot(model), checkpoint_name)
+
+        if is_periodic:
+            self.checkpoints.append(Checkpoint(checkpoint, self._n_checkpoints, self._updates,
+                                               self._timesteps_offset + model.num_timesteps, metric))
+            self._n_checkpoints += 1
+
+    def save_snapshot(self, model_snapshot: Snapshot, checkpoint_name: str):
+        """Save a snapshot of a model that was taken earlier (e.g. the best model so far) in the background.
+
+        :param model_snapshot: The snapshot, see `learning2write.checkpoints.snapshot()`.
+        :param checkpoint_name: The name to save the checkpoint under.
+        """
+        self._write(model_snapshot, checkpoint_name)
+
+    def set_metric(self, updates: int, metric: float):
+        """Record how well the model was doing at the time of a periodic checkpoint, for the retention policy.
+
+        :param updates: The number of updates when the checkpoint was saved. Nothing is recorded if there is no
+                        periodic checkpoint from then, e.g. if it has already been removed.
+        :param metric: How well the model was doing, e.g. its evaluation accuracy.
         """
-        checkpoint = os.path.join(self.checkpoint_path,
-                                  checkpoint_name if checkpoint_name else 'checkpoint_%05d' % self._updates)
-        print('[%s] Saving checkpoint \'%s.pkl\'...' % (datetime.now(), checkpoint))
-        model.save(checkpoint)
+        self.checkpoints = [checkpoint._replace(metric=metric) if checkpoint.updates == updates else checkpoint
+                            for checkpoint in self.checkpoints]
+
+    def close(self):
+        """Wait for the last checkpoint to be written."""
+        self.writer.wait()
+        self._apply_retention_policy()
+
+    def _write(self, model_snapshot: Snapshot, checkpoint_name: str) -> str:
+        """Start writing a snapshot, once the previous checkpoint has been written.
+
+        :return: The path of the checkpoint.
+        """
+        checkpoint = os.path.join(self.checkpoint_path, '%s.pkl' % checkpoint_name)
+        print('[%s] Saving checkpoint \'%s\'...' % (datetime.now(), checkpoint))
+
+        # Only apply the retention policy to checkpoints that have finished being written.
+        self.writer.wait()
+        self._apply_retention_policy()
+        self.writer.write(model_snapshot, checkpoint)
+
+        return checkpoint
+
+    def _apply_retention_policy(self):
+        """Remove the periodic checkpoints that the retention policy does not keep."""
+        keep = self.retention_policy.select(self.checkpoints)
+
+        for checkpoint in self.checkpoints:
+            if checkpoint.path not in keep and os.path.exists(checkpoint.path):
+                os.remove(checkpoint.path)
+
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint.path in keep]
+        write_index(self.checkpoint_path, self.checkpoints)
+
+
+class EvaluationHandler:
+    """Callback that evaluates the model every so often during training, without pausing training.
+
+    A snapshot of the model is handed to an `AsyncEvaluator`, which evaluates it in another process. Results are
+    picked up by later calls, logged to TensorBoard, and given to the checkpoint handler (if any) so that it can keep
+    the best checkpoints and save the best model so far as 'checkpoint_best'. Call `close()` at the end of training to
+    wait for the last evaluation.
+    """
+
+    def __init__(self, interval, evaluator: AsyncEvaluator, checkpointer: Optional[CheckpointHandler] = None):
+        """Create a new evaluation callback.
+
+        :param interval: How often (in updates) to evaluate the model during training. If an evaluation is still
+                         running when the next one is due then the next one is skipped.
+        :param evaluator: The evaluator to evaluate the model with.
+        :param checkpointer: The checkpoint handler to save the best model with. For the retention policy to make use
+                             of the evaluations, `interval` should be a multiple of the checkpoint interval.
+        """
+        self._updates = checkpointer.updates if checkpointer else 0
+        self.interval = interval
+        self.evaluator = evaluator
+        self.checkpointer = checkpointer
+        self.best_summary: Optional[dict] = None
+        # The snapshots that are being evaluated, by number of updates.
+        self._snapshots: Dict[int, Snapshot] = {}
+        self._writer: Optional[tf.summary.FileWriter] = None
+
+    def __call__(self, locals_: dict, globals_: dict, *args, **kwargs):
+        """Log the results of finished evaluations and start an evaluation if the time is right.
+
+        :param locals_: A dict of local variables. This should be the local variables of the model's learn function.
+        :param globals_: A dict of global variables that are available to the model.
+        :return: True to indicate training should continue.
+        """
+        self._writer = locals_.get('writer')
+        self._handle_results(self.evaluator.poll())
+
+        if self._updates % self.interval == 0:
+            model = locals_['self']
+
+            if self.evaluator.is_busy:
+                print('[%s] Skipping evaluation at update %d, the previous one is still running.'
+                      % (datetime.now(), self._updates))
+            else:
+                self._snapshots[self._updates] = snapshot(model)
+                self.evaluator.submit((self._updates, model.num_timesteps), self._snapshots[self._updates])
+
+        self._updates += 1
+
+        return True
+
+    def close(self):
+        """Wait for the last evaluation and stop the evaluator."""
+        # Training has finished, so its TensorBoard writer has been closed.
+        self._writer = None
+        self._handle_results(self.evaluator.close())
+
+    def _handle_results(self, results: List[Tuple[Tuple[int, int], dict]]):
+        """Log the results of evaluations, and save the model if it is the best so far."""
+        for (updates, timesteps), summary in results:
+            model_snapshot = self._snapshots.pop(updates)
+            print('[%s] Evaluation at update %d (%d steps) - Accuracy: %.4f - Mean F1: %.4f - Return: %.2f'
+                  % (datetime.now(), updates, timesteps, summary['accuracy'], summary['f1'],
+                     summary['return']['mean']))
+
+            if self._writer is not None:
+                self._writer.add_summary(tf.Summary(value=[
+                    tf.Summary.Value(tag='evaluation/accuracy', simple_value=summary['accuracy']),
+                    tf.Summary.Value(tag='evaluation/f1', simple_value=summary['f1']),
+                    tf.Summary.Value(tag='evaluation/return', simple_value=summary['return']['mean'])
+                ]), timesteps)
+
+            if self.checkpointer:
+                self.checkpointer.set_metric(updates, summary['accuracy'])
+
+            # Prefer the more accurate model, and use the F1 score to break ties (e.g. while the accuracy is still 0).
+            if self.best_summary is None or ((summary['accuracy'], summary['f1']) >
+                                             (self.best_summary['accuracy'], self.best_summary['f1'])):
+                self.best_summary = summary
+
+                if self.checkpointer:
+                    self.checkpointer.save_snapshot(model_snapshot, 'checkpoint_best')
+
+
+def get_callback(*callbacks: Optional[Callable]) -> Optional[Callable]:
+    """Combine several callbacks into one, for a model's `learn` function.
+
+    :param callbacks: The callbacks. Callbacks that are None are left out.
+    :return: A callback that calls every callback in turn, and returns False to stop training if any of them do. None
+             if there are no callbacks.
+    """
+    callbacks = [callback for callback in callbacks if callback]
+
+    if not callbacks:
+        return None
+
+    def callback_(locals_: dict, globals_: dict):
+        # Each callback is called even if an earlier one wants to stop training.
+        return all([callback(locals_, globals_) is not False for callback in callbacks])
+
+    return callback_
 
 
 class MlpPolicy5x5(FeedForwardPolicy):
@@ -73,32 +270,140 @@ class MlpPolicyEmnist(FeedForwardPolicy):
                          **kwargs)
 
 
-def get_env(n_workers: int, pattern_set: PatternSet) -> SubprocVecEnv:
+def get_action_mask_tensor(observations: tf.Tensor, n_actions: int) -> tf.Tensor:
+    """Find which actions are worth taking in a batch of observations, the same as
+    `learning2write.env.get_action_masks()`.
+
+    :param observations: The (processed) observations with the shape (batch, height, width, 3).
+    :param n_actions: The number of actions, which tells the action mode apart.
+    :return: A boolean tensor with the shape (batch, n_actions) that is True for the actions that are allowed.
+    """
+    pattern_shape = tuple(observations.shape.as_list()[1:3])
+    n_cells = pattern_shape[0] * pattern_shape[1]
+    stroke_actions = StrokeActions(pattern_shape) if get_action_mode(pattern_shape, n_actions) == 'strokes' else None
+    fill_action = stroke_actions.dot_action if stroke_actions else FILL_SQUARE
+
+    # Apart from filling a cell, whether an action is allowed only depends on the agent's position, so look it up in a
+    # table of the allowed actions from each cell of an empty grid.
+    position_masks = get_position_masks(pattern_shape, stroke_actions)
+    position = tf.reshape(observations[..., 2], [-1, n_cells])
+    pattern = tf.reshape(observations[..., 0], [-1, n_cells])
+    masks = tf.matmul(position, tf.constant(position_masks, dtype=position.dtype)) > 0.5
+    can_fill = tf.reduce_sum(position * (1 - pattern), axis=1, keepdims=True) > 0.5
+
+    return tf.logical_and(masks, tf.logical_or(can_fill, tf.constant(np.arange(n_actions) != fill_action)))
+
+
+class ActionMaskMixin:
+    """Mixin for policies that never choose the actions that are masked out by `get_action_mask_tensor()`, such as
+    moving off the grid.
+
+    The logits of the masked actions are replaced with `MASKED_LOGIT`, so they have (practically) zero probability.
+    This has to come before the policy class in the base classes.
+    """
+
+    def __init__(self, *args, mask_actions=True, **kwargs):
+        """Create the policy.
+
+        :param mask_actions: Whether to mask the actions. This is passed in the model's `policy_kwargs` so that it is
+                             saved with the model, see `learning2write.inference.export_policy()`.
+        """
+        super().__init__(*args, **kwargs)
+
+        if mask_actions:
+            masks = get_action_mask_tensor(self.processed_obs, self.ac_space.n)
+            self._policy = tf.where(masks, self._policy, tf.fill(tf.shape(self._policy), MASKED_LOGIT))
+            self._proba_distribution = CategoricalProbabilityDistribution(self._policy)
+            # Rebuild the sampling and probability ops from the masked logits.
+            self._setup_init()
+
+
+class MaskedMlpPolicy(ActionMaskMixin, MlpPolicy):
+    pass
+
+
+class MaskedMlpPolicy5x5(ActionMaskMixin, MlpPolicy5x5):
+    pass
+
+
+class MaskedMlpPolicyEmnist(ActionMaskMixin, MlpPolicyEmnist):
+    pass
+
+
+class MaskedCnnPolicy(ActionMaskMixin, CnnPolicy):
+    pass
+
+
+MASKED_POLICIES = {MlpPolicy: MaskedMlpPolicy, MlpPolicy5x5: MaskedMlpPolicy5x5, MlpPolicyEmnist: MaskedMlpPolicyEmnist,
+                   CnnPolicy: MaskedCnnPolicy}
+
+
+def get_max_steps(pattern_set: PatternSet, action_mode='cells') -> int:
+    """Get the maximum number of steps per episode, see `learning2write.env.get_default_max_steps()`."""
+    return get_default_max_steps((pattern_set.height, pattern_set.width), action_mode)
+
+
+def parse_n_workers(string: str) -> Union[int, str]:
+    """Parse the number of workers, which is either a number or 'auto'."""
+    return string if string == 'auto' else int(string)
+
+
+def get_env(n_workers: int, pattern_set: PatternSet, vec_env_type='subproc',
+            record_path: Optional[str] = None, action_mode='cells') -> VecEnv:
     """Create a vectorised writing environment.
 
     :param n_workers: The number of instances of the environment to run in parallel.
     :param pattern_set: The pattern set to be used in the environment.
+    :param vec_env_type: How to vectorise the environment. Either 'subproc' to run each instance of the environment in
+                         its own process, or 'batched' to step all of the instances together in this process.
+    :param record_path: The directory to record the episodes to, see `learning2write.trajectories`. By default the
+                        episodes are not recorded.
+    :param action_mode: Either 'cells' or 'strokes', see `learning2write.env.WritingEnvironment`.
     :return: The environment instance.
     """
-    # Give the agent at most just enough moves to cover the grid world exactly.
-    max_steps = 2 * pattern_set.width * pattern_set.height
-
-    return SubprocVecEnv([lambda: WritingEnvironment(pattern_set, max_steps=max_steps) for _ in range(n_workers)])
+    max_steps = get_max_steps(pattern_set, action_mode)
+
+    if vec_env_type == 'subproc':
+        def make_env(worker: int):
+            # Each worker has its own copy of the pattern set. Those that read the patterns in order (EMNIST) start
+            # from different parts of the dataset, so that the workers do not all read the same patterns.
+            shared_pattern_set.set_part(worker, n_workers)
+            env = WritingEnvironment(shared_pattern_set, max_steps=max_steps, action_mode=action_mode)
+
+            # Each worker records to its own directory, since only it sees the last observation of its episodes.
+            return TrajectoryRecorder(env, os.path.join(record_path, 'worker%d' % worker)) if record_path else env
+
+        # Share one copy of the patterns between the workers rather than giving each worker its own copy.
+        with SharedPatternStore(pattern_set) as pattern_store:
+            shared_pattern_set = pattern_store.patterns
+            env = SubprocVecEnv([lambda worker=worker: make_env(worker) for worker in range(n_workers)])
+            # Wait for every worker to create its environment (and so map the shared patterns) before the store is
+            # closed. The shared memory is freed once the workers exit.
+            env.get_attr('max_steps')
+
+        return env
+    elif vec_env_type == 'batched':
+        env = BatchedWritingEnvironment(n_workers, pattern_set, max_steps=max_steps, action_mode=action_mode)
+
+        return VecTrajectoryRecorder(env, record_path) if record_path else env
+    else:
+        raise ValueError('Unrecognised vectorised environment type \'%s\'' % vec_env_type)
 
 
-def get_model(env: SubprocVecEnv, model_path: Optional[str], model_type: str, pattern_set: PatternSet,
+def get_model(env: VecEnv, model_path: Optional[str], model_type: str, pattern_set: PatternSet,
               policy_type: str, er_buffer_size=1000000,
-              tensorboard_log_path: Optional[str] = None) -> ActorCriticRLModel:
+              tensorboard_log_path: Optional[str] = None, mask_actions=False) -> ActorCriticRLModel:
     """Create the RL agent model, optionally loaded from a previously trained model.
 
-    :param env: The vectorised gym environment (see stable_baselines.common.vec_env.SubprocVecEnv) to use with
-                the model.
+    :param env: The vectorised gym environment (see stable_baselines.common.vec_env.VecEnv) to use with the model.
     :param model_path: The path to a saved model. If None a new model is created.
     :param model_type: The name of the type of model to use.
     :param pattern_set: The pattern set that the model will be trained on.
     :param policy_type: The name of the type of policy to use for the model.
     :param er_buffer_size: The size of the experience replay buffer to use with ACER models.
     :param tensorboard_log_path: The path to log training for use with Tensorboard.
+    :param mask_actions: Whether the policy should mask out pointless actions, see `ActionMaskMixin`. This is ignored
+                         if loading a model.
     :return: The instance of the RL agent.
     """
     if model_path:
@@ -111,17 +416,19 @@ def get_model(env: SubprocVecEnv, model_path: Optional[str], model_type: str, pa
 
         model.setup_model()
     else:
-        policy, policy_kwargs = get_policy(policy_type, pattern_set)
+        policy, policy_kwargs = get_policy(policy_type, pattern_set, mask_actions)
         model = get_model_type(model_type)(policy, env, verbose=1, tensorboard_log=tensorboard_log_path,
                                            policy_kwargs=policy_kwargs)
     return model
 
 
-def get_policy(policy_type: str, pattern_set: PatternSet) -> Tuple[Type[FeedForwardPolicy], dict]:
+def get_policy(policy_type: str, pattern_set: PatternSet,
+               mask_actions=False) -> Tuple[Type[FeedForwardPolicy], dict]:
     """Translate a policy type from a string to a class type.
 
     :param policy_type: The name of the type of policy.
     :param pattern_set: The pattern set that the model will be trained on.
+    :param mask_actions: Whether to use the variant of the policy that masks out pointless actions.
     :return: The class corresponding to the name and the relevant kwargs dictionary.
              Raises ValueError if the name is not recognised.
     """
@@ -147,6 +454,11 @@ def get_policy(policy_type: str, pattern_set: PatternSet) -> Tuple[Type[FeedForw
         policy_kwargs = {'cnn_extractor': cnn_feature_extractor}
     else:
         raise 'Unrecognised policy type \'%s\'' % policy_type
+
+    if mask_actions:
+        policy = MASKED_POLICIES[policy]
+        policy_kwargs['mask_actions'] = True
+
     return policy, policy_kwargs
 
 
@@ -200,7 +512,8 @@ def emnist_cnn_feature_extractor(scaled_images, **kwargs):
 
 
 def get_checkpointer(checkpoint_frequency: int, checkpoint_path: Optional[str], model: ActorCriticRLModel,
-                     policy_type: str, pattern_set: str) -> Optional[CheckpointHandler]:
+                     policy_type: str, pattern_set: str,
+                     retention_policy: Optional[RetentionPolicy] = None) -> Optional[CheckpointHandler]:
     """Create a CheckpointHandler based on certain parameters.
 
     :param checkpoint_frequency: How often to save checkpoints. Checkpoints are disabled if this is less than one.
@@ -208,6 +521,7 @@ def get_checkpointer(checkpoint_frequency: int, checkpoint_path: Optional[str],
     :param model: The model to save training progress for.
     :param policy_type: The name of the type of policy to use for the model.
     :param pattern_set: The name of the set of patterns that the model will be trained on.
+    :param retention_policy: Which checkpoints to keep. By default every checkpoint is kept.
     :return: A CheckpointHandler if `checkpoint_checkpoint_frequency` > 0, None otherwise.
     """
     if checkpoint_frequency > 0:
@@ -216,7 +530,7 @@ def get_checkpointer(checkpoint_frequency: int, checkpoint_path: Optional[str],
                                                                                      policy_type,
                                                                                      pattern_set,
                                                                                      timestamp)
-        checkpointer = CheckpointHandler(checkpoint_frequency, path)
+        checkpointer = CheckpointHandler(checkpoint_frequency, path, retention_policy)
     else:
         checkpointer = None
     return checkpointer
@@ -227,9 +541,18 @@ def get_checkpointer(checkpoint_frequency: int, checkpoint_path: Optional[str],
                                 choices=VALID_PATTERN_SETS,
                                 kind='option', type=str),
     rotate_patterns=plac.Annotation('Flag indicating that patterns should be randomly rotated.', kind='flag'),
+    flip_patterns=plac.Annotation('Flag indicating that patterns should be randomly flipped.', kind='flag'),
+    materialize_augmentations=plac.Annotation('Flag indicating that the distinct rotations and/or flips of the 3x3 and '
+                                              '5x5 patterns should be precomputed and sampled uniformly.',
+                                              kind='flag'),
+    packed_patterns=plac.Annotation('Flag indicating that patterns should be stored as packed bits, which takes an '
+                                    'eighth of the memory.', kind='flag'),
     emnist_batch_size=plac.Annotation('If using an EMNIST-based pattern set, how many images that should be loaded and '
                                       'kept in memory at once.',
                                       kind='option', type=int),
+    emnist_prefetch=plac.Annotation('If using an EMNIST-based pattern set, how many batches of images to load in the '
+                                    'background. Each worker of a subproc environment prefetches its own batches.',
+                                    kind='option', type=int),
     model_type=plac.Annotation('The type of model to use. This is ignored if loading a model.',
                                choices=['acktr', 'acer', 'ppo'],
                                type=str, kind='option'),
@@ -243,38 +566,102 @@ def get_checkpointer(checkpoint_frequency: int, checkpoint_path: Optional[str],
                                 type=str, kind='option'),
     steps=plac.Annotation('How steps to train the model for.',
                           type=int, kind='option'),
-    n_workers=plac.Annotation('How many workers to train with.',
-                              type=int, kind='option'),
+    n_workers=plac.Annotation('How many workers (or environments, if using the batched environment) to train with. '
+                              'Set to \'auto\' to measure which number of workers, and which type of vectorised '
+                              'environment (overriding -vec-env-type), trains fastest on this machine.',
+                              type=parse_n_workers, kind='option'),
+    vec_env_type=plac.Annotation('How to run the environments. Either one process per worker (subproc), or all '
+                                 'environments stepped together in the main process (batched), which is usually '
+                                 'faster for the small pattern sets.',
+                                 choices=['subproc', 'batched'],
+                                 type=str, kind='option'),
     checkpoint_path=plac.Annotation('The directory to save checkpoint data to. '
                                     'Defaults to \'checkpoints/<pattern-set>/\'',
                                     type=str, kind='option'),
     checkpoint_frequency=plac.Annotation('How often (in number of updates, not timesteps) to save the model during '
                                          'training. Set to zero to disable checkpointing.',
                                          type=int, kind='option'),
-
+    keep_last=plac.Annotation('How many of the most recent checkpoints to keep. By default every checkpoint is kept.',
+                              type=int, kind='option'),
+    keep_every=plac.Annotation('Keep every n-th checkpoint (in addition to the most recent ones if -keep-last is set).',
+                               type=int, kind='option'),
+    keep_best=plac.Annotation('How many of the checkpoints with the best evaluation accuracy to keep. Requires '
+                              '-eval-frequency to be a multiple of -checkpoint-frequency.', type=int, kind='option'),
+    eval_frequency=plac.Annotation('How often (in number of updates) to evaluate the model in the background during '
+                                   'training, saving the best model as \'checkpoint_best\'. Set to zero to disable '
+                                   'evaluation.', type=int, kind='option'),
+    eval_episodes=plac.Annotation('How many episodes to run for each evaluation.', type=int, kind='option'),
+    seed=plac.Annotation('The seed for the model and the environments. By default training is not seeded.',
+                         type=int, kind='option'),
+    record_path=plac.Annotation('The directory to record every training episode to, for offline RL and behaviour '
+                                'cloning (see `learning2write.trajectories`). By default episodes are not recorded.',
+                                type=str, kind='option'),
+    mask_actions=plac.Annotation('Flag indicating that the policy should never move off the grid or fill a cell that '
+                                 'is already filled. This is ignored if loading a model.', kind='flag'),
+    action_mode=plac.Annotation('Whether the agent moves and fills one cell per step (cells), or draws a straight line '
+                                'of any length per step (strokes). A loaded model must have been trained with the '
+                                'same action mode.', choices=ACTION_MODES, type=str, kind='option')
 )
-def main(pattern_set='3x3', rotate_patterns=False, emnist_batch_size=512, model_type='acktr', model_path=None,
+def main(pattern_set='3x3', rotate_patterns=False, flip_patterns=False, materialize_augmentations=False,
+         packed_patterns=False, emnist_batch_size=512, emnist_prefetch=0,
+         model_type='acktr', model_path=None,
          er_buffer_size=1000000, policy_type='mlp',
-         steps=1000000, n_workers=4, checkpoint_path=None, checkpoint_frequency=10000):
+         steps=1000000, n_workers=4, vec_env_type='subproc', checkpoint_path=None, checkpoint_frequency=10000,
+         keep_last=None, keep_every=None, keep_best=None, eval_frequency=0, eval_episodes=1000, seed=None,
+         record_path=None, mask_actions=False, action_mode='cells'):
     """Train an A2C-based RL agent on the learning2write environment."""
-    pattern_set_ = get_pattern_set(pattern_set, rotate_patterns, emnist_batch_size)
-
-    env = get_env(n_workers, pattern_set_)
+    if keep_best and not (checkpoint_frequency > 0 and eval_frequency > 0
+                          and eval_frequency % checkpoint_frequency == 0):
+        raise ValueError('-keep-best requires -eval-frequency to be a multiple of -checkpoint-frequency')
+
+    pattern_set_ = get_pattern_set(pattern_set, rotate_patterns, emnist_batch_size, packed_patterns,
+                                   emnist_prefetch, flip_patterns, materialize_augmentations)
+
+    if n_workers == 'auto':
+        print('Measuring how fast training is with each type and number of environments...')
+        best = autotune(lambda env_: get_model(env_, model_path, model_type, pattern_set_, policy_type, er_buffer_size,
+                                               mask_actions=mask_actions),
+                        pattern_set_, get_max_steps(pattern_set_, action_mode), action_mode=action_mode)
+        vec_env_type, n_workers = best.vec_env_type, best.n_envs
+
+    env = get_env(n_workers, pattern_set_, vec_env_type, record_path, action_mode)
+    seed_vec_env(env, seed)
     model = get_model(env, model_path, model_type, pattern_set_, policy_type, er_buffer_size,
-                      tensorboard_log_path='./tensorboard/')
-    checkpointer = get_checkpointer(checkpoint_frequency, checkpoint_path, model, policy_type, pattern_set)
+                      tensorboard_log_path='./tensorboard/', mask_actions=mask_actions)
+    checkpointer = get_checkpointer(checkpoint_frequency, checkpoint_path, model, policy_type, pattern_set,
+                                    RetentionPolicy(keep_last, keep_every, keep_best))
+
+    if eval_frequency > 0:
+        evaluator = AsyncEvaluator(type(model), pattern_set, eval_episodes, seed=seed if seed is not None else 0,
+                                   rotate_patterns=rotate_patterns, flip_patterns=flip_patterns)
+        evaluation_handler = EvaluationHandler(eval_frequency, evaluator, checkpointer)
+    else:
+        evaluation_handler = None
 
     try:
         model.learn(total_timesteps=steps, tb_log_name='%s_%s_%s' % (pattern_set.upper(),
                                                                      model.__class__.__name__.upper(),
                                                                      model.policy.__name__.upper()),
-                    reset_num_timesteps=model_path is None, callback=checkpointer)
-        checkpointer.save_model(model, 'checkpoint_last')
+                    reset_num_timesteps=model_path is None, callback=get_callback(evaluation_handler, checkpointer),
+                    seed=seed)
+
+        if checkpointer:
+            checkpointer.save_model(model, 'checkpoint_last')
     except KeyboardInterrupt:
         # TODO: Make this work properly... Currently a SIGINT causes the workers for ACKTR to
         #  raise BrokenPipeError or EOFError.
         print('Stopping training...')
     finally:
+        # The last evaluation may save a new best checkpoint, so it needs to finish before the checkpoint handler.
+        if evaluation_handler:
+            evaluation_handler.close()
+
+        if checkpointer:
+            checkpointer.close()
+
+        if record_path and vec_env_type == 'subproc':
+            env.env_method('flush')
+
         env.close()
 
 